@@ -5,171 +5,236 @@ from datetime import datetime, date
 
 from . import models
 
+from .ledger import get_position_ledger
+
 from .const import START_DATE
 
+# Importação, exportação, motor vetorizado e instrumentação dependem de pandas
+# e são importados só quando usados
+
 
 class InvestmentManager:
-    def __init__(self, db_file=None, session=None):
+    def __init__(
+        self,
+        db_file=None,
+        session=None,
+        price_provider=None,
+        tax_engine="orm",
+        instrument=False,
+        portfolio_id=1,
+    ):
         self.db_file = db_file
         self.session = session
+        self.price_provider = price_provider
+        # Portfólio usado pelos relatórios e pela importação de notas
+        self.portfolio_id = portfolio_id
+        # "orm" apura o IR pelos modelos; "vectorized" usa o VectorizedTaxEngine
+        self.tax_engine = tax_engine
+
+        # Engine e fábrica de sessões criadas uma única vez por instância; o
+        # pool de conexões do engine é reaproveitado entre as chamadas. O IR
+        # materializado pelos relatórios é confirmado em save_reports, com um
+        # commit que não deve expirar as notas e ativos já carregados
+        self.engine = None
+        self.Session = None
+        if self.db_file != None:
+            self.engine = create_engine(self.db_file)
+            self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+        # Opcional: contagem de consultas e tempos de cada relatório, em
+        # self.instrumentation.get_reports() e após cada tabela impressa
+        self.instrumentation = None
+        if instrument:
+            if self.engine is None and session is None:
+                raise ValueError("instrument=True requer db_file ou session")
+
+            from .instrumentation import Instrumentation
+
+            self.instrumentation = Instrumentation(
+                self.engine if self.engine is not None else session.get_bind()
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_session(self):
+        # A sessão fica aberta entre as chamadas para manter o portfólio e as
+        # notas no identity map; só os métodos que alteram dados fazem commit
+        if self.session is None:
+            self.session = self.Session()
+        return self.session
+
+    def get_portfolio(self, portfolio_id=None):
+        if portfolio_id is None:
+            portfolio_id = self.portfolio_id
+        portfolio = self.get_session().get(models.Portfolio, portfolio_id)
+        if self.instrumentation is not None:
+            self.instrumentation.instrument(portfolio)
+        return portfolio
+
+    def get_tax_engine(self, portfolio):
+        if self.tax_engine == "vectorized":
+            from .vectorized import VectorizedTaxEngine
+
+            return VectorizedTaxEngine(portfolio)
+        return None
+
+    def save_reports(self):
+        # O IR apurado pelos relatórios fica na transação da sessão; é
+        # confirmado aqui só quando a sessão foi criada pelo próprio manager
+        if self.engine is not None and self.session is not None:
+            self.session.commit()
+
+    def close(self):
+        if self.instrumentation is not None:
+            self.instrumentation.disable()
+        if self.engine is None:
+            return
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        self.engine.dispose()
 
     def calculate_pm(
         self, symbol, start_date=START_DATE, end_date=datetime.now().date()
     ):
         symbol = symbol.upper()
-        # Crie uma conexão com o banco de dados
-        if self.db_file != None:
-            engine = create_engine(self.db_file)
-            Session = sessionmaker(bind=engine)
-            session = Session()
-        else:
-            session = self.session
-
-        # Consulta SQLAlchemy para retornar os stocks ordenados pela data do note
-        query = (
-            session.query(models.Stock)
-            .filter(models.Stock.symbol == symbol)
-            .join(models.Stock.brokerage_note)
-            .filter(start_date <= models.BrokerageNote.date)
-            .filter(models.BrokerageNote.date < end_date)
-            .order_by(models.BrokerageNote.date)
+        session = self.get_session()
+
+        # Posição obtida do livro de posições, montado uma única vez por sessão
+        price_average, total_quantity = get_position_ledger(session).get_position(
+            symbol, start_date=start_date, end_date=end_date
         )
 
-        # Execute a consulta e recupere os resultados
-        result = query.all()
-
-        # Variáveis para o cálculo do PM
-        total_quantity = 0
-        price_average = 0
-
-        # Calcula o PM considerando transações de compra e venda
-        for stock in result:
-            quantity = stock.quantity
-            cost = stock.value * (quantity - stock.check_day_trade())
-
-            if (
-                stock.operation == 1
-            ):  # 1 representa uma transação de compra, você pode ajustar conforme sua convenção
-                price_average = (price_average * total_quantity) + (
-                    stock.value * stock.quantity
-                )
-                total_quantity += quantity
-                if total_quantity > 0:
-                    price_average /= total_quantity
-            elif (
-                stock.operation == 2
-            ):  # 2 representa uma transação de venda, você pode ajustar conforme sua convenção
-                total_quantity -= quantity
-                price_average = price_average if total_quantity > 0 else 0
+        return price_average, total_quantity
 
-        if self.db_file != None:
-            session.close()
+    def calculate_positions(self, dates, symbols=None, start_date=START_DATE):
+        # Quantidade e PM de cada ativo (linhas) em cada data de corte
+        # (colunas), como em calculate_pm, com uma única passagem pelos
+        # negócios: resultado["Quantidade"] e resultado["Preço Médio"]
+        import pandas as pd
+
+        dates = list(dates)
+        if symbols is not None:
+            symbols = [symbol.upper() for symbol in symbols]
+        positions = get_position_ledger(self.get_session()).get_positions(
+            dates, start_date=start_date, symbols=symbols
+        )
 
-        return price_average, total_quantity
+        index = pd.Index(list(positions), name="Ticker")
+        quantity = pd.DataFrame(
+            [[position[1] for position in positions[symbol]] for symbol in index],
+            index=index,
+            columns=dates,
+        )
+        price_average = pd.DataFrame(
+            [[position[0] for position in positions[symbol]] for symbol in index],
+            index=index,
+            columns=dates,
+        )
+        return pd.concat(
+            {"Quantidade": quantity, "Preço Médio": price_average}, axis=1
+        )
 
-    def resume(self, year=None):
-        if self.db_file != None:
-            engine = create_engine(self.db_file)
-            Session = sessionmaker(bind=engine)
-            session = Session()
-        else:
-            session = self.session
+    def calculate_holdings(self, start_date=None, end_date=None, business_days=True):
+        # Quantidade e PM de cada ativo do portfólio ao fim de cada dia útil
+        # (ou corrido) do período, em arrays (dias x ativos) ou DataFrames
+        from .holdings import Holdings
 
-        portfolio = session.query(models.Portfolio).get(1)
+        return Holdings.from_portfolio(
+            self.get_portfolio(),
+            start_date=start_date,
+            end_date=end_date,
+            business_days=business_days,
+        )
+
+    def calculate_valuation(
+        self, start_date=None, end_date=None, prices=None, business_days=True
+    ):
+        # Valor de mercado, custo, variação e retorno diários da carteira.
+        # prices: DataFrame (datas x ativos) de fechamentos; sem ele, os
+        # fechamentos vêm da tabela de preços e o que faltar do price_provider
+        from .valuation import Valuation
+
+        valuation = Valuation.from_portfolio(
+            self.get_portfolio(),
+            start_date=start_date,
+            end_date=end_date,
+            price_provider=self.price_provider,
+            prices=prices,
+            business_days=business_days,
+        )
+        # Fechamentos baixados do provedor ficam gravados na tabela de preços
+        self.save_reports()
+        return valuation
+
+    def resume(self, year=None):
+        portfolio = self.get_portfolio()
         if year:
-            portfolio.print_resume(end_date=date(year, 12, 31))
+            portfolio.print_resume(
+                end_date=date(year, 12, 31), price_provider=self.price_provider
+            )
         else:
-            portfolio.print_resume()
+            portfolio.print_resume(price_provider=self.price_provider)
 
-        if self.db_file != None:
-            session.close()
+        self.save_reports()
 
     def ir_table_stock_swing_trade(self, year=None):
-        if self.db_file != None:
-            engine = create_engine(self.db_file)
-            Session = sessionmaker(bind=engine)
-            session = Session()
-        else:
-            session = self.session
-
-        portfolio = session.query(models.Portfolio).get(1)
+        portfolio = self.get_portfolio()
         if year:
             portfolio.print_ir_table_stock(
-                start_date=date(year, 1, 1), end_date=date(year, 12, 31)
+                start_date=date(year, 1, 1),
+                end_date=date(year, 12, 31),
+                tax_engine=self.get_tax_engine(portfolio),
             )
         else:
-            portfolio.print_ir_table_stock()
+            portfolio.print_ir_table_stock(tax_engine=self.get_tax_engine(portfolio))
 
-        if self.db_file != None:
-            session.close()
+        self.save_reports()
 
     def ir_table_stock_day_trade(self, year=None):
-        if self.db_file != None:
-            engine = create_engine(self.db_file)
-            Session = sessionmaker(bind=engine)
-            session = Session()
-        else:
-            session = self.session
-
-        portfolio = session.query(models.Portfolio).get(1)
+        portfolio = self.get_portfolio()
 
         if year:
             portfolio.print_ir_table_stock_day_trade(
-                start_date=date(year, 1, 1), end_date=date(year, 12, 31)
+                start_date=date(year, 1, 1),
+                end_date=date(year, 12, 31),
+                tax_engine=self.get_tax_engine(portfolio),
             )
         else:
-            portfolio.print_ir_table_stock_day_trade()
+            portfolio.print_ir_table_stock_day_trade(
+                tax_engine=self.get_tax_engine(portfolio)
+            )
 
-        if self.db_file != None:
-            session.close()
+        self.save_reports()
 
     def ir_table_fii(self, year=None):
-        if self.db_file != None:
-            engine = create_engine(self.db_file)
-            Session = sessionmaker(bind=engine)
-            session = Session()
-        else:
-            session = self.session
-
-        portfolio = session.query(models.Portfolio).get(1)
+        portfolio = self.get_portfolio()
 
         if year:
             portfolio.print_ir_table_fii(
-                start_date=date(year, 1, 1), end_date=date(year, 12, 31)
+                start_date=date(year, 1, 1),
+                end_date=date(year, 12, 31),
+                tax_engine=self.get_tax_engine(portfolio),
             )
         else:
-            portfolio.print_ir_table_fii()
+            portfolio.print_ir_table_fii(tax_engine=self.get_tax_engine(portfolio))
 
-        if self.db_file != None:
-            session.close()
+        self.save_reports()
 
     def year_diff(self, year=None):
-        if self.db_file != None:
-            engine = create_engine(self.db_file)
-            Session = sessionmaker(bind=engine)
-            session = Session()
-        else:
-            session = self.session
-
-        portfolio = session.query(models.Portfolio).get(1)
+        portfolio = self.get_portfolio()
 
         if year:
             portfolio.print_year_diff(year=year)
         else:
             portfolio.print_year_diff()
 
-        if self.db_file != None:
-            session.close()
-
     def impost(self, year=None):
-        if self.db_file != None:
-            engine = create_engine(self.db_file)
-            Session = sessionmaker(bind=engine)
-            session = Session()
-        else:
-            session = self.session
-
-        portfolio = session.query(models.Portfolio).get(1)
+        portfolio = self.get_portfolio()
 
         if year:
             start_date = date(year, 1, 1)
@@ -179,18 +244,8 @@ class InvestmentManager:
         else:
             portfolio.print_broker_notes_taxas_table()
 
-        if self.db_file != None:
-            session.close()
-
     def brokerage_notes(self, year=None):
-        if self.db_file != None:
-            engine = create_engine(self.db_file)
-            Session = sessionmaker(bind=engine)
-            session = Session()
-        else:
-            session = self.session
-
-        portfolio = session.query(models.Portfolio).get(1)
+        portfolio = self.get_portfolio()
 
         if year:
             start_date = date(year, 1, 1)
@@ -200,73 +255,101 @@ class InvestmentManager:
         else:
             portfolio.print_brokerage_notes_table()
 
-        if self.db_file != None:
-            session.close()
-
     def create_db(self, username="name@gmail.com", name="Name"):
-        engine = create_engine(self.db_file, echo=False)
+        session = self.get_session()
+
+        # Crie as tabelas no banco de dados (ou atualize um banco existente)
+        self.upgrade_db()
+
+        if (
+            session.query(models.User).filter(models.User.username == username).first()
+            is None
+        ):
+            new_user = models.User(username=username, name=name)
+            session.add(new_user)
+            session.commit()
+
+            new_user.add_portfolio()
+            session.commit()
+
+    def upgrade_db(self):
+        # Cria tabelas e índices que ainda não existem, sem tocar nos dados
+        session = self.get_session()
+        bind = session.get_bind()
+        models.Base.metadata.create_all(bind)
+        for table in models.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind, checkfirst=True)
+        # Tabelas dadas como ausentes nesta sessão passam a existir
+        session.info.pop(models.TABLES_KEY, None)
 
-        # Crie as tabelas no banco de dados
-        models.Base.metadata.create_all(engine)
+    def add_brokerage_note(self):
+        portfolio = self.get_portfolio()
 
-        Session = sessionmaker(bind=engine)
-        session = Session()
+        portfolio.create_brokerage_note()
 
-        new_user = models.User(username=username, name=name)
-        session.add(new_user)
-        session.commit()
+        self.get_session().commit()
 
-        user = session.query(models.User).get(1)
+    def import_brokerage_notes(self, path, max_workers=None):
+        from tabulate import tabulate
 
-        user.add_portfolio()
-        session.commit()
+        from .importer import import_brokerage_notes
 
-        if self.db_file != None:
-            session.close()
+        portfolio = self.get_portfolio()
 
-    def add_brokerage_note(self):
-        if self.db_file != None:
-            engine = create_engine(self.db_file)
-            Session = sessionmaker(bind=engine)
-            session = Session()
-        else:
-            session = self.session
+        report = import_brokerage_notes(
+            portfolio, self.get_session(), path, max_workers=max_workers
+        )
 
-        portfolio = session.query(models.Portfolio).get(1)
+        print(tabulate(report, headers="keys", tablefmt="pretty", showindex=False))
+        return report
 
-        portfolio.create_brokerage_note()
+    def add_brokerage_notes(self, notes, batch_size=1000):
+        from .importer import add_brokerage_notes
 
-        session.commit()
-    
-        if self.db_file != None:
-            session.close()
+        portfolio = self.get_portfolio()
 
-    def delete_brokerage_note(self, brokerage_note_number):
-        if self.db_file != None:
-            engine = create_engine(self.db_file)
-            Session = sessionmaker(bind=engine)
-            session = Session()
-        else:
-            session = self.session
+        report = add_brokerage_notes(
+            portfolio, self.get_session(), notes, batch_size=batch_size
+        )
 
-        portfolio = session.query(models.Portfolio).get(1)
+        self.print_import_summary(report)
+        return report
 
-        portfolio.remove_brokerage_note(brokerage_note_number)
+    def load_brokerage_notes(self, filename, batch_size=1000):
+        from .importer import load_brokerage_notes
 
-        session.commit()
+        portfolio = self.get_portfolio()
 
-        if self.db_file != None:
-            session.close()
+        report = load_brokerage_notes(
+            portfolio, self.get_session(), filename, batch_size=batch_size
+        )
 
-    def to_excel(self, filename=None, year=None):
-        if self.db_file != None:
-            engine = create_engine(self.db_file)
-            Session = sessionmaker(bind=engine)
-            session = Session()
-        else:
-            session = self.session
+        self.print_import_summary(report)
+        return report
+
+    def print_import_summary(self, report):
+        from tabulate import tabulate
+
+        # Em cargas grandes, mostra só os registros com erro
+        errors = report[report["Status"] == "Erro"]
+        if len(errors):
+            print(tabulate(errors, headers="keys", tablefmt="pretty", showindex=False))
+        print(
+            "{} notas importadas, {} com erro".format(
+                len(report) - len(errors), len(errors)
+            )
+        )
+
+    def delete_brokerage_note(self, brokerage_note_number):
+        portfolio = self.get_portfolio()
+
+        portfolio.remove_brokerage_note(brokerage_note_number)
 
-        portfolio = session.query(models.Portfolio).get(1)
+        self.get_session().commit()
+
+    def to_excel(self, filename=None, year=None):
+        portfolio = self.get_portfolio()
 
         if not filename:
             if year:
@@ -278,24 +361,44 @@ class InvestmentManager:
             start_date = date(year, 1, 1)
             end_date = date(year, 12, 31)
 
-            portfolio.to_excel(filename, start_date, end_date)
+            portfolio.to_excel(
+                filename,
+                start_date,
+                end_date,
+                price_provider=self.price_provider,
+                tax_engine=self.get_tax_engine(portfolio),
+            )
         else:
-            portfolio.to_excel(filename)
+            portfolio.to_excel(
+                filename,
+                price_provider=self.price_provider,
+                tax_engine=self.get_tax_engine(portfolio),
+            )
+        self.save_reports()
+        return filename
 
-        if self.db_file != None:
-            session.close()
+    def export_brokerage_notes_stocks(self, filename, year=None, chunk_size=5000):
+        # CSV ou Parquet (pela extensão), gravado em blocos
+        from .export import export_brokerage_notes_stocks
 
-    def split(self, symbol, ratio = 1, type = 's'):
-        if self.db_file != None:
-            engine = create_engine(self.db_file)
-            Session = sessionmaker(bind=engine)
-            session = Session()
-        else:
-            session = self.session
+        portfolio = self.get_portfolio()
+
+        if year:
+            return export_brokerage_notes_stocks(
+                portfolio,
+                filename,
+                date(year, 1, 1),
+                date(year, 12, 31),
+                chunk_size=chunk_size,
+            )
+        return export_brokerage_notes_stocks(
+            portfolio, filename, chunk_size=chunk_size
+        )
 
-        portfolio = session.query(models.Portfolio).get(1)
-        portfolio.split(symbol, ratio, type)
+    def split(self, symbol, ratio=1, type="s", date=None):
+        # type: "s" desdobramento, "g" grupamento ou "b" bonificação; date é a
+        # data com do evento (hoje, se omitida)
+        portfolio = self.get_portfolio()
+        portfolio.split(symbol, ratio, type, date)
 
-        session.commit()
-        if self.db_file != None:
-            session.close()
+        self.get_session().commit()
\ No newline at end of file
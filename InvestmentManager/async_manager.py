@@ -0,0 +1,233 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
+
+from .InvestmentManager import InvestmentManager
+
+from .const import *
+
+
+class AsyncInvestmentManager:
+    # As operações do InvestmentManager como corrotinas, para uso em um loop
+    # de eventos. A sessão do SQLAlchemy não é thread-safe, então todo acesso
+    # ao banco roda, na ordem das chamadas, em um executor dedicado de uma
+    # única thread; o loop nunca bloqueia em I/O de banco, rede ou PDF.
+    # Os relatórios devolvem DataFrames em vez de imprimir tabelas
+    def __init__(
+        self,
+        db_file=None,
+        session=None,
+        price_provider=None,
+        tax_engine="orm",
+        portfolio_id=1,
+        timeout=None,
+    ):
+        self.investments_manager = InvestmentManager(
+            db_file,
+            session=session,
+            price_provider=price_provider,
+            tax_engine=tax_engine,
+            portfolio_id=portfolio_id,
+        )
+        # Tempo máximo, em segundos, de cada chamada (None: sem limite)
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="InvestmentManager"
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def run(self, function, *args, timeout=None, **kwargs):
+        # Executa function no executor do banco. Uma chamada cancelada (ou que
+        # estoure o timeout) enquanto ainda está na fila não é executada; uma
+        # que já começou vai até o fim em segundo plano, para não deixar a
+        # sessão pela metade, e seu resultado é descartado
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self.executor, functools.partial(function, *args, **kwargs)
+        )
+        if timeout is None:
+            timeout = self.timeout
+        if timeout is None:
+            return await future
+        return await asyncio.wait_for(future, timeout)
+
+    async def close(self):
+        # A sessão é fechada na thread do banco, depois das chamadas na fila.
+        # Só retorna quando a thread termina, inclusive uma chamada que estourou
+        # o timeout e ainda está rodando
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, self.investments_manager.close)
+        finally:
+            await loop.run_in_executor(
+                None, functools.partial(self.executor.shutdown, wait=True)
+            )
+
+    ## Executados no executor do banco
+
+    def get_period(self, portfolio, year):
+        if year:
+            return date(year, 1, 1), date(year, 12, 31)
+        return portfolio.get_first_date(), datetime.now().date()
+
+    def get_ir_table(self, method, year):
+        portfolio = self.investments_manager.get_portfolio()
+        tax_engine = self.investments_manager.get_tax_engine(portfolio)
+        start_date, end_date = self.get_period(portfolio, year)
+        table = getattr(tax_engine or portfolio, method)(start_date, end_date)
+        self.investments_manager.save_reports()
+        return table
+
+    def get_resume(self, year):
+        portfolio = self.investments_manager.get_portfolio()
+        end_date = date(year, 12, 31) if year else datetime.now().date()
+        resume = portfolio.get_resume(
+            end_date=end_date, price_provider=self.investments_manager.price_provider
+        )
+        self.investments_manager.save_reports()
+        return resume
+
+    def get_brokerage_notes_table(self, method, year):
+        portfolio = self.investments_manager.get_portfolio()
+        if year:
+            return getattr(portfolio, method)(date(year, 1, 1), date(year, 12, 31))
+        return getattr(portfolio, method)()
+
+    def get_year_diff(self, year):
+        portfolio = self.investments_manager.get_portfolio()
+        if year:
+            return portfolio.get_year_diff(year=year)
+        return portfolio.get_year_diff()
+
+    def import_notes(self, function, *args, **kwargs):
+        return function(
+            self.investments_manager.get_portfolio(),
+            self.investments_manager.get_session(),
+            *args,
+            **kwargs,
+        )
+
+    ## Consultas
+
+    async def calculate_pm(
+        self, symbol, start_date=START_DATE, end_date=None, timeout=None
+    ):
+        return await self.run(
+            self.investments_manager.calculate_pm,
+            symbol,
+            start_date,
+            end_date or datetime.now().date(),
+            timeout=timeout,
+        )
+
+    async def resume(self, year=None, timeout=None):
+        # As cotações são buscadas em um único lote concorrente pelo provedor
+        return await self.run(self.get_resume, year, timeout=timeout)
+
+    async def ir_table_stock_swing_trade(self, year=None, timeout=None):
+        return await self.run(
+            self.get_ir_table, "get_ir_table_stock", year, timeout=timeout
+        )
+
+    async def ir_table_stock_day_trade(self, year=None, timeout=None):
+        return await self.run(
+            self.get_ir_table, "get_ir_table_stock_day_trade", year, timeout=timeout
+        )
+
+    async def ir_table_fii(self, year=None, timeout=None):
+        return await self.run(
+            self.get_ir_table, "get_ir_table_fii", year, timeout=timeout
+        )
+
+    async def impost(self, year=None, timeout=None):
+        return await self.run(
+            self.get_brokerage_notes_table, "get_brokerage_notes", year, timeout=timeout
+        )
+
+    async def brokerage_notes(self, year=None, timeout=None):
+        return await self.run(
+            self.get_brokerage_notes_table,
+            "get_brokerage_notes_stocks",
+            year,
+            timeout=timeout,
+        )
+
+    async def year_diff(self, year=None, timeout=None):
+        return await self.run(self.get_year_diff, year, timeout=timeout)
+
+    async def to_excel(self, filename=None, year=None, timeout=None):
+        # Devolve o nome do arquivo gravado
+        return await self.run(
+            self.investments_manager.to_excel, filename, year, timeout=timeout
+        )
+
+    ## Alterações
+
+    async def add_brokerage_note(
+        self, number, broker, date, stocks, irrf=0, timeout=None, **fees
+    ):
+        # stocks: [{"symbol", "quantity", "value", "operation"}, ...]; taxas
+        # omitidas valem zero. Devolve o relatório de importação da nota
+        from .importer import add_brokerage_notes
+
+        values = {"number": number, "broker": broker, "date": date, "irrf": irrf}
+        for column in BROKERAGE_NOTE_FEES:
+            values[column] = fees.pop(column, 0)
+        if fees:
+            raise TypeError("taxas desconhecidas: {}".format(", ".join(fees)))
+        values["stocks"] = list(stocks)
+        return await self.run(
+            self.import_notes, add_brokerage_notes, [values], timeout=timeout
+        )
+
+    async def add_brokerage_notes(self, notes, batch_size=1000, timeout=None):
+        from .importer import add_brokerage_notes
+
+        return await self.run(
+            self.import_notes,
+            add_brokerage_notes,
+            notes,
+            batch_size=batch_size,
+            timeout=timeout,
+        )
+
+    async def load_brokerage_notes(self, filename, batch_size=1000, timeout=None):
+        from .importer import load_brokerage_notes
+
+        return await self.run(
+            self.import_notes,
+            load_brokerage_notes,
+            filename,
+            batch_size=batch_size,
+            timeout=timeout,
+        )
+
+    async def import_brokerage_notes(self, path, max_workers=None, timeout=None):
+        # Os PDFs continuam sendo lidos no pool de processos do importador
+        from .importer import import_brokerage_notes
+
+        return await self.run(
+            self.import_notes,
+            import_brokerage_notes,
+            path,
+            max_workers=max_workers,
+            timeout=timeout,
+        )
+
+    async def delete_brokerage_note(self, brokerage_note_number, timeout=None):
+        return await self.run(
+            self.investments_manager.delete_brokerage_note,
+            brokerage_note_number,
+            timeout=timeout,
+        )
+
+    async def split(self, symbol, ratio=1, type="s", date=None, timeout=None):
+        return await self.run(
+            self.investments_manager.split, symbol, ratio, type, date, timeout=timeout
+        )
@@ -0,0 +1,242 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+from .const import START_DATE
+
+BATCH_REPORTS = ["resume", "ir", "excel"]
+
+
+def get_target(target):
+    # Aceita "db", (db, portfolio_id) ou (db, portfolio_id, arquivo.xlsx)
+    if isinstance(target, str):
+        target = (target,)
+    db_file = target[0]
+    portfolio_id = target[1] if len(target) > 1 else 1
+    filename = target[2] if len(target) > 2 else None
+    return db_file, portfolio_id, filename
+
+
+def get_db_path(db_file):
+    return os.path.abspath(db_file.split("///")[-1])
+
+
+def get_target_filename(db_file, portfolio_id, year, unique=False):
+    # unique: acrescenta um hash curto do caminho do banco, para alvos em
+    # diretórios diferentes com o mesmo nome de arquivo
+    name = os.path.splitext(os.path.basename(get_db_path(db_file)))[0]
+    if unique:
+        digest = hashlib.sha1(get_db_path(db_file).encode("utf-8")).hexdigest()
+        name = "{}-{}".format(name, digest[:8])
+    if year:
+        return "{}-{}-{:04d}.xlsx".format(name, portfolio_id, year)
+    return "{}-{}.xlsx".format(name, portfolio_id)
+
+
+def resolve_filenames(targets, year):
+    # (db, portfolio_id, planilha) de cada alvo. Um nome padrão usado por
+    # bancos diferentes recebe o hash do caminho de cada um
+    targets = [get_target(target) for target in targets]
+    paths = {}
+    for db_file, portfolio_id, _ in targets:
+        name = get_target_filename(db_file, portfolio_id, year)
+        paths.setdefault(name, set()).add(get_db_path(db_file))
+
+    resolved = []
+    for db_file, portfolio_id, filename in targets:
+        if filename is None:
+            name = get_target_filename(db_file, portfolio_id, year)
+            filename = get_target_filename(
+                db_file, portfolio_id, year, unique=len(paths[name]) > 1
+            )
+        resolved.append((db_file, portfolio_id, filename))
+    return resolved
+
+
+def new_result(target, error=None):
+    db_file, portfolio_id, _ = get_target(target)
+    return {
+        "db": db_file,
+        "portfolio_id": portfolio_id,
+        "file": None,
+        "error": error,
+        "times": {"total": 0},
+    }
+
+
+def run_target(
+    target,
+    year=None,
+    output_dir=".",
+    reports=BATCH_REPORTS,
+    price_provider=None,
+    tax_engine="orm",
+):
+    # Executado nos processos do pool: nunca propaga exceções. Devolve o
+    # tempo de cada etapa e o arquivo gerado
+    from .InvestmentManager import InvestmentManager
+
+    db_file, portfolio_id, filename = get_target(target)
+    result = new_result(target)
+
+    start_date = date(year, 1, 1) if year else START_DATE
+    end_date = date(year, 12, 31) if year else date.today()
+
+    start = time.perf_counter()
+    try:
+        with InvestmentManager(
+            db_file,
+            price_provider=price_provider,
+            tax_engine=tax_engine,
+            portfolio_id=portfolio_id,
+        ) as investments_manager:
+            portfolio = investments_manager.get_portfolio()
+            if portfolio is None:
+                raise ValueError("portfólio {} não encontrado".format(portfolio_id))
+            tax_engine_object = investments_manager.get_tax_engine(portfolio)
+            ir_source = tax_engine_object or portfolio
+
+            if "resume" in reports:
+                step = time.perf_counter()
+                portfolio.get_resume(
+                    end_date=end_date,
+                    price_provider=investments_manager.price_provider,
+                )
+                investments_manager.save_reports()
+                result["times"]["resume"] = time.perf_counter() - step
+
+            if "ir" in reports:
+                # Grava o IR de cada mês em monthly_tax_summary; a planilha
+                # abaixo reaproveita esses resultados
+                step = time.perf_counter()
+                ir_start_date = start_date if year else portfolio.get_first_date()
+                ir_source.get_ir_table_stock(ir_start_date, end_date)
+                ir_source.get_ir_table_stock_day_trade(ir_start_date, end_date)
+                ir_source.get_ir_table_fii(ir_start_date, end_date)
+                investments_manager.save_reports()
+                result["times"]["ir"] = time.perf_counter() - step
+
+            if "excel" in reports:
+                step = time.perf_counter()
+                filename = os.path.join(
+                    output_dir,
+                    filename or get_target_filename(db_file, portfolio_id, year),
+                )
+                portfolio.to_excel(
+                    filename,
+                    start_date,
+                    end_date,
+                    price_provider=investments_manager.price_provider,
+                    tax_engine=tax_engine_object,
+                )
+                investments_manager.save_reports()
+                result["file"] = filename
+                result["times"]["excel"] = time.perf_counter() - step
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    result["times"]["total"] = time.perf_counter() - start
+    return result
+
+
+def run_batch_reports(
+    targets,
+    year=None,
+    output_dir=".",
+    max_workers=None,
+    reports=BATCH_REPORTS,
+    price_provider=None,
+    tax_engine="orm",
+    verbose=True,
+):
+    # Gera resumo, tabelas de IR e planilha de cada alvo (um banco e um
+    # portfólio) em um pool de no máximo max_workers processos. Com
+    # max_workers=1 tudo roda no processo atual. Devolve um relatório com uma
+    # linha por alvo
+    import pandas as pd
+
+    targets = resolve_filenames(list(targets), year)
+    os.makedirs(output_dir, exist_ok=True)
+    kwargs = {
+        "year": year,
+        "output_dir": output_dir,
+        "reports": reports,
+        "price_provider": price_provider,
+        "tax_engine": tax_engine,
+    }
+
+    results = [None] * len(targets)
+    start = time.perf_counter()
+
+    # Dois alvos com a mesma planilha: o segundo não roda, em vez de
+    # sobrescrever a do primeiro
+    filenames = set()
+    pending = []
+    for i, target in enumerate(targets):
+        if target[2] in filenames:
+            results[i] = new_result(
+                target, "planilha {} já gerada por outro alvo".format(target[2])
+            )
+        else:
+            filenames.add(target[2])
+            pending.append(i)
+
+    def report_progress(done, i):
+        if verbose:
+            result = results[i]
+            print(
+                "[{}/{}] {} #{} {} {:.2f}s".format(
+                    done,
+                    len(targets),
+                    result["db"],
+                    result["portfolio_id"],
+                    "erro: " + result["error"] if result["error"] else "ok",
+                    result["times"]["total"],
+                )
+            )
+
+    if max_workers == 1 or len(pending) <= 1:
+        for done, i in enumerate(pending, start=1):
+            results[i] = run_target(targets[i], **kwargs)
+            report_progress(done, i)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(run_target, targets[i], **kwargs): i for i in pending
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    # Processo do pool encerrado de forma anormal
+                    results[i] = new_result(
+                        targets[i], "{}: {}".format(type(e).__name__, e)
+                    )
+                report_progress(done, i)
+
+    if verbose:
+        errors = sum(1 for result in results if result["error"])
+        print(
+            "{} alvos em {:.2f}s, {} com erro".format(
+                len(targets), time.perf_counter() - start, errors
+            )
+        )
+
+    return pd.DataFrame(
+        [
+            {
+                "Banco": result["db"],
+                "Portfólio": result["portfolio_id"],
+                "Status": "Erro" if result["error"] else "OK",
+                "Arquivo": result["file"],
+                "Resumo (s)": result["times"].get("resume"),
+                "IR (s)": result["times"].get("ir"),
+                "Planilha (s)": result["times"].get("excel"),
+                "Total (s)": result["times"]["total"],
+                "Erro": result["error"] or "",
+            }
+            for result in results
+        ]
+    )
@@ -0,0 +1,98 @@
+import threading
+
+from datetime import date, timedelta
+
+# numpy e holidays só são carregados quando um calendário é montado
+
+
+class BusinessDayCalendar:
+    def __init__(self, start_year, end_year):
+        import numpy as np
+        from holidays import Brazil
+
+        self.start_year = start_year
+        self.end_year = end_year
+        self.first_date = date(start_year, 1, 1)
+
+        # Feriados montados uma única vez para todo o intervalo de anos
+        self.holidays = set(Brazil(years=range(start_year, end_year + 1)).keys())
+
+        # ordinals[i]: quantidade de dias úteis em [first_date, first_date + i]
+        self.business_days = []
+        self.ordinals = []
+        current_date = self.first_date
+        while current_date.year <= end_year:
+            if current_date.weekday() < 5 and current_date not in self.holidays:
+                self.business_days.append(current_date)
+            self.ordinals.append(len(self.business_days))
+            current_date += timedelta(days=1)
+
+        self.business_days_array = np.array(self.business_days, dtype="datetime64[D]")
+        self.ordinals_array = np.array(self.ordinals)
+
+    def covers(self, start_year, end_year):
+        return self.start_year <= start_year and end_year <= self.end_year
+
+    def is_business_day(self, current_date):
+        return current_date.weekday() < 5 and current_date not in self.holidays
+
+    def add_business_days(self, start_date, days_to_add):
+        if days_to_add <= 0:
+            return start_date
+        index = self.ordinals[(start_date - self.first_date).days] + days_to_add - 1
+        return self.business_days[index]
+
+    def add_business_days_array(self, dates, days_to_add):
+        import numpy as np
+
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        if days_to_add <= 0:
+            return dates
+        offsets = (dates - np.datetime64(self.first_date, "D")).astype(int)
+        return self.business_days_array[self.ordinals_array[offsets] + days_to_add - 1]
+
+
+business_day_calendar = None
+business_day_calendar_lock = threading.Lock()
+
+
+def get_business_day_calendar(start_year, end_year):
+    # Reaproveita o calendário enquanto ele cobrir os anos pedidos. Lote,
+    # versão assíncrona e provedores de preço chamam daqui em paralelo: só uma
+    # thread monta um novo calendário, e a troca da referência é atômica
+    global business_day_calendar
+    calendar = business_day_calendar
+    if calendar is not None and calendar.covers(start_year, end_year):
+        return calendar
+
+    with business_day_calendar_lock:
+        calendar = business_day_calendar
+        if calendar is None or not calendar.covers(start_year, end_year):
+            if calendar is not None:
+                start_year = min(start_year, calendar.start_year)
+                end_year = max(end_year, calendar.end_year)
+            calendar = BusinessDayCalendar(start_year, end_year)
+            business_day_calendar = calendar
+    return calendar
+
+
+def add_business_days(start_date, days_to_add):
+    if days_to_add <= 0:
+        return start_date
+    # Um ano tem ao menos 240 dias úteis, então esse intervalo sempre basta
+    return get_business_day_calendar(
+        start_date.year, start_date.year + 1 + days_to_add // 240
+    ).add_business_days(start_date, days_to_add)
+
+
+def add_business_days_array(dates, days_to_add):
+    # Versão vetorizada: recebe uma coluna de datas e devolve datetime64[D]
+    import numpy as np
+
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    if len(dates) == 0 or days_to_add <= 0:
+        return dates
+    years = dates.astype("datetime64[Y]").astype(int) + 1970
+    return get_business_day_calendar(
+        int(years.min()), int(years.max()) + 1 + days_to_add // 240
+    ).add_business_days_array(dates, days_to_add)
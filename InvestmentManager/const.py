@@ -16,4 +16,25 @@ STOCK_SALE = 2
 STOCK_ACAO = 1
 STOCK_FII = 2
 STOCK_BDR = 3
-STOCK_ETF = 4
\ No newline at end of file
+STOCK_ETF = 4
+
+BROKERAGE_NOTE_FEES = [
+    "taxa_liquidacao",
+    "taxa_registro",
+    "taxa_termo_opcoes",
+    "taxa_ana",
+    "emolumentos",
+    "corretagem",
+    "taxa_custodia",
+    "impostos",
+    "outros",
+]
+
+TAX_CATEGORY_STOCK = "stock"
+TAX_CATEGORY_STOCK_DAY_TRADE = "stock_day_trade"
+TAX_CATEGORY_FII = "fii"
+
+# Eventos societários: desdobramento, grupamento e bonificação
+CORPORATE_ACTION_SPLIT = "s"
+CORPORATE_ACTION_GROUPING = "g"
+CORPORATE_ACTION_BONUS = "b"
@@ -0,0 +1,111 @@
+from bisect import bisect_left
+
+from .const import *
+
+
+def get_factor(type, ratio):
+    # Fator aplicado à quantidade; o preço é dividido por ele
+    if type == CORPORATE_ACTION_SPLIT:
+        factor = ratio
+    elif type == CORPORATE_ACTION_BONUS:
+        factor = 1 + ratio
+    else:
+        factor = 1 / ratio
+    # Fatores inteiros mantêm as quantidades inteiras. Os demais (bonificação,
+    # grupamento) podem gerar frações, que não são arredondadas: a posição, o
+    # PM, o IR e a exportação usam a mesma quantidade fracionária, com o custo
+    # total preservado. A venda das frações em leilão não é registrada
+    return int(factor) if float(factor).is_integer() else factor
+
+
+class AdjustmentFactors:
+    # Fatores de ajuste dos eventos societários por (portfólio, ativo). Um
+    # negócio feito até a data do evento (data com) é levado para a base atual
+    # multiplicando a quantidade e dividindo o preço pelo produto dos fatores
+    # dos eventos com data >= data do negócio
+    def __init__(self, actions):
+        # actions: (portfolio_id, symbol, date, factor)
+        self.dates = {}
+        self.factors = {}
+
+        for portfolio_id, symbol, action_date, factor in sorted(
+            actions, key=lambda action: action[2]
+        ):
+            key = (portfolio_id, symbol)
+            self.dates.setdefault(key, []).append(action_date)
+            self.factors.setdefault(key, []).append(factor)
+
+        # factors[key][i]: produto dos fatores dos eventos i em diante
+        for key, factors in self.factors.items():
+            cumulative = [1]
+            for factor in reversed(factors):
+                cumulative.append(cumulative[-1] * factor)
+            self.factors[key] = cumulative[::-1]
+
+    def has_actions(self, portfolio_id=None):
+        if portfolio_id is None:
+            return bool(self.dates)
+        return any(key[0] == portfolio_id for key in self.dates)
+
+    def has_fractional_factors(self, portfolio_id):
+        # Só fatores inteiros garantem quantidades ajustadas inteiras
+        return any(
+            not isinstance(factor, int)
+            for key, factors in self.factors.items()
+            if key[0] == portfolio_id
+            for factor in factors
+        )
+
+    def get_factor(self, portfolio_id, symbol, trade_date):
+        dates = self.dates.get((portfolio_id, symbol))
+        if not dates:
+            return 1
+        return self.factors[(portfolio_id, symbol)][bisect_left(dates, trade_date)]
+
+    def get_factors(self, portfolio_id, symbols, dates):
+        # Versão vetorizada de get_factor para os negócios de um portfólio
+        import numpy as np
+
+        symbols = np.asarray(symbols)
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        factors = np.ones(len(symbols))
+        for (action_portfolio_id, symbol), action_dates in self.dates.items():
+            if action_portfolio_id != portfolio_id:
+                continue
+            mask = symbols == symbol
+            if mask.any():
+                index = np.searchsorted(
+                    np.asarray(action_dates, dtype="datetime64[D]"),
+                    dates[mask],
+                    side="left",
+                )
+                factors[mask] = np.asarray(
+                    self.factors[(portfolio_id, symbol)], dtype=float
+                )[index]
+        return factors
+
+
+def adjust_trades(trades, factors, portfolio_id=None):
+    # Leva as colunas qty e price de um DataFrame de negócios (com symbol e
+    # date) para a base atual. Sem portfolio_id, cada negócio é ajustado pelos
+    # eventos do portfólio da sua coluna portfolio
+    import numpy as np
+
+    if not factors.has_actions(portfolio_id):
+        return
+    if portfolio_id is None:
+        portfolios = trades["portfolio"].to_numpy()
+    else:
+        portfolios = np.full(len(trades), portfolio_id)
+
+    symbols = trades["symbol"].to_numpy()
+    dates = trades["date"].to_numpy()
+    adjustment = np.ones(len(trades))
+    for portfolio_id in np.unique(portfolios).tolist():
+        if factors.has_actions(portfolio_id):
+            rows = portfolios == portfolio_id
+            adjustment[rows] = factors.get_factors(
+                portfolio_id, symbols[rows], dates[rows]
+            )
+    trades["qty"] = trades["qty"] * adjustment
+    trades["price"] = trades["price"] / adjustment
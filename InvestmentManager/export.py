@@ -0,0 +1,221 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+from .const import *
+
+from .functions import add_business_days_array
+
+from .vectorized import add_day_trades
+
+from .corporate_actions import adjust_trades
+
+TRADE_COLUMNS = [
+    "Nota",
+    "Corretora",
+    "Data do Pregão",
+    "Data de Liquidação",
+    "C/V",
+    "Ticker",
+    "Quantidade",
+    "Preço",
+    "Valor da Operação",
+    "Taxas",
+    "Valor Liquido",
+    "I.R.R.F.",
+    "Taxa de Liquidação",
+    "Taxa de Registro",
+    "Taxa Termo/Opções",
+    "Taxa A.N.A.",
+    "Emolumentos",
+    "Corretagem",
+    "Taxa Custódia",
+    "Impostos",
+    "Outros",
+    "Day-trade",
+]
+
+
+def iter_brokerage_notes_stocks(
+    portfolio, start_date=START_DATE, end_date=datetime.now().date(), chunk_size=5000
+):
+    # Mesmas linhas de Portfolio.get_brokerage_notes_stocks, em DataFrames de
+    # ~chunk_size negócios. O rateio de taxas é por nota, então um bloco
+    # nunca divide uma nota
+    session = Session.object_session(portfolio)
+    query = (
+        session.query(
+            models.Stock.id,
+            models.Stock.brokerage_note_id,
+            models.Stock.symbol,
+            models.Stock.operation,
+            models.Stock.quantity,
+            models.Stock.value,
+            models.BrokerageNote.number,
+            models.BrokerageNote.broker,
+            models.BrokerageNote.date,
+            models.BrokerageNote.irrf,
+            *[getattr(models.BrokerageNote, column) for column in BROKERAGE_NOTE_FEES],
+        )
+        .join(models.Stock.brokerage_note)
+        .filter(models.BrokerageNote.portfolio_id == portfolio.id)
+        .filter(start_date <= models.BrokerageNote.date)
+        .filter(models.BrokerageNote.date <= end_date)
+        .order_by(
+            models.BrokerageNote.date,
+            models.BrokerageNote.number,
+            models.BrokerageNote.id,
+            models.Stock.id,
+        )
+        .yield_per(chunk_size)
+    )
+
+    factors = models.CorporateAction.get_adjustment_factors(session)
+
+    rows = []
+    for row in query:
+        if len(rows) >= chunk_size and row[1] != rows[-1][1]:
+            yield get_trade_rows(rows, factors, portfolio.id)
+            rows = []
+        rows.append(row)
+    if rows:
+        yield get_trade_rows(rows, factors, portfolio.id)
+
+
+def get_trade_rows(rows, factors=None, portfolio_id=None):
+    # Rateio das taxas e do IRRF por nota, como em BrokerageNote.get_fees
+    trades = pd.DataFrame(
+        rows,
+        columns=["id", "note", "symbol", "op", "qty", "price", "number", "broker"]
+        + ["date", "irrf"]
+        + BROKERAGE_NOTE_FEES,
+    )
+    if factors is not None:
+        adjust_trades(trades, factors, portfolio_id)
+    add_day_trades(trades)
+
+    note = trades["note"]
+    sale = trades["op"] == STOCK_SALE
+    value = trades["price"] * trades["qty"]
+    value_swing_trade = trades["price"] * (trades["qty"] - trades["day_trade"])
+    value_day_trade = trades["price"] * trades["day_trade"]
+
+    # Totais da nota repetidos em cada linha
+    total_value = value.groupby(note).transform("sum")
+    total_swing_trade = value_swing_trade.where(sale, 0).groupby(note).transform("sum")
+    total_day_trade = value_day_trade.where(sale, 0).groupby(note).transform("sum")
+    irrf_day_trade = (
+        trades["gain_day_trade"].where(sale, 0).groupby(note).transform("sum")
+        * ALIQ_IRRF_DAY_TRADE
+    )
+    irrf_swing_trade = trades["irrf"] - irrf_day_trade
+
+    weights = np.divide(
+        value, total_value, out=np.zeros(len(trades)), where=total_value > 0
+    )
+    fees = {column: weights * trades[column] for column in BROKERAGE_NOTE_FEES}
+    fees["irrf"] = np.divide(
+        irrf_swing_trade * value_swing_trade,
+        total_swing_trade,
+        out=np.zeros(len(trades)),
+        where=total_swing_trade > 0,
+    ) + np.divide(
+        irrf_day_trade * value_day_trade,
+        total_day_trade,
+        out=np.zeros(len(trades)),
+        where=total_day_trade > 0,
+    )
+    taxas = sum(fees[column] for column in BROKERAGE_NOTE_FEES + ["irrf"])
+
+    data = {
+        "Nota": trades["number"],
+        "Corretora": trades["broker"],
+        "Data do Pregão": trades["date"],
+        "Data de Liquidação": add_business_days_array(trades["date"], 2).tolist(),
+        "C/V": trades["op"],
+        "Ticker": trades["symbol"],
+        "Quantidade": trades["qty"],
+        "Preço": trades["price"],
+        "Valor da Operação": value,
+        "Taxas": taxas,
+        "Valor Liquido": value + np.where(trades["op"] == STOCK_BUY, taxas, -taxas),
+        "I.R.R.F.": fees["irrf"],
+        "Taxa de Liquidação": fees["taxa_liquidacao"],
+        "Taxa de Registro": fees["taxa_registro"],
+        "Taxa Termo/Opções": fees["taxa_termo_opcoes"],
+        "Taxa A.N.A.": fees["taxa_ana"],
+        "Emolumentos": fees["emolumentos"],
+        "Corretagem": fees["corretagem"],
+        # Como em get_brokerage_notes_stocks, a custódia mostra a corretagem
+        "Taxa Custódia": fees["corretagem"],
+        "Impostos": fees["impostos"],
+        "Outros": fees["outros"],
+        # Ajustada pelos eventos societários, pode não ser inteira
+        "Day-trade": trades["day_trade"],
+    }
+    table = pd.DataFrame(data, columns=TRADE_COLUMNS)
+    # Quantidade inteira, como em get_brokerage_notes_stocks, salvo quando um
+    # fator fracionário (bonificação, grupamento) pode gerar frações. A
+    # decisão vale para o portfólio todo, então todos os blocos têm o mesmo tipo
+    if factors is None or not factors.has_fractional_factors(portfolio_id):
+        table = table.astype({"Quantidade": "int64"})
+    return table
+
+
+def export_brokerage_notes_stocks(
+    portfolio,
+    filename,
+    start_date=START_DATE,
+    end_date=datetime.now().date(),
+    chunk_size=5000,
+):
+    # Grava bloco a bloco em CSV ou Parquet; a memória usada depende só de
+    # chunk_size. Devolve o número de linhas gravadas
+    chunks = iter_brokerage_notes_stocks(portfolio, start_date, end_date, chunk_size)
+    if filename.lower().endswith(".parquet"):
+        return write_parquet(chunks, filename)
+    return write_csv(chunks, filename)
+
+
+def write_csv(chunks, filename):
+    total = 0
+    with open(filename, "w", newline="", encoding="utf-8") as file:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(file, header=i == 0, index=False)
+            file.flush()
+            total += len(chunk)
+        if total == 0:
+            pd.DataFrame(columns=TRADE_COLUMNS).to_csv(file, index=False)
+    return total
+
+
+def write_parquet(chunks, filename):
+    # pyarrow só é necessário para exportar em Parquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    total = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(filename, table.schema)
+            writer.write_table(table.cast(writer.schema))
+            total += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pq.write_table(
+            pa.Table.from_pandas(
+                pd.DataFrame(columns=TRADE_COLUMNS), preserve_index=False
+            ),
+            filename,
+        )
+    return total
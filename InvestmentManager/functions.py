@@ -1,22 +1,9 @@
 import re
-from datetime import datetime, timedelta
-from holidays import Brazil
-
-from tabula import read_pdf
+from datetime import datetime, date
 
 from .const import *
 
-def add_business_days(start_date, days_to_add):
-    current_date = start_date
-    added_days = 0
-
-    while added_days < days_to_add:
-        current_date += timedelta(days=1)
-        if current_date.weekday() < 5:  # Verificar se não é sábado (5) nem domingo (6)
-            if current_date not in Brazil():
-                added_days += 1
-
-    return current_date
+from .business_days import add_business_days, add_business_days_array
 
 
 def extract_numbers_from_symbol(symbol):
@@ -27,8 +14,40 @@ def extract_numbers_from_symbol(symbol):
         return int(numbers[-1])  # Retorna o primeiro número encontrado
     else:
         return None  # Retorna None se não
-    
+
+
+def get_stock_type(symbol, stock_exange):
+    actions = ["SANB11"]
+    etf = [
+        "BOVA11",  # ETF que replica o Ibovespa
+        "SMAL11",  # ETF que replica o Índice Small Cap (SMLL)
+        "IVVB11",  # ETF que replica o S&P 500
+        "FIXA11",  # ETF de renda fixa
+        "GOAU11",  # ETF de ações do setor de mineração (GOAU)
+        "QBTC11",
+    ]
+    if stock_exange.upper() == "BVMF":
+        number = extract_numbers_from_symbol(symbol)
+        if (
+            symbol.upper() in actions
+            or number == 4
+            or number == 3
+            or number == 5
+            or number == 6
+        ):
+            return STOCK_ACAO
+        elif symbol.upper() in etf:
+            return STOCK_ETF
+        elif number == 11:
+            return STOCK_FII
+        elif number == 33:
+            return STOCK_BDR
+
+
 def read_brokerage_note(filename):
+  # tabula (e a JVM) só são carregados ao ler PDFs
+  from tabula import read_pdf
+
   try:
     note = read_pdf(filename, pages='all')
     corretora = note[0].iloc[1][1]
@@ -91,4 +110,45 @@ def read_brokerage_note(filename):
       'impostos': impostos,
       'outros': outros,
       'stocks': stocks
-  }
\ No newline at end of file
+  }
+
+
+def iter_months(start_date, end_date):
+    # Percorre os meses de start_date até end_date (inclusive)
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        yield year, month
+        year, month = (year, month + 1) if month < 12 else (year + 1, 1)
+
+
+def validate_brokerage_note(values):
+    # Confere um dicionário no formato de read_brokerage_note e devolve a
+    # lista de erros encontrados (vazia se a nota for válida)
+    errors = []
+    if not isinstance(values, dict):
+        return ["nota não reconhecida"]
+
+    if not isinstance(values.get("number"), int):
+        errors.append("número da nota inválido")
+    if not isinstance(values.get("broker"), str):
+        errors.append("corretora inválida")
+    if not isinstance(values.get("date"), date):
+        errors.append("data inválida")
+    for key in ["irrf"] + BROKERAGE_NOTE_FEES:
+        if not isinstance(values.get(key), (int, float)) or values[key] < 0:
+            errors.append("{} inválido".format(key))
+
+    stocks = values.get("stocks")
+    if not stocks:
+        errors.append("nota sem ativos")
+        return errors
+    for i, stock in enumerate(stocks, start=1):
+        if not isinstance(stock.get("symbol"), str) or not stock["symbol"].strip():
+            errors.append("ativo {}: símbolo inválido".format(i))
+        if not isinstance(stock.get("value"), (int, float)) or stock["value"] <= 0:
+            errors.append("ativo {}: preço inválido".format(i))
+        if not isinstance(stock.get("quantity"), int) or stock["quantity"] <= 0:
+            errors.append("ativo {}: quantidade inválida".format(i))
+        if stock.get("operation") not in (STOCK_BUY, STOCK_SALE):
+            errors.append("ativo {}: operação inválida".format(i))
+    return errors
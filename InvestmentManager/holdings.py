@@ -0,0 +1,125 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from .const import *
+
+from .business_days import get_business_day_calendar
+
+from .vectorized import VectorizedTaxEngine
+
+
+def get_dates(start_date, end_date, business_days=True):
+    # Índice diário da série: dias úteis da B3 ou todos os dias corridos
+    if not business_days:
+        return np.arange(
+            np.datetime64(start_date, "D"),
+            np.datetime64(end_date, "D") + 1,
+            dtype="datetime64[D]",
+        )
+    dates = get_business_day_calendar(
+        start_date.year, end_date.year
+    ).business_days_array
+    return dates[
+        (dates >= np.datetime64(start_date, "D"))
+        & (dates <= np.datetime64(end_date, "D"))
+    ]
+
+
+def get_last_values(rows, columns, values, shape):
+    # Matriz com o último valor informado para cada célula (row, column),
+    # repetido nas linhas seguintes até o próximo; NaN antes do primeiro
+    last = (
+        pd.DataFrame({"row": rows, "column": columns})
+        .drop_duplicates(keep="last")
+        .index.to_numpy()
+    )
+    matrix = np.full(shape, np.nan)
+    matrix[rows[last], columns[last]] = values[last]
+    return pd.DataFrame(matrix).ffill().to_numpy()
+
+
+class Holdings:
+    # Série temporal densa das posições: quantity[i, j] e price_average[i, j]
+    # são a quantidade e o PM do ativo symbols[j] ao fim do dia dates[i], ou
+    # seja, calculate_pm com end_date no dia seguinte
+    def __init__(self, dates, symbols, quantity, price_average):
+        self.dates = dates
+        self.symbols = symbols
+        self.quantity = quantity
+        self.price_average = price_average
+
+    @classmethod
+    def from_trades(cls, trades, dates):
+        # trades: DataFrame do VectorizedTaxEngine (date, symbol, op, qty e o PM
+        # após cada negócio em pm), em ordem cronológica
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        trade_dates = trades["date"].to_numpy(dtype="datetime64[D]")
+
+        # Cada negócio entra no primeiro dia do índice a partir da sua data; os
+        # anteriores ao início compõem a posição do primeiro dia
+        rows = np.searchsorted(dates, trade_dates, side="left")
+        trades = trades[rows < len(dates)]
+        rows = rows[rows < len(dates)]
+
+        symbols, columns = np.unique(trades["symbol"].to_numpy(), return_inverse=True)
+        shape = (len(dates), len(symbols))
+
+        # Quantidade: soma acumulada, ao longo dos dias, das variações diárias
+        quantity = trades["qty"].to_numpy()
+        signed = np.where(
+            trades["op"] == STOCK_BUY,
+            quantity,
+            np.where(trades["op"] == STOCK_SALE, -quantity, 0),
+        )
+        changes = np.zeros(shape)
+        np.add.at(changes, (rows, columns), signed)
+
+        # PM: o do último negócio de cada dia, repetido até o próximo negócio
+        price_average = get_last_values(rows, columns, trades["pm"].to_numpy(), shape)
+
+        return cls(
+            dates,
+            list(symbols),
+            np.cumsum(changes, axis=0),
+            np.nan_to_num(price_average),
+        )
+
+    @classmethod
+    def from_portfolio(
+        cls, portfolio, start_date=None, end_date=None, business_days=True
+    ):
+        # Um único carregamento dos negócios do portfólio, já ajustados pelos
+        # eventos societários
+        engine = VectorizedTaxEngine(portfolio)
+        trades = engine.get_trades()
+        end_date = end_date or date.today()
+        start_date = start_date or engine.get_first_date() or end_date
+        return cls.from_trades(
+            trades, get_dates(start_date, end_date, business_days=business_days)
+        )
+
+    def get_quantity(self):
+        return pd.DataFrame(
+            self.quantity,
+            index=pd.DatetimeIndex(self.dates, name="Data"),
+            columns=pd.Index(self.symbols, name="Ticker"),
+        )
+
+    def get_price_average(self):
+        return pd.DataFrame(
+            self.price_average,
+            index=pd.DatetimeIndex(self.dates, name="Data"),
+            columns=pd.Index(self.symbols, name="Ticker"),
+        )
+
+    def to_frame(self):
+        # Colunas em dois níveis, como em InvestmentManager.calculate_positions
+        return pd.concat(
+            {
+                "Quantidade": self.get_quantity(),
+                "Preço Médio": self.get_price_average(),
+            },
+            axis=1,
+        )
@@ -0,0 +1,344 @@
+import csv
+import glob
+import itertools
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date
+
+import pandas as pd
+
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import models
+
+from .const import *
+
+from .functions import read_brokerage_note, validate_brokerage_note
+
+from .ledger import invalidate_position_ledger
+
+BROKERAGE_NOTE_FIELDS = ["number", "broker", "date", "irrf"] + BROKERAGE_NOTE_FEES
+STOCK_FIELDS = ["symbol", "quantity", "value", "operation"]
+# 1234,56 ou 1.234,56: pontos só como separador de milhar
+BRAZILIAN_NUMBER = re.compile(r"[+-]?(\d+|\d{1,3}(\.\d{3})+),\d+")
+
+
+def find_brokerage_note_files(path):
+    # Aceita um diretório, um padrão glob ou uma lista de arquivos
+    if isinstance(path, (list, tuple)):
+        return list(path)
+    if os.path.isdir(path):
+        return sorted(
+            filename
+            for filename in glob.glob(os.path.join(path, "*"))
+            if filename.lower().endswith(".pdf")
+        )
+    return sorted(glob.glob(path))
+
+
+def parse_brokerage_note_file(filename):
+    # Executado nos processos do pool: nunca propaga exceções
+    try:
+        values = read_brokerage_note(filename)
+    except Exception as e:
+        return filename, None, ["falha ao ler o PDF: {}".format(e)]
+    if values is None:
+        return filename, None, ["corretora ou layout de nota não suportado"]
+    return filename, values, validate_brokerage_note(values)
+
+
+def parse_brokerage_note_files(filenames, max_workers=None):
+    # Cada processo mantém sua própria JVM do tabula entre os arquivos;
+    # com max_workers=1 tudo roda no processo atual, com uma única JVM
+    if max_workers == 1 or len(filenames) <= 1:
+        return [parse_brokerage_note_file(filename) for filename in filenames]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(parse_brokerage_note_file, filenames))
+
+
+def import_brokerage_notes(portfolio, session, path, max_workers=None):
+    # Lê os PDFs em paralelo, valida e insere todas as notas válidas em uma
+    # única transação. Devolve um relatório com uma linha por arquivo
+    filenames = find_brokerage_note_files(path)
+    parsed = [
+        (os.path.basename(filename), values, errors)
+        for filename, values, errors in parse_brokerage_note_files(
+            filenames, max_workers
+        )
+    ]
+    return insert_brokerage_notes(portfolio, session, parsed, "Arquivo")
+
+
+def add_brokerage_notes(portfolio, session, notes, batch_size=1000):
+    # notes: iterável de dicionários no formato de read_brokerage_note
+    parsed = (
+        (i, values, validate_brokerage_note(values))
+        for i, values in enumerate(notes, start=1)
+    )
+    return insert_brokerage_notes(portfolio, session, parsed, "Registro", batch_size)
+
+
+def load_brokerage_notes(portfolio, session, filename, batch_size=1000):
+    # CSV (um ativo por linha) ou JSON/JSON Lines (uma nota por registro)
+    if filename.lower().endswith(".csv"):
+        parsed = read_brokerage_notes_csv(filename)
+    else:
+        parsed = read_brokerage_notes_json(filename)
+    return insert_brokerage_notes(portfolio, session, parsed, "Registro", batch_size)
+
+
+def insert_brokerage_notes(portfolio, session, parsed, source, batch_size=1000):
+    # parsed: (origem, values, erros) de cada nota. Notas com erro ficam só no
+    # relatório; as demais são gravadas em lotes de batch_size notas, com
+    # INSERTs em lote, e confirmadas em uma única transação
+    numbers = {
+        number
+        for (number,) in session.query(models.BrokerageNote.number).filter(
+            models.BrokerageNote.portfolio_id == portfolio.id
+        )
+    }
+    report = []
+    imported = []
+    batch = []
+    try:
+        for origin, values, errors in parsed:
+            number = values.get("number") if values else None
+            if not isinstance(number, int):
+                number = None
+            if not errors and number in numbers:
+                errors = ["nota já cadastrada"]
+            if not errors:
+                batch.append(values)
+                numbers.add(number)
+                imported.append(len(report))
+                if len(batch) >= batch_size:
+                    insert_brokerage_note_batch(portfolio, session, batch)
+                    batch = []
+            report.append(
+                {
+                    source: origin,
+                    "Nota": number,
+                    "Data": values.get("date") if values else None,
+                    "Ativos": len(values.get("stocks") or []) if values else 0,
+                    "Status": "Erro" if errors else "Importada",
+                    "Erro": "; ".join(errors),
+                }
+            )
+        insert_brokerage_note_batch(portfolio, session, batch)
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        for i in imported:
+            report[i]["Status"] = "Erro"
+            report[i]["Erro"] = "falha ao gravar: {}".format(e)
+    except Exception:
+        # Arquivo ausente, ilegível ou malformado: nada é gravado e o erro
+        # chega a quem chamou, em vez de virar uma importação vazia
+        session.rollback()
+        portfolio.invalidate_month_index()
+        raise
+
+    portfolio.invalidate_month_index()
+    return pd.DataFrame(
+        report, columns=[source, "Nota", "Data", "Ativos", "Status", "Erro"]
+    ).astype({"Nota": "Int64"})
+
+
+def insert_brokerage_note_batch(portfolio, session, batch):
+    # Um INSERT em lote para as notas e outro para os ativos. Como não passa
+    # pelo flush do ORM, os caches da sessão são invalidados aqui
+    if not batch:
+        return
+
+    last_id = session.query(func.max(models.BrokerageNote.id)).scalar() or 0
+    session.execute(
+        models.BrokerageNote.__table__.insert(),
+        [
+            dict(
+                {key: values[key] for key in BROKERAGE_NOTE_FIELDS},
+                portfolio_id=portfolio.id,
+            )
+            for values in batch
+        ],
+    )
+    ids = dict(
+        session.query(models.BrokerageNote.number, models.BrokerageNote.id)
+        .filter(models.BrokerageNote.portfolio_id == portfolio.id)
+        .filter(models.BrokerageNote.id > last_id)
+    )
+    session.execute(
+        models.Stock.__table__.insert(),
+        [
+            {
+                "brokerage_note_id": ids[values["number"]],
+                "symbol": stock["symbol"].upper(),
+                "quantity": stock["quantity"],
+                "value": stock["value"],
+                "operation": stock["operation"],
+            }
+            for values in batch
+            for stock in values["stocks"]
+        ],
+    )
+
+    session.expire(portfolio, ["brokerage_notes"])
+    invalidate_position_ledger(session)
+    for values in batch:
+        models.MonthlyTaxSummary.invalidate(
+            session,
+            values["date"],
+            portfolio.id,
+            [stock["symbol"].upper() for stock in values["stocks"]],
+        )
+    models.MonthlyTaxSummary.apply_invalidation(session)
+
+
+## CSV / JSON
+
+
+def read_brokerage_notes_csv(filename, delimiter=None):
+    # Um ativo por linha, com os campos da nota repetidos. Linhas seguidas com
+    # o mesmo número formam uma nota. Gera (linha, values, erros) sob demanda
+    with open(filename, newline="", encoding="utf-8-sig") as file:
+        if delimiter is None:
+            delimiter = csv.Sniffer().sniff(file.read(4096), ",;\t").delimiter
+            file.seek(0)
+
+        # Primeira passagem, só pelos números: uma nota cujas linhas não são
+        # contíguas é recusada inteira, em vez de entrar pela metade
+        seen = set()
+        split_numbers = set()
+        reader = csv.DictReader(file, delimiter=delimiter)
+        for number, _ in itertools.groupby(row.get("number") for row in reader):
+            if number in seen:
+                split_numbers.add(number)
+            seen.add(number)
+        file.seek(0)
+
+        reader = csv.DictReader(file, delimiter=delimiter)
+        rows = ((reader.line_num, row) for row in reader)
+        notes = itertools.groupby(rows, key=lambda item: item[1].get("number"))
+        for number, group in notes:
+            group = list(group)
+            if number in split_numbers:
+                yield group[0][0], None, [
+                    "linhas da nota {} não são contíguas".format(number)
+                ]
+                continue
+            record = {key: group[0][1].get(key) for key in BROKERAGE_NOTE_FIELDS}
+            record["stocks"] = [
+                {key: row.get(key) for key in STOCK_FIELDS} for _, row in group
+            ]
+            values, errors = parse_brokerage_note_record(record)
+            yield group[0][0], values, errors
+
+
+def read_brokerage_notes_json(filename):
+    # JSON com uma lista de notas ou JSON Lines com uma nota por linha
+    with open(filename, encoding="utf-8") as file:
+        if filename.lower().endswith((".jsonl", ".ndjson")):
+            records = (
+                (i, line) for i, line in enumerate(file, start=1) if line.strip()
+            )
+            for i, line in records:
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield i, None, ["JSON inválido: {}".format(e)]
+                    continue
+                values, errors = parse_brokerage_note_record(record)
+                yield i, values, errors
+        else:
+            for i, record in enumerate(json.load(file), start=1):
+                values, errors = parse_brokerage_note_record(record)
+                yield i, values, errors
+
+
+def parse_brokerage_note_record(record):
+    # Converte um registro de texto (CSV/JSON) para o formato de
+    # read_brokerage_note e devolve (values, erros)
+    if not isinstance(record, dict):
+        return None, ["registro não reconhecido"]
+
+    values = {}
+    errors = []
+    parsers = {
+        "number": parse_int,
+        "broker": lambda value: str(value).strip(),
+        "date": parse_date,
+    }
+    for key in BROKERAGE_NOTE_FIELDS:
+        value = record.get(key)
+        if value is None or value == "":
+            # Só as taxas são opcionais
+            if key in parsers:
+                errors.append("{} ausente".format(key))
+                continue
+            value = 0
+        try:
+            values[key] = parsers.get(key, parse_float)(value)
+        except (TypeError, ValueError):
+            errors.append("{} inválido: {!r}".format(key, value))
+
+    stocks = []
+    for i, stock in enumerate(record.get("stocks") or [], start=1):
+        try:
+            stocks.append(
+                {
+                    "symbol": str(stock["symbol"]).strip().upper(),
+                    "quantity": parse_int(stock["quantity"]),
+                    "value": parse_float(stock["value"]),
+                    "operation": parse_operation(stock["operation"]),
+                }
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append("ativo {}: {}".format(i, e))
+    values["stocks"] = stocks
+
+    if not errors:
+        errors = validate_brokerage_note(values)
+    return values, errors
+
+
+def parse_float(value):
+    # Aceita 1234.56 e o formato brasileiro 1.234,56. Com vírgula, o número
+    # tem de estar no formato brasileiro: 1,234.56 é recusado, não lido como
+    # 1.23456
+    if isinstance(value, str):
+        value = value.strip()
+        if "," in value:
+            if not BRAZILIAN_NUMBER.fullmatch(value):
+                raise ValueError("número ambíguo: {!r}".format(value))
+            value = value.replace(".", "").replace(",", ".")
+    return float(value)
+
+
+def parse_int(value):
+    value = parse_float(value)
+    if not value.is_integer():
+        raise ValueError("{} não é inteiro".format(value))
+    return int(value)
+
+
+def parse_date(value):
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        for date_format in ["%Y-%m-%d", "%d/%m/%Y"]:
+            try:
+                return datetime.strptime(value.strip(), date_format).date()
+            except ValueError:
+                pass
+    raise ValueError("data inválida")
+
+
+def parse_operation(value):
+    operation = str(value).strip().upper()
+    if operation in ("C", "COMPRA", str(STOCK_BUY)):
+        return STOCK_BUY
+    if operation in ("V", "VENDA", str(STOCK_SALE)):
+        return STOCK_SALE
+    raise ValueError("operação inválida: {!r}".format(value))
@@ -0,0 +1,176 @@
+import functools
+import inspect
+import threading
+import time
+
+import pandas as pd
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Relatórios do Portfolio medidos em cada portfólio instrumentado
+REPORT_METHODS = [
+    name
+    for name, method in vars(models.Portfolio).items()
+    if (name.startswith(("get_", "print_")) or name == "to_excel")
+    and inspect.isfunction(method)
+]
+
+
+class Instrumentation:
+    # Mede, por chamada de relatório do Portfolio (get_*, print_* e to_excel),
+    # a quantidade de consultas SQL, o tempo gasto nelas, o tempo de Python e
+    # quantos objetos do ORM foram carregados. Chamadas internas (ex.: get_*
+    # dentro de print_*) são somadas à chamada mais externa. Só os portfólios
+    # passados a instrument (os do manager) são medidos: a classe Portfolio e
+    # as demais sessões do processo não mudam
+    def __init__(self, engine=None, print_summary=True):
+        self.engine = None
+        self.print_summary = print_summary
+        self.reports = []
+        self.portfolios = []
+        self.sessions = []
+        # Relatório em andamento de cada thread
+        self.local = threading.local()
+        # Início da consulta em andamento, em conn.info
+        self.start_key = ("instrumentation_start", id(self))
+        if engine is not None:
+            self.enable(engine)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disable()
+
+    @property
+    def current(self):
+        return getattr(self.local, "current", None)
+
+    @current.setter
+    def current(self, report):
+        self.local.current = report
+
+    def enable(self, engine):
+        if self.engine is not None:
+            return
+        # Sessões ligadas a uma conexão são medidas pelo engine dela
+        self.engine = engine.engine
+        event.listen(self.engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(self.engine, "after_cursor_execute", self.after_cursor_execute)
+        event.listen(self.engine, "handle_error", self.handle_error)
+
+    def disable(self):
+        if self.engine is None:
+            return
+        event.remove(self.engine, "before_cursor_execute", self.before_cursor_execute)
+        event.remove(self.engine, "after_cursor_execute", self.after_cursor_execute)
+        event.remove(self.engine, "handle_error", self.handle_error)
+        for session in self.sessions:
+            event.remove(session, "loaded_as_persistent", self.on_load)
+        for portfolio in self.portfolios:
+            for name in REPORT_METHODS:
+                vars(portfolio).pop(name, None)
+        self.sessions = []
+        self.portfolios = []
+        self.engine = None
+
+    def instrument(self, portfolio):
+        # Troca os relatórios do próprio objeto, não da classe
+        if self.engine is None or portfolio is None or portfolio in self.portfolios:
+            return portfolio
+        for name in REPORT_METHODS:
+            setattr(portfolio, name, self.wrap(name, getattr(portfolio, name)))
+        self.portfolios.append(portfolio)
+
+        session = Session.object_session(portfolio)
+        if session is not None and session not in self.sessions:
+            event.listen(session, "loaded_as_persistent", self.on_load)
+            self.sessions.append(session)
+        return portfolio
+
+    ## Eventos
+
+    def before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info[self.start_key] = time.perf_counter()
+
+    def after_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        self.add_query(conn.info.pop(self.start_key, None))
+
+    def handle_error(self, exception_context):
+        # Consulta que falhou: conta o tempo até o erro e limpa o início
+        connection = exception_context.connection
+        if connection is not None:
+            self.add_query(connection.info.pop(self.start_key, None))
+
+    def add_query(self, start):
+        if start is not None and self.current is not None:
+            self.current["queries"] += 1
+            self.current["sql_time"] += time.perf_counter() - start
+
+    def on_load(self, session, instance):
+        if self.current is not None:
+            self.current["objects"] += 1
+
+    ## Relatórios
+
+    def wrap(self, name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            return self.measure(name, functools.partial(method, *args, **kwargs))
+
+        return wrapper
+
+    def measure(self, name, call):
+        if self.current is not None:
+            return call()
+
+        report = {"report": name, "queries": 0, "sql_time": 0.0, "objects": 0}
+        self.current = report
+        start = time.perf_counter()
+        try:
+            result = call()
+        finally:
+            self.current = None
+            report["total_time"] = time.perf_counter() - start
+            report["python_time"] = report["total_time"] - report["sql_time"]
+            self.reports.append(report)
+
+        if self.print_summary and name.startswith("print_"):
+            print(self.format_report(report))
+        return result
+
+    def format_report(self, report):
+        return (
+            "{}: {} consultas SQL em {:.3f}s | Python {:.3f}s | "
+            "{} objetos carregados | total {:.3f}s".format(
+                report["report"],
+                report["queries"],
+                report["sql_time"],
+                report["python_time"],
+                report["objects"],
+                report["total_time"],
+            )
+        )
+
+    def get_reports(self):
+        return pd.DataFrame(
+            self.reports,
+            columns=[
+                "report",
+                "queries",
+                "sql_time",
+                "python_time",
+                "objects",
+                "total_time",
+            ],
+        )
+
+    def clear(self):
+        self.reports = []
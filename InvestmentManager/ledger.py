@@ -0,0 +1,161 @@
+from bisect import bisect_left
+
+from . import models
+
+from .const import *
+
+LEDGER_KEY = "position_ledger"
+
+
+def apply_trade(price_average, total_quantity, operation, quantity, value):
+    # Mesma regra de PM usada historicamente em calculate_pm
+    if operation == STOCK_BUY:
+        price_average = (price_average * total_quantity) + (value * quantity)
+        total_quantity += quantity
+        if total_quantity > 0:
+            price_average /= total_quantity
+    elif operation == STOCK_SALE:
+        total_quantity -= quantity
+        price_average = price_average if total_quantity > 0 else 0
+    return price_average, total_quantity
+
+
+class PositionLedger:
+    def __init__(self, trades):
+        # trades: (symbol, date, operation, quantity, value) em ordem cronológica
+        self.trades = {}
+        self.dates = {}
+        self.positions = {}
+
+        for symbol, trade_date, operation, quantity, value in trades:
+            if symbol not in self.trades:
+                self.trades[symbol] = []
+                self.dates[symbol] = []
+                self.positions[symbol] = []
+                price_average, total_quantity = 0, 0
+            else:
+                price_average, total_quantity = self.positions[symbol][-1]
+
+            self.trades[symbol].append((operation, quantity, value))
+            self.dates[symbol].append(trade_date)
+            self.positions[symbol].append(
+                apply_trade(price_average, total_quantity, operation, quantity, value)
+            )
+
+    @classmethod
+    def from_session(cls, session):
+        query = (
+            session.query(
+                models.Stock.symbol,
+                models.BrokerageNote.date,
+                models.Stock.operation,
+                models.Stock.quantity,
+                models.Stock.value,
+                models.BrokerageNote.portfolio_id,
+            )
+            .join(models.Stock.brokerage_note)
+            .order_by(models.BrokerageNote.date, models.Stock.id)
+        )
+
+        # Quantidades e preços levados para a base atual pelos eventos
+        # societários de cada portfólio
+        factors = models.CorporateAction.get_adjustment_factors(session)
+        if not factors.has_actions():
+            return cls(row[:5] for row in query)
+
+        trades = []
+        for symbol, trade_date, operation, quantity, value, portfolio_id in query:
+            factor = factors.get_factor(portfolio_id, symbol, trade_date)
+            trades.append(
+                (symbol, trade_date, operation, quantity * factor, value / factor)
+            )
+        return cls(trades)
+
+    def get_position(self, symbol, start_date=START_DATE, end_date=None):
+        # Posição (PM, quantidade) considerando negócios em [start_date, end_date)
+        dates = self.dates.get(symbol)
+        if not dates:
+            return 0, 0
+
+        end = bisect_left(dates, end_date) if end_date is not None else len(dates)
+        start = bisect_left(dates, start_date) if start_date != START_DATE else 0
+
+        if start >= end:
+            return 0, 0
+        if start == 0:
+            return self.positions[symbol][end - 1]
+
+        # Período que não começa no primeiro negócio: refaz apenas o trecho
+        price_average, total_quantity = 0, 0
+        for operation, quantity, value in self.trades[symbol][start:end]:
+            price_average, total_quantity = apply_trade(
+                price_average, total_quantity, operation, quantity, value
+            )
+        return price_average, total_quantity
+
+    def get_positions(self, dates, start_date=START_DATE, symbols=None):
+        # Posições em várias datas de corte, com uma única passagem pelos
+        # negócios de cada ativo: {symbol: [(PM, quantidade) em cada data]},
+        # considerando, para cada data, os negócios em [start_date, data)
+        if symbols is None:
+            symbols = self.get_symbols()
+        order = sorted(range(len(dates)), key=lambda i: dates[i])
+
+        positions = {}
+        for symbol in symbols:
+            trade_dates = self.dates.get(symbol, [])
+            snapshots = [(0, 0)] * len(dates)
+            start = 0
+            if start_date != START_DATE:
+                start = bisect_left(trade_dates, start_date)
+
+            if start == 0:
+                # Desde o primeiro negócio: posições já acumuladas no livro
+                for i in order:
+                    end = bisect_left(trade_dates, dates[i])
+                    if end > 0:
+                        snapshots[i] = self.positions[symbol][end - 1]
+            else:
+                # Refaz o trecho a partir de start_date uma única vez, anotando
+                # a posição ao passar por cada data de corte
+                price_average, total_quantity = 0, 0
+                index = start
+                for i in order:
+                    end = bisect_left(trade_dates, dates[i])
+                    while index < end:
+                        operation, quantity, value = self.trades[symbol][index]
+                        price_average, total_quantity = apply_trade(
+                            price_average, total_quantity, operation, quantity, value
+                        )
+                        index += 1
+                    snapshots[i] = (price_average, total_quantity)
+            positions[symbol] = snapshots
+        return positions
+
+    def get_symbols(self):
+        return sorted(self.dates.keys())
+
+
+def get_position_ledger(session):
+    # Garante que alterações pendentes estejam no banco, como faria o autoflush
+    if session.autoflush:
+        session.flush()
+
+    ledger = session.info.get(LEDGER_KEY)
+    if ledger is None:
+        ledger = PositionLedger.from_session(session)
+        session.info[LEDGER_KEY] = ledger
+        models.listen_session_events(session, _after_flush, _after_rollback)
+    return ledger
+
+
+def invalidate_position_ledger(session):
+    session.info.pop(LEDGER_KEY, None)
+
+
+def _after_flush(session, flush_context):
+    invalidate_position_ledger(session)
+
+
+def _after_rollback(session):
+    invalidate_position_ledger(session)
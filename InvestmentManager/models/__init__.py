@@ -2,4 +2,10 @@ from .models import Stock
 from .models import Portfolio
 from .models import User
 from .models import BrokerageNote
-from .models import Base
\ No newline at end of file
+from .models import Price
+from .models import MonthlyTaxSummary
+from .models import CorporateAction
+from .models import Base
+from .models import listen_session_events
+from .models import has_table
+from .models import TABLES_KEY
\ No newline at end of file
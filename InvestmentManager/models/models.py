@@ -1,34 +1,54 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, Date
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    ForeignKey,
+    Float,
+    Date,
+    UniqueConstraint,
+    Index,
+)
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import relationship, Session, joinedload
 from sqlalchemy.ext.declarative import declarative_base
 
-import yfinance as yf
-from yahoo_fin import stock_info
-
 import math
-import numpy as np
-
-from datetime import datetime, date
 
-from tabulate import tabulate
+# numpy, pandas e tabulate são importados nos métodos que os usam, para que
+# importar o pacote (ex.: só para calculate_pm) não os carregue
 
-import pandas as pd
+from datetime import datetime, date, timedelta
 
 from .. import InvestmentManager
 
 from ..const import *
 
 from ..functions import (
-    extract_numbers_from_symbol,
+    get_stock_type,
     add_business_days,
+    add_business_days_array,
     read_brokerage_note,
+    iter_months,
 )
 
+from ..tax import MonthlyTaxState
+
+from ..corporate_actions import AdjustmentFactors, get_factor
+
+from ..prices import get_default_price_provider
+
 Base = declarative_base()
 
+# Em session.info: {nome da tabela: existe no banco}, preenchido por has_table
+TABLES_KEY = "tables"
+
 
 class BrokerageNote(Base):
     __tablename__ = "brokerage_notes"
+    __table_args__ = (
+        Index("ix_brokerage_notes_portfolio_id_date", "portfolio_id", "date"),
+        Index("ix_brokerage_notes_portfolio_id_number", "portfolio_id", "number"),
+    )
 
     id = Column(Integer, primary_key=True)
     number = Column(Integer)
@@ -57,15 +77,21 @@ class BrokerageNote(Base):
             quantity=quantity,
             value=value,
             operation=operation,
-            brokerage_note=self,
         )
+        # O append também define stock.brokerage_note via back_populates
         self.stocks.append(new_stock)
+        self.invalidate_cache()
         return new_stock
 
     def remove_stock(self, stock_id):
-        stock = next((stock for stock in self.sotcks if stock.id == stock_id), None)
+        stock = next((stock for stock in self.stocks if stock.id == stock_id), None)
         session = Session.object_session(self)
         if stock:
+            # Invalida antes de remover, para que o ativo removido conte entre
+            # os afetados. A sessão não expira os objetos no commit: a coleção
+            # carregada precisa deixar de conter o ativo removido
+            self.invalidate_cache()
+            self.stocks.remove(stock)
             session.delete(stock)
             session.commit()
             return True
@@ -78,10 +104,106 @@ class BrokerageNote(Base):
             total += stock.value * stock.quantity
         return total
 
-    def split(self, symbol, ratio = 1, type = 's'):
-        for stock in self.stocks:
-            if stock.symbol == symbol:
-                stock.split(ratio, type)
+    def get_day_trades(self):
+        # Casa compras e vendas do mesmo ativo na nota uma única vez:
+        # {stock.id: (quantidade, lucro, valor de venda)}
+        day_trades = getattr(self, "_day_trades", None)
+        if day_trades is None:
+            session = Session.object_session(self)
+            if session is not None and any(stock.id is None for stock in self.stocks):
+                session.flush()
+
+            buy = {}
+            sale = {}
+            for stock in sorted(self.stocks, key=lambda stock: stock.id):
+                if stock.operation == STOCK_BUY:
+                    buy.setdefault(stock.symbol, []).append(stock)
+                elif stock.operation == STOCK_SALE:
+                    sale.setdefault(stock.symbol, []).append(stock)
+
+            day_trades = {}
+            for symbol in buy:
+                for buy_l, sale_l in zip(buy[symbol], sale.get(symbol, [])):
+                    quantity = min(buy_l.quantity, sale_l.quantity)
+                    match = (
+                        quantity,
+                        (sale_l.value - buy_l.value) * quantity,
+                        sale_l.value * quantity,
+                    )
+                    day_trades[buy_l.id] = match
+                    day_trades[sale_l.id] = match
+            self._day_trades = day_trades
+        return day_trades
+
+    def get_fees(self):
+        import numpy as np
+
+        # Rateio das taxas e do IRRF da nota entre os ativos, proporcional ao
+        # valor de cada operação: {stock.id: {coluna: valor}}
+        fees = getattr(self, "_fees", None)
+        if fees is None:
+            day_trades = self.get_day_trades()
+            stocks = list(self.stocks)
+
+            values = np.array([stock.value for stock in stocks], dtype=float)
+            quantities = np.array([stock.quantity for stock in stocks], dtype=float)
+            day_trade = np.array(
+                [day_trades.get(stock.id, (0, 0, 0))[0] for stock in stocks],
+                dtype=float,
+            )
+
+            total_value = self.get_total_value()
+            weights = (
+                (values * quantities) / total_value
+                if total_value > 0
+                else np.zeros(len(stocks))
+            )
+            columns = {
+                column: weights * getattr(self, column)
+                for column in BROKERAGE_NOTE_FEES
+            }
+
+            irrf = np.zeros(len(stocks))
+            total_value_sale_swing_trade = self.get_total_value_sale_swing_trade()
+            if total_value_sale_swing_trade > 0:
+                irrf = irrf + self.get_irrf_swing_trade() * (
+                    (values * (quantities - day_trade)) / total_value_sale_swing_trade
+                )
+            total_value_sale_day_trade = self.get_total_value_sale_day_trade()
+            if total_value_sale_day_trade > 0:
+                irrf = irrf + self.get_irrf_day_trade() * (
+                    (values * day_trade) / total_value_sale_day_trade
+                )
+            columns["irrf"] = irrf
+
+            taxas = np.zeros(len(stocks))
+            for column in BROKERAGE_NOTE_FEES + ["irrf"]:
+                taxas = taxas + columns[column]
+            columns["taxas"] = taxas
+
+            columns = {
+                column: column_values.tolist()
+                for column, column_values in columns.items()
+            }
+            fees = {
+                stock.id: {column: columns[column][i] for column in columns}
+                for i, stock in enumerate(stocks)
+            }
+            self._fees = fees
+        return fees
+
+    def clear_cache(self):
+        # Day trades e rateio das taxas, recalculados na próxima leitura
+        self._day_trades = None
+        self._fees = None
+
+    def invalidate_cache(self):
+        self.clear_cache()
+        if self.portfolio is not None:
+            self.portfolio.invalidate_month_index()
+            self.portfolio.invalidate_tax_summary(
+                self.date, [stock.symbol for stock in self.stocks]
+            )
 
     def get_total_value_sale_swing_trade(self):
         total = 0
@@ -193,6 +315,7 @@ class Portfolio(Base):
 
     user = relationship("User", back_populates="portfolios")
     brokerage_notes = relationship("BrokerageNote", back_populates="portfolio")
+    corporate_actions = relationship("CorporateAction", back_populates="portfolio")
 
     ## Edit brokerage notes
 
@@ -226,9 +349,11 @@ class Portfolio(Base):
             taxa_custodia=taxa_custodia,
             impostos=impostos,
             outros=outros,
-            portfolio=self,
         )
+        # O append também define brokerage_note.portfolio via back_populates
         self.brokerage_notes.append(new_brokerage_note)
+        self.invalidate_month_index()
+        self.invalidate_tax_summary(date)
         return new_brokerage_note
 
     def create_brokerage_note(self, brokerage_note_filename=None):
@@ -529,6 +654,10 @@ class Portfolio(Base):
 
         values["stocks"] = stocks
 
+        return self.add_brokerage_note_from_values(values)
+
+    def add_brokerage_note_from_values(self, values):
+        # values no formato devolvido por read_brokerage_note
         new_brokerage_note = self.add_brokerage_note(
             number=values["number"],
             broker=values["broker"],
@@ -566,34 +695,128 @@ class Portfolio(Base):
         session = Session.object_session(self)
 
         if brokerage_note:
+            # A sessão não expira os objetos no commit: a coleção carregada
+            # precisa deixar de conter a nota removida
+            self.brokerage_notes.remove(brokerage_note)
             for stock in brokerage_note.stocks:
                 session.delete(stock)
             session.delete(brokerage_note)
+            self.invalidate_tax_summary(
+                brokerage_note.date,
+                [stock.symbol for stock in brokerage_note.stocks],
+            )
             session.commit()
+            self.invalidate_month_index()
             return True
         else:
             return False
 
+    ## Month index
+
+    def get_month_index(self):
+        # Índice por (ano, mês) com notas, vendas e IRRF, montado sob demanda
+        month_index = getattr(self, "_month_index", None)
+        if month_index is None:
+            self.load_brokerage_notes_stocks()
+            month_index = {"notes": {}, "sales": {}, "irrf": {}}
+            for note in self.brokerage_notes:
+                key = (note.date.year, note.date.month)
+                month_index["notes"].setdefault(key, []).append(note)
+                sales = month_index["sales"].setdefault(key, [])
+                for stock in note.stocks:
+                    if stock.operation == STOCK_SALE:
+                        sales.append(stock)
+            self._month_index = month_index
+        return month_index
+
+    def invalidate_month_index(self):
+        self._month_index = None
+
+    def load_brokerage_notes_stocks(self, start_date=START_DATE, end_date=None):
+        # Carrega os ativos de todas as notas do período com um único SELECT
+        # (joined loading), em vez de uma consulta por nota ao percorrer
+        # note.stocks. Não consulta nada se já estiverem carregados
+        session = Session.object_session(self)
+        if session is None:
+            return
+        unloaded = [
+            note
+            for note in self.brokerage_notes
+            if "stocks" in inspect(note).unloaded
+            and start_date <= note.date
+            and (end_date is None or note.date <= end_date)
+        ]
+        if not unloaded:
+            return
+
+        query = (
+            session.query(BrokerageNote)
+            .filter(BrokerageNote.portfolio_id == self.id)
+            .options(joinedload(BrokerageNote.stocks))
+        )
+        if start_date != START_DATE:
+            query = query.filter(BrokerageNote.date >= start_date)
+        if end_date is not None:
+            query = query.filter(BrokerageNote.date <= end_date)
+        query.all()
+
+    def invalidate_tax_summary(self, from_date, symbols=()):
+        # Descarta o IR materializado a partir do mês de from_date, neste
+        # portfólio e nos que negociam algum dos ativos em symbols
+        session = Session.object_session(self)
+        if session is not None and from_date is not None:
+            MonthlyTaxSummary.invalidate(session, from_date, self.id, symbols)
+
     ## Show all stocks on portfolio
 
     def get_unique_symbols(self):
         unique_symbols = set()
 
+        self.load_brokerage_notes_stocks()
         for brokerage_note in self.brokerage_notes:
             for stock in brokerage_note.stocks:
                 unique_symbols.add(stock.symbol)
 
         return sorted(list(unique_symbols))
 
-    def split(self, symbol, ratio = 1, type = 's'):
-        for brokerage_note in self.brokerage_notes:
-            brokerage_note.split(symbol, ratio, type)
+    def split(self, symbol, ratio=1, type="s", date=None):
+        # Registra o evento; as notas não são alteradas. Negócios até date
+        # (data com, por padrão hoje) passam a ser ajustados pelo fator
+        if date is None:
+            date = datetime.now().date()
+        corporate_action = CorporateAction(
+            symbol=symbol, date=date, type=type.lower(), ratio=ratio
+        )
+        self.corporate_actions.append(corporate_action)
+
+        session = Session.object_session(self)
+        if session is not None:
+            first_date = (
+                session.query(func.min(BrokerageNote.date))
+                .join(BrokerageNote.stocks)
+                .filter(BrokerageNote.portfolio_id == self.id)
+                .filter(Stock.symbol == symbol)
+                .filter(BrokerageNote.date <= date)
+                .scalar()
+            )
+            self.invalidate_tax_summary(first_date, [symbol])
+            session.flush()
+        return corporate_action
+
+    def get_adjustment_factor(self, symbol, trade_date):
+        session = Session.object_session(self)
+        if session is None:
+            return 1
+        return CorporateAction.get_adjustment_factors(session).get_factor(
+            self.id, symbol, trade_date
+        )
 
     def get_unique_symbols_in_date_range(
         self, start_date=START_DATE, end_date=datetime.now().date()
     ):
         unique_symbols = set()
 
+        self.load_brokerage_notes_stocks(start_date, end_date)
         for brokerage_note in self.brokerage_notes:
             if start_date <= brokerage_note.date <= end_date:
                 for stock in brokerage_note.stocks:
@@ -606,41 +829,53 @@ class Portfolio(Base):
     def get_brokerage_notes_stocks(
         self, start_date=START_DATE, end_date=datetime.now().date()
     ):
+        import pandas as pd
+
         # Filtrar as notas de corretagem do portfólio com datas entre o período
+        self.load_brokerage_notes_stocks(start_date, end_date)
         brokerage_notes_within_period = [
             note
             for note in self.brokerage_notes
             if start_date <= (note.date) <= end_date
         ]
 
+        # Datas de liquidação (D+2) calculadas de uma vez para todas as notas
+        settlement_dates = add_business_days_array(
+            [note.date for note in brokerage_notes_within_period], 2
+        ).tolist()
+
         data = []
 
-        for brokerage_note in brokerage_notes_within_period:
+        for brokerage_note, settlement_date in zip(
+            brokerage_notes_within_period, settlement_dates
+        ):
+            # Taxas rateadas uma única vez por nota
+            fees = brokerage_note.get_fees()
             for stock in brokerage_note.stocks:
                 day_trade = stock.check_day_trade()
 
-                taxa_liquidacao = stock.get_taxa_liquidacao()
-                taxa_registro = stock.get_taxa_registro()
-                taxa_termo_opcoes = stock.get_taxa_termo_opcoes()
-                taxa_ana = stock.get_taxa_ana()
-                emolumentos = stock.get_emolumentos()
-                corretagem = stock.get_corretagem()
-                taxa_custodia = stock.get_corretagem()
-                impostos = stock.get_impostos()
-                outros = stock.get_outros()
-                irrf = stock.get_irrf()
-                taxas = stock.get_taxas()
+                taxa_liquidacao = fees[stock.id]["taxa_liquidacao"]
+                taxa_registro = fees[stock.id]["taxa_registro"]
+                taxa_termo_opcoes = fees[stock.id]["taxa_termo_opcoes"]
+                taxa_ana = fees[stock.id]["taxa_ana"]
+                emolumentos = fees[stock.id]["emolumentos"]
+                corretagem = fees[stock.id]["corretagem"]
+                taxa_custodia = fees[stock.id]["corretagem"]
+                impostos = fees[stock.id]["impostos"]
+                outros = fees[stock.id]["outros"]
+                irrf = fees[stock.id]["irrf"]
+                taxas = fees[stock.id]["taxas"]
 
                 data.append(
                     {
                         "Nota": brokerage_note.number,
                         "Corretora": brokerage_note.broker,
                         "Data do Pregão": brokerage_note.date,
-                        "Data de Liquidação": add_business_days(brokerage_note.date, 2),
+                        "Data de Liquidação": settlement_date,
                         "C/V": stock.operation,
                         "Ticker": stock.symbol,
-                        "Quantidade": stock.quantity,
-                        "Preço": stock.value,
+                        "Quantidade": stock.get_quantity(),
+                        "Preço": stock.get_value(),
                         "Valor da Operação": stock.value * stock.quantity,
                         "Taxas": taxas,
                         "Valor Liquido": (stock.value * stock.quantity)
@@ -655,7 +890,7 @@ class Portfolio(Base):
                         "Taxa Custódia": taxa_custodia,
                         "Impostos": impostos,
                         "Outros": outros,
-                        "Day-trade": day_trade,
+                        "Day-trade": day_trade * stock.get_adjustment_factor(),
                     }
                 )
 
@@ -669,6 +904,8 @@ class Portfolio(Base):
     def get_brokerage_notes(
         self, start_date=START_DATE, end_date=datetime.now().date()
     ):
+        import pandas as pd
+
         # Filtrar as notas de corretagem do portfólio com datas entre o período
         brokerage_notes_within_period = [
             note
@@ -705,6 +942,8 @@ class Portfolio(Base):
     def print_broker_notes_taxas_table(
         self, start_date=START_DATE, end_date=datetime.now().date()
     ):
+        from tabulate import tabulate
+
         # Filtrar as notas de corretagem do portfólio com datas entre o período
         brokerage_notes = self.get_brokerage_notes(start_date, end_date)
 
@@ -748,56 +987,69 @@ class Portfolio(Base):
             )
 
         # Definir os cabeçalhos da tabela
-        table_headers = brokerage_notes.columns.values
+        table_headers = list(brokerage_notes.columns)
 
         # Imprimir a tabela formatada
         print(tabulate(table_data, headers=table_headers, tablefmt="pretty"))
 
-    def get_resume(self, start_date=START_DATE, end_date=datetime.now().date()):
+    def get_resume(
+        self,
+        start_date=START_DATE,
+        end_date=datetime.now().date(),
+        price_provider=None,
+    ):
+        import numpy as np
+        import pandas as pd
+
         data = []
         valor_total = 0
         pm_total = 0
 
+        session = Session.object_session(self)
+        positions = []
         for stock_symbol in self.get_unique_symbols_in_date_range(
             start_date=start_date, end_date=end_date
         ):
-            session = Session.object_session(self)
             pm, quantity = InvestmentManager.InvestmentManager(
                 session=session
             ).calculate_pm(stock_symbol, start_date=start_date, end_date=end_date)
 
-            stock = session.query(Stock).filter(Stock.symbol == stock_symbol).first()
-
             if quantity > 0:
-                if self.stock_exange == "BVMF":
-                    if datetime.now().year > end_date.year:
-                        yf_obj = yf.Ticker(stock_symbol + ".SA")
-                        current_price = yf_obj.history(
-                            start="{}-12-25".format(end_date.year),
-                            end="{}-12-31".format(end_date.year),
-                            interval="1d",
-                        )["Close"][-1]
-                    else:
-                        current_price = stock_info.get_live_price(stock_symbol + ".SA")
-
-                pm_total += quantity * pm
-                valor_total += quantity * current_price
-
-                data.append(
-                    {
-                        "Ticker": stock.symbol,
-                        "Tipo": stock.get_type(),
-                        "Quantidade": quantity,
-                        "Preço Médio": pm,
-                        "Valor Investido": quantity * pm,
-                        "Preço Atual": current_price,
-                        "Valor Atual": quantity * current_price,
-                        "Variação": quantity * (current_price - pm),
-                        "Variação (%)": quantity
-                        * (current_price - pm)
-                        / (quantity * pm),
-                    }
+                positions.append((stock_symbol, pm, quantity))
+
+        # Cotações de todos os ativos buscadas em um único lote; fechamentos de
+        # anos anteriores vêm da tabela de preços e só os que faltam são baixados
+        prices = {}
+        if self.stock_exange == "BVMF":
+            if price_provider is None:
+                price_provider = get_default_price_provider()
+            symbols = [stock_symbol for stock_symbol, _, _ in positions]
+            if datetime.now().year > end_date.year:
+                prices = Price.get_last_closes(
+                    session, symbols, date(end_date.year, 12, 31), price_provider
                 )
+            else:
+                prices = price_provider.get_prices(symbols)
+
+        for stock_symbol, pm, quantity in positions:
+            current_price = prices.get(stock_symbol, np.nan)
+
+            pm_total += quantity * pm
+            valor_total += quantity * current_price
+
+            data.append(
+                {
+                    "Ticker": stock_symbol,
+                    "Tipo": get_stock_type(stock_symbol, self.stock_exange),
+                    "Quantidade": quantity,
+                    "Preço Médio": pm,
+                    "Valor Investido": quantity * pm,
+                    "Preço Atual": current_price,
+                    "Valor Atual": quantity * current_price,
+                    "Variação": quantity * (current_price - pm),
+                    "Variação (%)": quantity * (current_price - pm) / (quantity * pm),
+                }
+            )
 
         data.append(
             {
@@ -813,6 +1065,8 @@ class Portfolio(Base):
         return df
 
     def get_year_diff(self, start_date=START_DATE, year=datetime.now().date().year):
+        import pandas as pd
+
         data = []
         valor_total = 0
         pm_total = 0
@@ -820,16 +1074,21 @@ class Portfolio(Base):
         end_date_i = date(year - 1, 12, 31)
         end_date_f = date(year, 12, 31)
 
-        for stock_symbol in self.get_unique_symbols_in_date_range(
+        # As duas posições de cada ativo saem de uma única passagem pelo livro
+        symbols = self.get_unique_symbols_in_date_range(
             start_date=start_date, end_date=end_date_f
-        ):
-            session = Session.object_session(self)
-            pm_i, quantity_i = InvestmentManager.InvestmentManager(
-                session=session
-            ).calculate_pm(stock_symbol, start_date=start_date, end_date=end_date_i)
-            pm_f, quantity_f = InvestmentManager.InvestmentManager(
-                session=session
-            ).calculate_pm(stock_symbol, start_date=start_date, end_date=end_date_f)
+        )
+        session = Session.object_session(self)
+        positions = InvestmentManager.InvestmentManager(
+            session=session
+        ).calculate_positions([end_date_i, end_date_f], symbols, start_date)
+
+        for stock_symbol in symbols:
+            position = positions.loc[stock_symbol.upper()]
+            pm_i = position[("Preço Médio", end_date_i)]
+            quantity_i = position[("Quantidade", end_date_i)]
+            pm_f = position[("Preço Médio", end_date_f)]
+            quantity_f = position[("Quantidade", end_date_f)]
 
             if quantity_i > 0 or quantity_f > 0:
                 pm_total_i = quantity_i * pm_i
@@ -846,59 +1105,53 @@ class Portfolio(Base):
         df = pd.DataFrame(data)
         return df
 
-    def get_ir_table_stock(self, start_date=START_DATE, end_date=datetime.now().date()):
+    def get_ir_table_stock(
+        self, start_date=START_DATE, end_date=datetime.now().date()
+    ):
+        return MonthlyTaxSummary.get_table(
+            self, TAX_CATEGORY_STOCK, start_date, end_date, self.calculate_ir_table_stock
+        )
+
+    def calculate_ir_table_stock(
+        self, start_date=START_DATE, end_date=datetime.now().date()
+    ):
+        import numpy as np
+        import pandas as pd
+
         data = []
 
-        for year in range(start_date.year, end_date.year + 1):
-            for month in range(
-                1 if start_date.year < year else start_date.month,
-                12 + 1 if year < end_date.year else end_date.month + 1,
-            ):
-                loss, imposto_devido_acumulado = self.get_accumulated_loss_and_ir_stock(
-                    start_date=START_DATE, end_date=date(year, month, 1)
-                )
+        # Uma única passagem desde a primeira nota, carregando o estado mês a mês
+        state = MonthlyTaxState(ALIQ_STOCK_BVMF)
+        for year, month in iter_months(min(self.get_first_date(), start_date), end_date):
+            gain_value, sales_value = self.get_gain_and_sales_for_month_stock(
+                year, month
+            )
+            total_gain = (
+                gain_value[STOCK_ACAO] + gain_value[STOCK_BDR] + gain_value[STOCK_ETF]
+            )
+            gain_free = (
+                gain_value[STOCK_ACAO]
+                if gain_value[STOCK_ACAO] > 0 and sales_value[STOCK_ACAO] < 20000
+                else 0
+            )
+            irrf = self.get_irrf_for_month_stock(year, month)
+
+            if (year, month) >= (start_date.year, start_date.month):
+                loss = state.loss
+                imposto_devido_acumulado = state.imposto_devido_acumulado
 
-                sales_value_stock = 0
-                sales_value_bdr = 0
-                sales_value_etf = 0
-                gain_acao_value = 0
-                gain_bdr_value = 0
-                gain_etf_value = 0
-                sales = self.get_sales_for_month(year, month)
-                if len(sales) > 0:
-                    start = True
-                    for sale in sales:
-                        if sale.get_type() == STOCK_ACAO:
-                            gain_value_r, sale_value_r = sale.calculate_gain_and_sale()
-                            sales_value_stock += sale_value_r
-                            gain_acao_value += gain_value_r
-                        elif sale.get_type() == STOCK_BDR:
-                            gain_value_r, sale_value_r = sale.calculate_gain_and_sale()
-                            sales_value_bdr += sale_value_r
-                            gain_bdr_value += gain_value_r
-                        elif sale.get_type() == STOCK_ETF:
-                            gain_value_r, sale_value_r = sale.calculate_gain_and_sale()
-                            sales_value_etf += sale_value_r
-                            gain_etf_value += gain_value_r
-
-                total_gain = gain_acao_value + gain_bdr_value + gain_etf_value
-                gain_free = (
-                    gain_acao_value
-                    if gain_acao_value > 0 and sales_value_stock < 20000
-                    else 0
-                )
                 base_calculo = total_gain + loss - gain_free
                 base_calculo = base_calculo if base_calculo > 0 else 0
                 imposto_devido = base_calculo * ALIQ_STOCK_BVMF
-                irrf = self.get_irrf_for_month_stock(year, month)
-                sales_value = sales_value_stock + sales_value_bdr + sales_value_etf
                 data.append(
                     {
                         "Mês": "{:04d}-".format(year) + "{:02d}".format(month),
-                        "Alienações": sales_value,
-                        "Lucro Ação": gain_acao_value,
-                        "Lucro BDR": gain_bdr_value,
-                        "Lucro ETF": gain_etf_value,
+                        "Alienações": sales_value[STOCK_ACAO]
+                        + sales_value[STOCK_BDR]
+                        + sales_value[STOCK_ETF],
+                        "Lucro Ação": gain_value[STOCK_ACAO],
+                        "Lucro BDR": gain_value[STOCK_BDR],
+                        "Lucro ETF": gain_value[STOCK_ETF],
                         "Lucro Isento": gain_free,
                         "Lucro Total": total_gain,
                         "Prejuizo a Compensar": loss,
@@ -921,71 +1174,53 @@ class Portfolio(Base):
                     }
                 )
 
+            state.advance(total_gain, irrf, gain_free)
+
         df = pd.DataFrame(data)
         return df
 
     def get_ir_table_stock_day_trade(
         self, start_date=START_DATE, end_date=datetime.now().date()
     ):
+        return MonthlyTaxSummary.get_table(
+            self, TAX_CATEGORY_STOCK_DAY_TRADE, start_date, end_date, self.calculate_ir_table_stock_day_trade
+        )
+
+    def calculate_ir_table_stock_day_trade(
+        self, start_date=START_DATE, end_date=datetime.now().date()
+    ):
+        import numpy as np
+        import pandas as pd
+
         data = []
 
-        for year in range(start_date.year, end_date.year + 1):
-            for month in range(
-                1 if start_date.year < year else start_date.month,
-                12 + 1 if year < end_date.year else end_date.month + 1,
-            ):
-                (
-                    loss,
-                    imposto_devido_acumulado,
-                ) = self.get_accumulated_loss_and_ir_stock_day_trade(
-                    start_date=START_DATE, end_date=date(year, month, 1)
-                )
+        # Uma única passagem desde a primeira nota, carregando o estado mês a mês
+        state = MonthlyTaxState(ALIQ_STOCK_DAY_TRADE_BVMF)
+        for year, month in iter_months(min(self.get_first_date(), start_date), end_date):
+            gain_value, sales_value = self.get_gain_and_sales_for_month_stock(
+                year, month, day_trade=True
+            )
+            total_gain = (
+                gain_value[STOCK_ACAO] + gain_value[STOCK_BDR] + gain_value[STOCK_ETF]
+            )
+            irrf = self.get_irrf_for_month_stock_day_trade(year, month)
+
+            if (year, month) >= (start_date.year, start_date.month):
+                loss = state.loss
+                imposto_devido_acumulado = state.imposto_devido_acumulado
 
-                sales_value_stock = 0
-                sales_value_bdr = 0
-                sales_value_etf = 0
-                gain_acao_value = 0
-                gain_bdr_value = 0
-                gain_etf_value = 0
-                sales = self.get_sales_for_month(year, month)
-                if len(sales) > 0:
-                    start = True
-                    for sale in sales:
-                        if sale.get_type() == STOCK_ACAO:
-                            (
-                                gain_value_r,
-                                sale_value_r,
-                            ) = sale.calculate_gain_and_sale_day_trade()
-                            sales_value_stock += sale_value_r
-                            gain_acao_value += gain_value_r
-                        elif sale.get_type() == STOCK_BDR:
-                            (
-                                gain_value_r,
-                                sale_value_r,
-                            ) = sale.calculate_gain_and_sale_day_trade()
-                            sales_value_bdr += sale_value_r
-                            gain_bdr_value += gain_value_r
-                        elif sale.get_type() == STOCK_ETF:
-                            (
-                                gain_value_r,
-                                sale_value_r,
-                            ) = sale.calculate_gain_and_sale_day_trade()
-                            sales_value_etf += sale_value_r
-                            gain_etf_value += gain_value_r
-
-                total_gain = gain_acao_value + gain_bdr_value + gain_etf_value
                 base_calculo = total_gain + loss
                 base_calculo = base_calculo if base_calculo > 0 else 0
                 imposto_devido = base_calculo * ALIQ_STOCK_DAY_TRADE_BVMF
-                irrf = self.get_irrf_for_month_stock_day_trade(year, month)
-                sales_value = sales_value_stock + sales_value_bdr + sales_value_etf
                 data.append(
                     {
                         "Mês": "{:04}".format(year) + "-{:02}".format(month),
-                        "Alienações": sales_value,
-                        "Lucro Ação": gain_acao_value,
-                        "Lucro BDR": gain_bdr_value,
-                        "Lucro ETF": gain_etf_value,
+                        "Alienações": sales_value[STOCK_ACAO]
+                        + sales_value[STOCK_BDR]
+                        + sales_value[STOCK_ETF],
+                        "Lucro Ação": gain_value[STOCK_ACAO],
+                        "Lucro BDR": gain_value[STOCK_BDR],
+                        "Lucro ETF": gain_value[STOCK_ETF],
                         "Lucro Total": total_gain,
                         "Prejuizo a Compensar": loss,
                         "Base de Cálculo": base_calculo,
@@ -1009,42 +1244,39 @@ class Portfolio(Base):
                     }
                 )
 
+            state.advance(total_gain, irrf)
+
         df = pd.DataFrame(data)
         return df
 
-    def get_ir_table_fii(self, start_date=START_DATE, end_date=datetime.now().date()):
+    def get_ir_table_fii(
+        self, start_date=START_DATE, end_date=datetime.now().date()
+    ):
+        return MonthlyTaxSummary.get_table(
+            self, TAX_CATEGORY_FII, start_date, end_date, self.calculate_ir_table_fii
+        )
+
+    def calculate_ir_table_fii(
+        self, start_date=START_DATE, end_date=datetime.now().date()
+    ):
+        import numpy as np
+        import pandas as pd
+
         data = []
 
-        for year in range(start_date.year, end_date.year + 1):
-            for month in range(
-                1 if start_date.year < year else start_date.month,
-                12 + 1 if year < end_date.year else end_date.month + 1,
-            ):
-                loss, imposto_devido_acumulado = self.get_accumulated_loss_and_ir_fii(
-                    start_date=START_DATE, end_date=date(year, month, 1)
-                )
+        # Uma única passagem desde a primeira nota, carregando o estado mês a mês
+        state = MonthlyTaxState(ALIQ_FII_BVMF)
+        for year, month in iter_months(min(self.get_first_date(), start_date), end_date):
+            total_gain, sales_value = self.get_gain_and_sales_for_month_fii(year, month)
+            irrf = self.get_irrf_for_month_fii(year, month)
+
+            if (year, month) >= (start_date.year, start_date.month):
+                loss = state.loss
+                imposto_devido_acumulado = state.imposto_devido_acumulado
 
-                sales_value_fii = 0
-                gain_fii = 0
-                sales = self.get_sales_for_month(year, month)
-                if len(sales) > 0:
-                    start = True
-                    for sale in sales:
-                        if sale.get_type() == STOCK_FII:
-                            gain_value_f, sale_value_f = sale.calculate_gain_and_sale()
-                            (
-                                gain_value_day_trade_f,
-                                sale_value_day_trade_f,
-                            ) = sale.calculate_gain_and_sale_day_trade()
-                            sales_value_fii += sale_value_f + sale_value_day_trade_f
-                            gain_fii += gain_value_f + gain_value_day_trade_f
-
-                total_gain = gain_fii
                 base_calculo = total_gain + loss
                 base_calculo = base_calculo if base_calculo > 0 else 0
                 imposto_devido = base_calculo * ALIQ_FII_BVMF
-                irrf = self.get_irrf_for_month_fii(year, month)
-                sales_value = sales_value_fii
                 data.append(
                     {
                         "Mês": "{:04d}".format(year) + "-{:02d}".format(month),
@@ -1072,45 +1304,54 @@ class Portfolio(Base):
                     }
                 )
 
-        # Definir os cabeçalhos da tabela
-        table_headers = [
-            "Mês",
-            "Alienações",
-            "Lucro",
-            "Prejuizo a Compensar",
-            "Base de Cálculo",
-            "Imposto Devido",
-            "I.R.R.F no mês",
-            "Imposto a Pagar",
-            "Data de Pagamento",
-        ]
+            state.advance(total_gain, irrf)
 
         df = pd.DataFrame(data)
         return df
 
-    def get_sales_for_month(self, year, month):
-        sales = []
+    def get_gain_and_sales_for_month_stock(self, year, month, day_trade=False):
+        gain_value = {STOCK_ACAO: 0, STOCK_BDR: 0, STOCK_ETF: 0}
+        sales_value = {STOCK_ACAO: 0, STOCK_BDR: 0, STOCK_ETF: 0}
 
-        # Percorra as notas de corretagem
-        for note in self.brokerage_notes:
-            if note.date >= date(year, month, 1) and note.date < date(
-                year if month < 12 else year + 1, month + 1 if month < 12 else 1, 1
-            ):
-                for stock in note.stocks:
-                    if stock.operation == STOCK_SALE:
-                        sales.append(stock)
+        for sale in self.get_sales_for_month(year, month):
+            type_stock = sale.get_type()
+            if type_stock in gain_value:
+                if day_trade:
+                    gain_value_r, sale_value_r = sale.calculate_gain_and_sale_day_trade()
+                else:
+                    gain_value_r, sale_value_r = sale.calculate_gain_and_sale()
+                gain_value[type_stock] += gain_value_r
+                sales_value[type_stock] += sale_value_r
 
-        return sales
+        return gain_value, sales_value
+
+    def get_gain_and_sales_for_month_fii(self, year, month):
+        gain_fii = 0
+        sales_value_fii = 0
+
+        for sale in self.get_sales_for_month(year, month):
+            if sale.get_type() == STOCK_FII:
+                gain_value_f, sale_value_f = sale.calculate_gain_and_sale()
+                (
+                    gain_value_day_trade_f,
+                    sale_value_day_trade_f,
+                ) = sale.calculate_gain_and_sale_day_trade()
+                sales_value_fii += sale_value_f + sale_value_day_trade_f
+                gain_fii += gain_value_f + gain_value_day_trade_f
+
+        return gain_fii, sales_value_fii
+
+    def get_sales_for_month(self, year, month):
+        return list(self.get_month_index()["sales"].get((year, month), []))
 
     def get_sales_before_month(self, year, month):
         sales = []
 
-        # Percorra as notas de corretagem
-        for note in self.brokerage_notes:
-            if note.date < date(year, month, 1):
-                for stock in note.stocks:
-                    if stock.operation == STOCK_SALE:
-                        sales.append(stock)
+        sales_index = self.get_month_index()["sales"]
+        for key in sorted(sales_index):
+            if key >= (year, month):
+                break
+            sales += sales_index[key]
 
         return sales
 
@@ -1119,193 +1360,113 @@ class Portfolio(Base):
     ):
         if start_date == START_DATE:
             start_date = self.get_first_date()
-        loss = 0
-        imposto_devido_acumulado = 0
-        for year_l in range(start_date.year, end_date.year + 1):
-            for month_l in range(
-                1 if year_l > start_date.year else start_date.month,
-                end_date.month if year_l == end_date.year else 12 + 1,
-            ):
-                sales_value_stock = 0
-                gain_acao_value = 0
-                gain_bdr_value = 0
-                gain_etf_value = 0
-                sales = self.get_sales_for_month(year_l, month_l)
-                if len(sales) > 0:
-                    for sale in sales:
-                        if sale.get_type() == STOCK_ACAO:
-                            gain_value_r, sale_value_r = sale.calculate_gain_and_sale()
-                            sales_value_stock += sale_value_r
-                            gain_acao_value += gain_value_r
-                        elif sale.get_type() == STOCK_BDR:
-                            gain_value_r, _ = sale.calculate_gain_and_sale()
-                            gain_bdr_value += gain_value_r
-                        elif sale.get_type() == STOCK_ETF:
-                            gain_value_r, _ = sale.calculate_gain_and_sale()
-                            gain_etf_value += gain_value_r
-
-                total_gain = gain_acao_value + gain_bdr_value + gain_etf_value
-                gain_free = (
-                    gain_acao_value
-                    if gain_acao_value > 0 and sales_value_stock < 20000
-                    else 0
-                )
-                loss += total_gain - gain_free
-                loss = loss if loss < 0 else 0
-                base_calculo = total_gain + loss - gain_free
-                base_calculo = base_calculo if base_calculo > 0 else 0
-                imposto_devido_acumulado += (
-                    base_calculo * ALIQ_STOCK_BVMF
-                    - self.get_irrf_for_month_stock(year_l, month_l)
-                )
-        return loss, imposto_devido_acumulado
+        state = MonthlyTaxState(ALIQ_STOCK_BVMF)
+        for year_l, month_l in iter_months(start_date, end_date):
+            if (year_l, month_l) == (end_date.year, end_date.month):
+                break
+            gain_value, sales_value = self.get_gain_and_sales_for_month_stock(
+                year_l, month_l
+            )
+            total_gain = (
+                gain_value[STOCK_ACAO] + gain_value[STOCK_BDR] + gain_value[STOCK_ETF]
+            )
+            gain_free = (
+                gain_value[STOCK_ACAO]
+                if gain_value[STOCK_ACAO] > 0 and sales_value[STOCK_ACAO] < 20000
+                else 0
+            )
+            state.advance(
+                total_gain, self.get_irrf_for_month_stock(year_l, month_l), gain_free
+            )
+        return state.loss, state.imposto_devido_acumulado
 
     def get_accumulated_loss_and_ir_stock_day_trade(
         self, start_date=START_DATE, end_date=datetime.now().date()
     ):
         if start_date == START_DATE:
             start_date = self.get_first_date()
-        loss = 0
-        imposto_devido_acumulado = 0
-        for year_l in range(start_date.year, end_date.year + 1):
-            for month_l in range(
-                1 if year_l > start_date.year else start_date.month,
-                end_date.month if year_l == end_date.year else 12 + 1,
-            ):
-                sales_value_stock = 0
-                gain_acao_value = 0
-                gain_bdr_value = 0
-                gain_etf_value = 0
-                sales = self.get_sales_for_month(year_l, month_l)
-                if len(sales) > 0:
-                    for sale in sales:
-                        if sale.get_type() == STOCK_ACAO:
-                            (
-                                gain_value_r,
-                                sale_value_r,
-                            ) = sale.calculate_gain_and_sale_day_trade()
-                            sales_value_stock += sale_value_r
-                            gain_acao_value += gain_value_r
-                        elif sale.get_type() == STOCK_BDR:
-                            gain_value_r, _ = sale.calculate_gain_and_sale_day_trade()
-                            gain_bdr_value += gain_value_r
-                        elif sale.get_type() == STOCK_ETF:
-                            gain_value_r, _ = sale.calculate_gain_and_sale_day_trade()
-                            gain_etf_value += gain_value_r
-
-                total_gain = gain_acao_value + gain_bdr_value + gain_etf_value
-                loss += total_gain
-                loss = loss if loss < 0 else 0
-                base_calculo = total_gain + loss
-                base_calculo = base_calculo if base_calculo > 0 else 0
-                imposto_devido_acumulado += (
-                    base_calculo * ALIQ_STOCK_DAY_TRADE_BVMF
-                    - self.get_irrf_for_month_stock_day_trade(year_l, month_l)
-                )
-        return loss, imposto_devido_acumulado
+        state = MonthlyTaxState(ALIQ_STOCK_DAY_TRADE_BVMF)
+        for year_l, month_l in iter_months(start_date, end_date):
+            if (year_l, month_l) == (end_date.year, end_date.month):
+                break
+            gain_value, _ = self.get_gain_and_sales_for_month_stock(
+                year_l, month_l, day_trade=True
+            )
+            total_gain = (
+                gain_value[STOCK_ACAO] + gain_value[STOCK_BDR] + gain_value[STOCK_ETF]
+            )
+            state.advance(
+                total_gain, self.get_irrf_for_month_stock_day_trade(year_l, month_l)
+            )
+        return state.loss, state.imposto_devido_acumulado
 
     def get_accumulated_loss_and_ir_fii(
         self, start_date=START_DATE, end_date=datetime.now().date()
     ):
         if start_date == START_DATE:
             start_date = self.get_first_date()
-        loss = 0
-        imposto_devido_acumulado = 0
-        for year_l in range(start_date.year, end_date.year + 1):
-            for month_l in range(
-                1 if year_l > start_date.year else start_date.month,
-                end_date.month if year_l == end_date.year else 12 + 1,
-            ):
-                gain_value = 0
-                sales = self.get_sales_for_month(year_l, month_l)
-                if len(sales) > 0:
-                    for sale in sales:
-                        if sale.get_type() == STOCK_FII:
-                            gain_value_f, _ = sale.calculate_gain_and_sale()
-                            (
-                                gain_value_day_trade_f,
-                                _,
-                            ) = sale.calculate_gain_and_sale_day_trade()
-                            gain_value += gain_value_f + gain_value_day_trade_f
-
-                total_gain = gain_value
-                loss += total_gain
-                loss = loss if loss < 0 else 0
-                base_calculo = total_gain + loss
-                base_calculo = base_calculo if base_calculo > 0 else 0
-                imposto_devido_acumulado += (
-                    base_calculo * ALIQ_FII_BVMF
-                    - self.get_irrf_for_month_fii(year_l, month_l)
-                )
-        return loss, imposto_devido_acumulado
+        state = MonthlyTaxState(ALIQ_FII_BVMF)
+        for year_l, month_l in iter_months(start_date, end_date):
+            if (year_l, month_l) == (end_date.year, end_date.month):
+                break
+            total_gain, _ = self.get_gain_and_sales_for_month_fii(year_l, month_l)
+            state.advance(total_gain, self.get_irrf_for_month_fii(year_l, month_l))
+        return state.loss, state.imposto_devido_acumulado
 
     def get_irrf_for_month_stock(self, year, month):
-        irrf = 0
+        irrf_index = self.get_month_index()["irrf"]
+        key = (TAX_CATEGORY_STOCK, year, month)
 
-        # Filtrar as notas de corretagem do portfólio com datas entre o período
-        brokerage_notes_within_period = [
-            note
-            for note in self.brokerage_notes
-            if date(year, month, 1)
-            <= (note.date)
-            <= date(year if month < 12 else year + 1, month + 1 if month < 12 else 1, 1)
-        ]
-
-        brokerage_notes_within_period = sorted(
-            brokerage_notes_within_period, key=lambda note: note.date
-        )
-
-        for brokerage_note in brokerage_notes_within_period:
-            irrf += brokerage_note.get_irrf_swing_trade_stocks()
-        return irrf
+        if key not in irrf_index:
+            irrf = 0
+            for brokerage_note in self.get_brokerage_notes_for_irrf(year, month):
+                irrf += brokerage_note.get_irrf_swing_trade_stocks()
+            irrf_index[key] = irrf
+        return irrf_index[key]
 
     def get_irrf_for_month_stock_day_trade(self, year, month):
-        irrf = 0
-
-        # Filtrar as notas de corretagem do portfólio com datas entre o período
-        brokerage_notes_within_period = [
-            note
-            for note in self.brokerage_notes
-            if date(year, month, 1)
-            <= (note.date)
-            <= date(year if month < 12 else year + 1, month + 1 if month < 12 else 1, 1)
-        ]
+        irrf_index = self.get_month_index()["irrf"]
+        key = (TAX_CATEGORY_STOCK_DAY_TRADE, year, month)
 
-        brokerage_notes_within_period = sorted(
-            brokerage_notes_within_period, key=lambda note: note.date
-        )
-
-        for brokerage_note in brokerage_notes_within_period:
-            irrf += brokerage_note.get_irrf_day_trade_stocks()
-        return irrf
+        if key not in irrf_index:
+            irrf = 0
+            for brokerage_note in self.get_brokerage_notes_for_irrf(year, month):
+                irrf += brokerage_note.get_irrf_day_trade_stocks()
+            irrf_index[key] = irrf
+        return irrf_index[key]
 
     def get_irrf_for_month_fii(self, year, month):
-        irrf = 0
+        irrf_index = self.get_month_index()["irrf"]
+        key = (TAX_CATEGORY_FII, year, month)
+
+        if key not in irrf_index:
+            irrf = 0
+            for brokerage_note in self.get_brokerage_notes_for_irrf(year, month):
+                irrf += (
+                    brokerage_note.get_irrf_day_trade_fii()
+                    + brokerage_note.get_irrf_swing_trade_fii()
+                )
+            irrf_index[key] = irrf
+        return irrf_index[key]
 
-        # Filtrar as notas de corretagem do portfólio com datas entre o período
-        brokerage_notes_within_period = [
-            note
-            for note in self.brokerage_notes
-            if date(year, month, 1)
-            <= (note.date)
-            <= date(year if month < 12 else year + 1, month + 1 if month < 12 else 1, 1)
-        ]
+    def get_brokerage_notes_for_irrf(self, year, month):
+        # Notas do mês e, como sempre foi considerado, as do dia 1º do mês seguinte
+        notes_index = self.get_month_index()["notes"]
+        next_month = (year, month + 1) if month < 12 else (year + 1, 1)
 
         brokerage_notes_within_period = sorted(
-            brokerage_notes_within_period, key=lambda note: note.date
+            notes_index.get((year, month), []), key=lambda note: note.date
         )
-
-        for brokerage_note in brokerage_notes_within_period:
-            irrf += (
-                brokerage_note.get_irrf_day_trade_fii()
-                + brokerage_note.get_irrf_swing_trade_fii()
-            )
-        return irrf
+        brokerage_notes_within_period += [
+            note for note in notes_index.get(next_month, []) if note.date.day == 1
+        ]
+        return brokerage_notes_within_period
 
     def get_all_sales(self):
         sales = []
 
         # Percorra as notas de corretagem
+        self.load_brokerage_notes_stocks()
         for note in self.brokerage_notes:
             for stock in note.stocks:
                 if stock.operation == STOCK_SALE:
@@ -1316,6 +1477,9 @@ class Portfolio(Base):
     def print_brokerage_notes_table(
         self, start_date=START_DATE, end_date=datetime.now().date()
     ):
+        import pandas as pd
+        from tabulate import tabulate
+
         brokerage_notes = self.get_brokerage_notes_stocks(start_date, end_date)
         table_data = []
         if len(brokerage_notes) > 0:
@@ -1381,14 +1545,23 @@ class Portfolio(Base):
                 )
 
         # Definir os cabeçalhos da tabela
-        table_headers = brokerage_notes.columns.values
+        table_headers = list(brokerage_notes.columns)
 
         # Imprimir a tabela formatada
         print(tabulate(table_data, headers=table_headers, tablefmt="pretty"))
 
-    def print_resume(self, start_date=START_DATE, end_date=datetime.now().date()):
+    def print_resume(
+        self,
+        start_date=START_DATE,
+        end_date=datetime.now().date(),
+        price_provider=None,
+    ):
+        from tabulate import tabulate
+
         table_data = []
-        stocks = self.get_resume(start_date=start_date, end_date=end_date)
+        stocks = self.get_resume(
+            start_date=start_date, end_date=end_date, price_provider=price_provider
+        )
 
         for stock in stocks.iloc:
             type_stock = stock["Tipo"]
@@ -1424,39 +1597,44 @@ class Portfolio(Base):
             )
 
         # Definir os cabeçalhos da tabela
-        table_headers = stocks.columns.values
+        table_headers = list(stocks.columns)
 
         # Imprimir a tabela formatada
         print(tabulate(table_data, headers=table_headers, tablefmt="pretty"))
 
     def print_year_diff(self, start_date=START_DATE, year=datetime.now().date().year):
+        from tabulate import tabulate
+
         table_data = []
         stocks = self.get_year_diff(start_date, year)
 
         for stock in stocks.iloc:
             table_data.append(
                 [
-                    stock[0],
-                    "R$ {:.2f}".format(stock[1]),
-                    "R$ {:.2f}".format(stock[2]),
+                    stock.iloc[0],
+                    "R$ {:.2f}".format(stock.iloc[1]),
+                    "R$ {:.2f}".format(stock.iloc[2]),
                 ]
             )
 
         # Definir os cabeçalhos da tabela
-        table_headers = stocks.columns.values
+        table_headers = list(stocks.columns)
 
         # Imprimir a tabela formatada
         print(tabulate(table_data, headers=table_headers, tablefmt="pretty"))
 
     def print_ir_table_stock_day_trade(
-        self, start_date=START_DATE, end_date=datetime.now().date()
+        self, start_date=START_DATE, end_date=datetime.now().date(), tax_engine=None
     ):
+        import pandas as pd
+        from tabulate import tabulate
+
         table_data = []
 
         if start_date == START_DATE:
             start_date = self.get_first_date()
 
-        stocks = self.get_ir_table_stock_day_trade(start_date, end_date)
+        stocks = (tax_engine or self).get_ir_table_stock_day_trade(start_date, end_date)
         stocks["Data de Pagamento"] = pd.to_datetime(stocks["Data de Pagamento"])
         stocks["Mês"] = pd.to_datetime(stocks["Mês"])
 
@@ -1501,20 +1679,23 @@ class Portfolio(Base):
             )
 
         # Definir os cabeçalhos da tabela
-        table_headers = stocks.columns.values
+        table_headers = list(stocks.columns)
 
         # Imprimir a tabela formatada
         print(tabulate(table_data, headers=table_headers, tablefmt="pretty"))
 
     def print_ir_table_stock(
-        self, start_date=START_DATE, end_date=datetime.now().date()
+        self, start_date=START_DATE, end_date=datetime.now().date(), tax_engine=None
     ):
+        import pandas as pd
+        from tabulate import tabulate
+
         table_data = []
 
         if start_date == START_DATE:
             start_date = self.get_first_date()
 
-        stocks = self.get_ir_table_stock(start_date, end_date)
+        stocks = (tax_engine or self).get_ir_table_stock(start_date, end_date)
         stocks["Data de Pagamento"] = pd.to_datetime(stocks["Data de Pagamento"])
         stocks["Mês"] = pd.to_datetime(stocks["Mês"])
 
@@ -1562,18 +1743,23 @@ class Portfolio(Base):
             )
 
         # Definir os cabeçalhos da tabela
-        table_headers = stocks.columns.values
+        table_headers = list(stocks.columns)
 
         # Imprimir a tabela formatada
         print(tabulate(table_data, headers=table_headers, tablefmt="pretty"))
 
-    def print_ir_table_fii(self, start_date=START_DATE, end_date=datetime.now().date()):
+    def print_ir_table_fii(
+        self, start_date=START_DATE, end_date=datetime.now().date(), tax_engine=None
+    ):
+        import pandas as pd
+        from tabulate import tabulate
+
         table_data = []
 
         if start_date == START_DATE:
             start_date = self.get_first_date()
 
-        stocks = self.get_ir_table_fii(start_date, end_date)
+        stocks = (tax_engine or self).get_ir_table_fii(start_date, end_date)
         stocks["Data de Pagamento"] = pd.to_datetime(stocks["Data de Pagamento"])
         stocks["Mês"] = pd.to_datetime(stocks["Mês"])
 
@@ -1609,7 +1795,7 @@ class Portfolio(Base):
             )
 
         # Definir os cabeçalhos da tabela
-        table_headers = stocks.columns.values
+        table_headers = list(stocks.columns)
 
         # Imprimir a tabela formatada
         print(tabulate(table_data, headers=table_headers, tablefmt="pretty"))
@@ -1645,16 +1831,25 @@ class Portfolio(Base):
         filename="Investimentos.xlsx",
         start_date=START_DATE,
         end_date=datetime.now().date(),
+        price_provider=None,
+        tax_engine=None,
     ):
+        import pandas as pd
+
         if start_date == START_DATE:
             start_date = self.get_first_date()
 
-        resume = self.get_resume(start_date, end_date)
+        # tax_engine: objeto com os mesmos get_ir_table_* (ex.: VectorizedTaxEngine)
+        tax_engine = tax_engine or self
+
+        resume = self.get_resume(start_date, end_date, price_provider)
         notes = self.get_brokerage_notes_stocks(start_date, end_date)
         notes_taxas = self.get_brokerage_notes(start_date, end_date)
-        stocks_swing_trade = self.get_ir_table_stock(start_date, end_date)
-        stocks_day_trade = self.get_ir_table_stock_day_trade(start_date, end_date)
-        fiis = self.get_ir_table_fii(start_date, end_date)
+        stocks_swing_trade = tax_engine.get_ir_table_stock(start_date, end_date)
+        stocks_day_trade = tax_engine.get_ir_table_stock_day_trade(
+            start_date, end_date
+        )
+        fiis = tax_engine.get_ir_table_fii(start_date, end_date)
         year_diff = self.get_year_diff(START_DATE, end_date.year)
         with pd.ExcelWriter(filename) as writer:
             resume.to_excel(writer, sheet_name="Resumo")
@@ -1670,6 +1865,10 @@ class Portfolio(Base):
 
 class Stock(Base):
     __tablename__ = "stocks"
+    __table_args__ = (
+        Index("ix_stocks_symbol_brokerage_note_id", "symbol", "brokerage_note_id"),
+        Index("ix_stocks_brokerage_note_id", "brokerage_note_id"),
+    )
 
     id = Column(Integer, primary_key=True)
     brokerage_note_id = Column(Integer, ForeignKey("brokerage_notes.id"))
@@ -1681,224 +1880,477 @@ class Stock(Base):
     brokerage_note = relationship("BrokerageNote", back_populates="stocks")
 
     def get_type(self):
-        actions = ["SANB11"]
-        etf = [
-            "BOVA11",  # ETF que replica o Ibovespa
-            "SMAL11",  # ETF que replica o Índice Small Cap (SMLL)
-            "IVVB11",  # ETF que replica o S&P 500
-            "FIXA11",  # ETF de renda fixa
-            "GOAU11",  # ETF de ações do setor de mineração (GOAU)
-            "QBTC11",
-        ]
-        if self.brokerage_note.portfolio.stock_exange.upper() == "BVMF":
-            number = extract_numbers_from_symbol(self.symbol)
-            if (
-                self.symbol.upper() in actions
-                or number == 4
-                or number == 3
-                or number == 5
-                or number == 6
-            ):
-                return STOCK_ACAO
-            elif self.symbol.upper() in etf:
-                return STOCK_ETF
-            elif number == 11:
-                return STOCK_FII
-            elif number == 33:
-                return STOCK_BDR
+        return get_stock_type(self.symbol, self.brokerage_note.portfolio.stock_exange)
 
-    def check_day_trade(self):
-        symbol = self.symbol
-        date = self.brokerage_note.date
-        brokerage_note = self.brokerage_note
-        id = self.id
-        session = Session.object_session(self)
+    ## Valores ajustados pelos eventos societários. quantity e value guardam o
+    ## que está na nota; os valores financeiros (quantidade x preço) não mudam
 
-        # Consulta SQLAlchemy para retornar os stocks ordenados pela data do note
-        query = (
-            session.query(Stock)
-            .filter(Stock.symbol == symbol)
-            .filter(Stock.brokerage_note == brokerage_note)
-            .join(Stock.brokerage_note)
-            .filter(BrokerageNote.date == date)
-            .order_by(Stock.id)
+    def get_adjustment_factor(self):
+        return self.brokerage_note.portfolio.get_adjustment_factor(
+            self.symbol, self.brokerage_note.date
         )
 
-        # Execute a consulta e recupere os resultados
-        result = query.all()
+    def get_quantity(self):
+        return self.quantity * self.get_adjustment_factor()
 
-        buy = []
-        sale = []
-        for stock in result:
-            if stock.operation == STOCK_BUY:
-                buy.append(stock)
-            elif stock.operation == STOCK_SALE:
-                sale.append(stock)
+    def get_value(self):
+        return self.value / self.get_adjustment_factor()
 
-        for buy_l, sale_l in zip(buy, sale):
-            if buy_l.id == id or sale_l.id == id:
-                return min(buy_l.quantity, sale_l.quantity)
-        return 0
+    def check_day_trade(self):
+        quantity, _, _ = self.brokerage_note.get_day_trades().get(self.id, (0, 0, 0))
+        return quantity
 
     def calculate_gain_and_sale_day_trade(self):
-        symbol = self.symbol
-        date = self.brokerage_note.date
-        brokerage_note = self.brokerage_note
-        id = self.id
-        session = Session.object_session(self)
-
-        # Consulta SQLAlchemy para retornar os stocks ordenados pela data do note
-        query = (
-            session.query(Stock)
-            .filter(Stock.symbol == symbol)
-            .filter(Stock.brokerage_note == brokerage_note)
-            .join(Stock.brokerage_note)
-            .filter(BrokerageNote.date == date)
-            .order_by(Stock.id)
-        )
-
-        # Execute a consulta e recupere os resultados
-        result = query.all()
-
-        buy = []
-        sale = []
-        for stock in result:
-            if stock.operation == STOCK_BUY:
-                buy.append(stock)
-            elif stock.operation == STOCK_SALE:
-                sale.append(stock)
-
-        for buy_l, sale_l in zip(buy, sale):
-            if buy_l.id == id or sale_l.id == id:
-                return (sale_l.value - buy_l.value) * min(
-                    buy_l.quantity, sale_l.quantity
-                ), sale_l.value * min(buy_l.quantity, sale_l.quantity)
-        return 0, 0
+        _, gain, sale = self.brokerage_note.get_day_trades().get(self.id, (0, 0, 0))
+        return gain, sale
 
     def calculate_gain_and_sale(self):
         day_trade = self.check_day_trade()
         sales_value = self.value * (self.quantity - day_trade)
         session = Session.object_session(self)
+        # O PM está na base atual, então o preço e a quantidade também
+        factor = self.get_adjustment_factor()
         gain_value = (
-            self.value
+            self.value / factor
             - InvestmentManager.InvestmentManager(session=session).calculate_pm(
                 self.symbol, end_date=self.brokerage_note.date
             )[0]
-        ) * (self.quantity - day_trade)
+        ) * ((self.quantity - day_trade) * factor)
         return gain_value, sales_value
 
     def get_taxa_liquidacao(self):
-        return (
-            self.brokerage_note.taxa_liquidacao
-            * ((self.value * self.quantity) / self.brokerage_note.get_total_value())
-            if self.brokerage_note.get_total_value() > 0
-            else 0
-        )
+        return self.brokerage_note.get_fees()[self.id]["taxa_liquidacao"]
 
     def get_taxa_registro(self):
-        return (
-            self.brokerage_note.taxa_registro
-            * ((self.value * self.quantity) / self.brokerage_note.get_total_value())
-            if self.brokerage_note.get_total_value() > 0
-            else 0
-        )
+        return self.brokerage_note.get_fees()[self.id]["taxa_registro"]
 
     def get_taxa_termo_opcoes(self):
-        return (
-            self.brokerage_note.taxa_termo_opcoes
-            * ((self.value * self.quantity) / self.brokerage_note.get_total_value())
-            if self.brokerage_note.get_total_value() > 0
-            else 0
-        )
+        return self.brokerage_note.get_fees()[self.id]["taxa_termo_opcoes"]
 
     def get_taxa_ana(self):
-        return (
-            self.brokerage_note.taxa_ana
-            * ((self.value * self.quantity) / self.brokerage_note.get_total_value())
-            if self.brokerage_note.get_total_value() > 0
-            else 0
-        )
+        return self.brokerage_note.get_fees()[self.id]["taxa_ana"]
 
     def get_emolumentos(self):
-        return (
-            self.brokerage_note.emolumentos
-            * ((self.value * self.quantity) / self.brokerage_note.get_total_value())
-            if self.brokerage_note.get_total_value() > 0
-            else 0
-        )
+        return self.brokerage_note.get_fees()[self.id]["emolumentos"]
 
     def get_corretagem(self):
-        return (
-            self.brokerage_note.corretagem
-            * ((self.value * self.quantity) / self.brokerage_note.get_total_value())
-            if self.brokerage_note.get_total_value() > 0
-            else 0
-        )
+        return self.brokerage_note.get_fees()[self.id]["corretagem"]
 
     def get_taxa_custodia(self):
-        return (
-            self.brokerage_note.taxa_custodia
-            * ((self.value * self.quantity) / self.brokerage_note.get_total_value())
-            if self.brokerage_note.get_total_value() > 0
-            else 0
-        )
+        return self.brokerage_note.get_fees()[self.id]["taxa_custodia"]
 
     def get_impostos(self):
-        return (
-            self.brokerage_note.impostos
-            * ((self.value * self.quantity) / self.brokerage_note.get_total_value())
-            if self.brokerage_note.get_total_value() > 0
-            else 0
-        )
+        return self.brokerage_note.get_fees()[self.id]["impostos"]
 
     def get_outros(self):
-        return (
-            self.brokerage_note.outros
-            * ((self.value * self.quantity) / self.brokerage_note.get_total_value())
-            if self.brokerage_note.get_total_value() > 0
-            else 0
-        )
+        return self.brokerage_note.get_fees()[self.id]["outros"]
 
     def get_irrf(self):
-        day_trade = self.check_day_trade()
-        irrf = 0
-        irrf += (
-            self.brokerage_note.get_irrf_swing_trade()
-            * (
-                (self.value * (self.quantity - day_trade))
-                / self.brokerage_note.get_total_value_sale_swing_trade()
+        return self.brokerage_note.get_fees()[self.id]["irrf"]
+
+    def get_taxas(self):
+        return self.brokerage_note.get_fees()[self.id]["taxas"]
+
+
+
+def _clear_brokerage_note_cache(target, *args):
+    if target is None:
+        # Objeto já coletado, expirado pelo rollback
+        return
+    if isinstance(target, BrokerageNote):
+        brokerage_note = target
+    else:
+        # Só a nota já carregada na sessão: não dispara o lazy load
+        brokerage_note = vars(target).get("brokerage_note")
+        session = Session.object_session(target)
+        brokerage_note_id = vars(target).get("brokerage_note_id")
+        if brokerage_note is None and session is not None and brokerage_note_id:
+            brokerage_note = session.identity_map.get(
+                Session.identity_key(BrokerageNote, brokerage_note_id)
             )
-            if self.brokerage_note.get_total_value_sale_swing_trade() > 0
-            else 0
+    if brokerage_note is not None:
+        brokerage_note.clear_cache()
+
+
+# Os caches da nota deixam de valer quando um ativo, a lista de ativos ou uma
+# taxa mudam, e quando a nota ou um ativo são recarregados ou expirados (ex.:
+# session.refresh ou rollback)
+for attribute in [Stock.symbol, Stock.quantity, Stock.value, Stock.operation] + [
+    getattr(BrokerageNote, column) for column in BROKERAGE_NOTE_FEES + ["irrf"]
+]:
+    event.listen(attribute, "set", _clear_brokerage_note_cache)
+for name in ["append", "remove"]:
+    event.listen(BrokerageNote.stocks, name, _clear_brokerage_note_cache)
+for cls in [BrokerageNote, Stock]:
+    for name in ["refresh", "expire"]:
+        event.listen(cls, name, _clear_brokerage_note_cache)
+
+
+class Price(Base):
+    __tablename__ = "prices"
+    __table_args__ = (UniqueConstraint("symbol", "date"),)
+
+    id = Column(Integer, primary_key=True)
+    symbol = Column(String)
+    date = Column(Date)
+    close = Column(Float)
+
+    @classmethod
+    def get_last_closes(
+        cls, session, symbols, end_date, price_provider=None, days=6
+    ):
+        # Último fechamento em [end_date - days, end_date) de cada ativo. O que
+        # não estiver na tabela é baixado de uma vez e gravado
+        start_date = end_date - timedelta(days=days)
+        if not has_table(session, cls.__table__):
+            # Sem a tabela de preços: os fechamentos são baixados, sem gravar
+            if price_provider is None:
+                return {}
+            history = price_provider.get_history(symbols, start_date, end_date)
+            return {
+                symbol: max(closes)[1] for symbol, closes in history.items() if closes
+            }
+        closes = cls.query_last_closes(session, symbols, start_date, end_date)
+
+        missing = [symbol for symbol in symbols if symbol not in closes]
+        if missing and price_provider is not None:
+            cls.store(
+                session, price_provider.get_history(missing, start_date, end_date)
+            )
+            closes.update(
+                cls.query_last_closes(session, missing, start_date, end_date)
+            )
+        return closes
+
+    @classmethod
+    def query_last_closes(cls, session, symbols, start_date, end_date):
+        query = (
+            session.query(cls.symbol, cls.close)
+            .filter(cls.symbol.in_(symbols))
+            .filter(start_date <= cls.date)
+            .filter(cls.date < end_date)
+            .order_by(cls.date)
         )
-        irrf += (
-            self.brokerage_note.get_irrf_day_trade()
-            * (
-                (self.value * day_trade)
-                / self.brokerage_note.get_total_value_sale_day_trade()
+        return {symbol: close for symbol, close in query.all()}
+
+    @classmethod
+    def query_history(cls, session, symbols, start_date, end_date):
+        # Fechamentos gravados em [start_date, end_date): [(symbol, date, close)]
+        # em ordem de data
+        if not has_table(session, cls.__table__):
+            return []
+        query = (
+            session.query(cls.symbol, cls.date, cls.close)
+            .filter(cls.symbol.in_(symbols))
+            .filter(start_date <= cls.date)
+            .filter(cls.date < end_date)
+            .order_by(cls.date)
+        )
+        return query.all()
+
+    @classmethod
+    def store(cls, session, history):
+        # history: {symbol: [(date, close), ...]}; ignora o que já está gravado.
+        # Os fechamentos ficam na transação da sessão, confirmada por quem a
+        # criou (InvestmentManager.save_reports)
+        if not has_table(session, cls.__table__):
+            return
+        rows = []
+        for symbol, closes in history.items():
+            if not closes:
+                continue
+            existing = {
+                price_date
+                for (price_date,) in session.query(cls.date)
+                .filter(cls.symbol == symbol)
+                .filter(cls.date.in_([price_date for price_date, _ in closes]))
+            }
+            for price_date, close in closes:
+                if price_date not in existing:
+                    rows.append({"symbol": symbol, "date": price_date, "close": close})
+                    existing.add(price_date)
+        if rows:
+            # Históricos diários longos são gravados com um único insert em lote
+            session.execute(cls.__table__.insert(), rows)
+
+
+class CorporateAction(Base):
+    __tablename__ = "corporate_actions"
+    __table_args__ = (
+        Index("ix_corporate_actions_portfolio_id_symbol", "portfolio_id", "symbol"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    portfolio_id = Column(Integer, ForeignKey("portfolios.id"))
+    symbol = Column(String)
+    # Data com: negócios até esta data são ajustados
+    date = Column(Date)
+    type = Column(String)
+    # Desdobramento/grupamento: 2 = 1 para 2 / 2 para 1; bonificação: 0.1 = 10%
+    ratio = Column(Float)
+
+    portfolio = relationship("Portfolio", back_populates="corporate_actions")
+
+    FACTORS_KEY = "adjustment_factors"
+
+    def get_factor(self):
+        return get_factor(self.type, self.ratio)
+
+    @classmethod
+    def get_adjustment_factors(cls, session):
+        # Fatores de todos os portfólios, montados uma vez por sessão e
+        # descartados a cada flush
+        factors = session.info.get(cls.FACTORS_KEY)
+        if factors is None:
+            # Sem a tabela (banco anterior a ela), não há eventos a aplicar
+            actions = []
+            if has_table(session, cls.__table__):
+                actions = session.query(
+                    cls.portfolio_id, cls.symbol, cls.date, cls.type, cls.ratio
+                )
+            factors = AdjustmentFactors(
+                (
+                    portfolio_id,
+                    symbol,
+                    action_date,
+                    get_factor(type, ratio),
+                )
+                for portfolio_id, symbol, action_date, type, ratio in actions
             )
-            if self.brokerage_note.get_total_value_sale_day_trade() > 0
-            else 0
+            session.info[cls.FACTORS_KEY] = factors
+            listen_session_events(session, _after_flush, _after_rollback)
+        return factors
+
+
+class MonthlyTaxSummary(Base):
+    __tablename__ = "monthly_tax_summary"
+    __table_args__ = (UniqueConstraint("portfolio_id", "month", "category"),)
+
+    id = Column(Integer, primary_key=True)
+    portfolio_id = Column(Integer, ForeignKey("portfolios.id"))
+    month = Column(Date)
+    category = Column(String)
+
+    sales = Column(Float, default=0)
+    gain_acao = Column(Float, default=0)
+    gain_bdr = Column(Float, default=0)
+    gain_etf = Column(Float, default=0)
+    gain_free = Column(Float, default=0)
+    total_gain = Column(Float, default=0)
+    loss = Column(Float, default=0)
+    base_calculo = Column(Float, default=0)
+    imposto_devido = Column(Float, default=0)
+    irrf = Column(Float, default=0)
+    imposto_a_pagar = Column(Float, default=0)
+    payment_date = Column(Date, nullable=True)
+
+    # Colunas de cada tabela de IR e onde ficam gravadas
+    COLUMNS = {
+        TAX_CATEGORY_STOCK: [
+            ("Alienações", "sales"),
+            ("Lucro Ação", "gain_acao"),
+            ("Lucro BDR", "gain_bdr"),
+            ("Lucro ETF", "gain_etf"),
+            ("Lucro Isento", "gain_free"),
+            ("Lucro Total", "total_gain"),
+            ("Prejuizo a Compensar", "loss"),
+            ("Base de Cálculo", "base_calculo"),
+            ("Imposto Devido", "imposto_devido"),
+            ("I.R.R.F no mês", "irrf"),
+            ("Imposto a Pagar", "imposto_a_pagar"),
+        ],
+        TAX_CATEGORY_STOCK_DAY_TRADE: [
+            ("Alienações", "sales"),
+            ("Lucro Ação", "gain_acao"),
+            ("Lucro BDR", "gain_bdr"),
+            ("Lucro ETF", "gain_etf"),
+            ("Lucro Total", "total_gain"),
+            ("Prejuizo a Compensar", "loss"),
+            ("Base de Cálculo", "base_calculo"),
+            ("Imposto Devido", "imposto_devido"),
+            ("I.R.R.F no mês", "irrf"),
+            ("Imposto a Pagar", "imposto_a_pagar"),
+        ],
+        TAX_CATEGORY_FII: [
+            ("Alienações", "sales"),
+            ("Lucro", "total_gain"),
+            ("Prejuizo a Compensar", "loss"),
+            ("Base de Cálculo", "base_calculo"),
+            ("Imposto Devido", "imposto_devido"),
+            ("I.R.R.F no mês", "irrf"),
+            ("Imposto a Pagar", "imposto_a_pagar"),
+        ],
+    }
+
+    INVALID_FROM_KEY = "tax_summary_invalid_from"
+
+    @classmethod
+    def get_table(cls, portfolio, category, start_date, end_date, calculate):
+        # Lê os meses já apurados; se faltar algum, calcula o período com
+        # calculate(start_date, end_date) e grava o resultado
+        session = Session.object_session(portfolio)
+        months = [
+            date(year, month, 1) for year, month in iter_months(start_date, end_date)
+        ]
+        if (
+            session is None
+            or start_date == START_DATE
+            or not months
+            or not has_table(session, cls.__table__)
+        ):
+            return calculate(start_date, end_date)
+
+        rows = cls.query_months(
+            session, portfolio.id, category, months[0], months[-1]
         )
-        return irrf
+        if len(rows) == len(months):
+            return cls.to_table(category, rows)
 
-    def get_taxas(self):
-        return (
-            self.get_taxa_liquidacao()
-            + self.get_taxa_registro()
-            + self.get_taxa_termo_opcoes()
-            + self.get_taxa_ana()
-            + self.get_emolumentos()
-            + self.get_corretagem()
-            + self.get_taxa_custodia()
-            + self.get_impostos()
-            + self.get_outros()
-            + self.get_irrf()
+        table = calculate(start_date, end_date)
+        cls.store(session, portfolio.id, category, months, table)
+        return table
+
+    @classmethod
+    def query_months(cls, session, portfolio_id, category, first_month, last_month):
+        cls.apply_invalidation(session)
+
+        # Só colunas, sem passar pelo identity map
+        attributes = [attribute for _, attribute in cls.COLUMNS[category]]
+        query = (
+            session.query(
+                cls.month,
+                *[getattr(cls, attribute) for attribute in attributes],
+                cls.payment_date,
+            )
+            .filter(cls.portfolio_id == portfolio_id)
+            .filter(cls.category == category)
+            .filter(first_month <= cls.month)
+            .filter(cls.month <= last_month)
+            .order_by(cls.month)
+        )
+        return query.all()
+
+    @classmethod
+    def to_table(cls, category, rows):
+        import numpy as np
+        import pandas as pd
+
+        data = []
+        for row in rows:
+            values = {"Mês": row[0].strftime("%Y-%m")}
+            for i, (column, _) in enumerate(cls.COLUMNS[category]):
+                values[column] = row[i + 1]
+            values["Data de Pagamento"] = (
+                row[-1] if row[-1] is not None else np.nan
+            )
+            data.append(values)
+        return pd.DataFrame(data)
+
+    @classmethod
+    def store(cls, session, portfolio_id, category, months, table):
+        import pandas as pd
+
+        cls.apply_invalidation(session)
+
+        table_summary = cls.__table__
+        session.execute(
+            table_summary.delete()
+            .where(table_summary.c.portfolio_id == portfolio_id)
+            .where(table_summary.c.category == category)
+            .where(table_summary.c.month >= months[0])
+            .where(table_summary.c.month <= months[-1])
+        )
+
+        rows = []
+        for month, values in zip(months, table.to_dict("records")):
+            row = {"portfolio_id": portfolio_id, "month": month, "category": category}
+            for column, attribute in cls.COLUMNS[category]:
+                row[attribute] = float(values[column])
+            payment_date = values["Data de Pagamento"]
+            row["payment_date"] = None if pd.isnull(payment_date) else payment_date
+            rows.append(row)
+        # Sem commit: um relatório não confirma alterações pendentes de quem o
+        # chamou. Os meses ficam na transação da sessão até o commit dela
+        session.execute(table_summary.insert(), rows)
+
+    @classmethod
+    def invalidate(cls, session, from_date, portfolio_id, symbols=()):
+        # Só registra as datas; o DELETE é feito no próximo flush (ou leitura),
+        # para não gerar um comando por nota ou ativo inserido
+        invalid = session.info.setdefault(
+            cls.INVALID_FROM_KEY, {"portfolios": {}, "symbols": {}}
         )
+        listen_session_events(session, _after_flush, _after_rollback)
+        for key, values in [("portfolios", [portfolio_id]), ("symbols", symbols)]:
+            for value in values:
+                invalid_from = invalid[key].get(value)
+                if invalid_from is None or from_date < invalid_from:
+                    invalid[key][value] = from_date
+
+    @classmethod
+    def apply_invalidation(cls, session):
+        invalid = session.info.pop(cls.INVALID_FROM_KEY, None)
+        if invalid is None:
+            return
+
+        table_summary = cls.__table__
+        if not has_table(session, table_summary):
+            return
+        connection = session.connection()
+
+        # O PM de um ativo no motor ORM considera todos os portfólios: a
+        # limpeza vale também para os outros portfólios que negociam o ativo
+        portfolios = dict(invalid["portfolios"])
+        symbols = invalid["symbols"]
+        if symbols:
+            query = (
+                select(BrokerageNote.portfolio_id, Stock.symbol)
+                .join(Stock.brokerage_note)
+                .where(Stock.symbol.in_(list(symbols)))
+                .distinct()
+            )
+            for portfolio_id, symbol in connection.execute(query):
+                invalid_from = portfolios.get(portfolio_id)
+                if invalid_from is None or symbols[symbol] < invalid_from:
+                    portfolios[portfolio_id] = symbols[symbol]
+
+        for portfolio_id, from_date in portfolios.items():
+            # Notas do dia 1º entram no IRRF do mês anterior
+            from_date -= timedelta(days=1)
+            first_month = date(from_date.year, from_date.month, 1)
+            connection.execute(
+                table_summary.delete()
+                .where(table_summary.c.portfolio_id == portfolio_id)
+                .where(table_summary.c.month >= first_month)
+            )
+
+
+def has_table(session, table):
+    # Bancos criados antes de uma tabela existir só a recebem em create_db ou
+    # upgrade_db; até lá os relatórios seguem sem ela. Consultado uma vez por
+    # sessão
+    tables = session.info.setdefault(TABLES_KEY, {})
+    if table.name not in tables:
+        tables[table.name] = inspect(session.connection()).has_table(table.name)
+    return tables[table.name]
+
+
+def listen_session_events(session, after_flush, after_rollback):
+    # Os ganchos ficam na própria sessão, registrados quando ela passa a ter
+    # algum cache em session.info; outras sessões do processo não os executam
+    if not event.contains(session, "after_flush", after_flush):
+        event.listen(session, "after_flush", after_flush)
+        event.listen(session, "after_rollback", after_rollback)
+
+
+def _after_flush(session, flush_context):
+    MonthlyTaxSummary.apply_invalidation(session)
+    session.info.pop(CorporateAction.FACTORS_KEY, None)
+
 
-    def split(self, ratio = 1, type = 's'):
-        self.value = self.value * (ratio**(-1 if type == 's' or type == 'S' else 1))
-        self.quantity = self.quantity * (ratio**(1 if type == 's' or type == 'S' else -1))
+def _after_rollback(session):
+    session.info.pop(MonthlyTaxSummary.INVALID_FROM_KEY, None)
+    session.info.pop(CorporateAction.FACTORS_KEY, None)
 
 
 class User(Base):
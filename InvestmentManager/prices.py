@@ -0,0 +1,201 @@
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+
+class PriceProvider(ABC):
+    # Busca cotações em lote, em paralelo, com cache em memória.
+    # end_date None indica a cotação atual; caso contrário, o último
+    # fechamento antes de end_date.
+    def __init__(self, ttl=300, timeout=10, max_workers=8):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.cache = {}
+        self.last_known = {}
+
+    @abstractmethod
+    def fetch_price(self, symbol, end_date=None):
+        pass
+
+    @abstractmethod
+    def fetch_history(self, symbol, start_date, end_date):
+        # Fechamentos diários em [start_date, end_date): [(date, close), ...]
+        pass
+
+    def run_concurrently(self, function, symbols, *args):
+        # Executa function(symbol, *args) em paralelo; símbolos que falharem
+        # ou estourarem o timeout ficam de fora do resultado
+        if not symbols:
+            return {}
+        executor = ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(symbols))
+        )
+        futures = {
+            executor.submit(function, symbol, *args): symbol for symbol in symbols
+        }
+        wait(futures, timeout=self.timeout)
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+        results = {}
+        for future, symbol in futures.items():
+            if (
+                future.done()
+                and not future.cancelled()
+                and future.exception() is None
+            ):
+                results[symbol] = future.result()
+        return results
+
+    def get_history(self, symbols, start_date, end_date):
+        return self.run_concurrently(
+            self.fetch_history, list(dict.fromkeys(symbols)), start_date, end_date
+        )
+
+    def get_price(self, symbol, end_date=None):
+        return self.get_prices([symbol], end_date)[symbol]
+
+    def get_prices(self, symbols, end_date=None):
+        prices = {}
+        missing = []
+        now = time.monotonic()
+
+        for symbol in dict.fromkeys(symbols):
+            cached = self.cache.get((symbol, end_date))
+            # Fechamentos passados não mudam; só a cotação atual expira
+            if cached is not None and (
+                end_date is not None or now - cached[1] < self.ttl
+            ):
+                prices[symbol] = cached[0]
+            else:
+                missing.append(symbol)
+
+        results = self.run_concurrently(self.fetch_price, missing, end_date)
+        for symbol in missing:
+            key = (symbol, end_date)
+            if symbol in results:
+                price = float(results[symbol])
+                self.cache[key] = (price, time.monotonic())
+                self.last_known[key] = price
+                prices[symbol] = price
+            else:
+                # Falha ou timeout: usa a última cotação conhecida
+                prices[symbol] = self.last_known.get(key, float("nan"))
+
+        return prices
+
+    def clear_cache(self):
+        self.cache = {}
+
+
+class YahooPriceProvider(PriceProvider):
+    # yfinance e yahoo_fin só são importados quando uma cotação é buscada
+    def __init__(self, suffix=".SA", **kwargs):
+        super().__init__(**kwargs)
+        self.suffix = suffix
+
+    def fetch_price(self, symbol, end_date=None):
+        if end_date is None:
+            from yahoo_fin import stock_info
+
+            return stock_info.get_live_price(symbol + self.suffix)
+        import yfinance as yf
+
+        history = yf.Ticker(symbol + self.suffix).history(
+            start=(end_date - timedelta(days=6)).strftime("%Y-%m-%d"),
+            end=end_date.strftime("%Y-%m-%d"),
+            interval="1d",
+        )
+        return history["Close"].iloc[-1]
+
+    def fetch_history(self, symbol, start_date, end_date):
+        import yfinance as yf
+
+        history = yf.Ticker(symbol + self.suffix).history(
+            start=start_date.strftime("%Y-%m-%d"),
+            end=end_date.strftime("%Y-%m-%d"),
+            interval="1d",
+        )
+        return [
+            (index.date(), float(close)) for index, close in history["Close"].items()
+        ]
+
+    def get_history(self, symbols, start_date, end_date):
+        # Um único download para todos os ativos
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return {}
+        import yfinance as yf
+
+        try:
+            data = yf.download(
+                [symbol + self.suffix for symbol in symbols],
+                start=start_date.strftime("%Y-%m-%d"),
+                end=end_date.strftime("%Y-%m-%d"),
+                interval="1d",
+                auto_adjust=True,
+                progress=False,
+                timeout=self.timeout,
+            )
+        except Exception:
+            return super().get_history(symbols, start_date, end_date)
+
+        closes = data["Close"]
+        if not hasattr(closes, "columns"):
+            closes = closes.to_frame(symbols[0] + self.suffix)
+
+        history = {}
+        for symbol in symbols:
+            if symbol + self.suffix in closes.columns:
+                column = closes[symbol + self.suffix].dropna()
+                history[symbol] = [
+                    (index.date(), float(close)) for index, close in column.items()
+                ]
+        return history
+
+
+class FakePriceProvider(PriceProvider):
+    # Provedor local, sem rede: prices é {symbol: preço} ou {(symbol, data): preço}
+    def __init__(self, prices=None, **kwargs):
+        super().__init__(**kwargs)
+        self.prices = prices if prices is not None else {}
+        self.calls = []
+
+    def fetch_price(self, symbol, end_date=None):
+        self.calls.append((symbol, end_date))
+        if (symbol, end_date) in self.prices:
+            return self.prices[(symbol, end_date)]
+        return self.prices[symbol]
+
+    def fetch_history(self, symbol, start_date, end_date):
+        self.calls.append((symbol, start_date, end_date))
+        history = sorted(
+            (key[1], price)
+            for key, price in self.prices.items()
+            if isinstance(key, tuple)
+            and key[0] == symbol
+            and key[1] is not None
+            and start_date <= key[1] < end_date
+        )
+        if not history and symbol in self.prices:
+            # Preço único: tratado como o fechamento da véspera de end_date
+            history = [(end_date - timedelta(days=1), self.prices[symbol])]
+        return history
+
+
+default_price_provider = None
+
+
+def get_default_price_provider():
+    global default_price_provider
+    if default_price_provider is None:
+        default_price_provider = YahooPriceProvider()
+    return default_price_provider
+
+
+def set_default_price_provider(price_provider):
+    global default_price_provider
+    default_price_provider = price_provider
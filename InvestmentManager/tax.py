@@ -0,0 +1,14 @@
+class MonthlyTaxState:
+    # Estado carregado de um mês para o outro na apuração do IR:
+    # prejuízo a compensar e imposto devido acumulado
+    def __init__(self, aliquota):
+        self.aliquota = aliquota
+        self.loss = 0
+        self.imposto_devido_acumulado = 0
+
+    def advance(self, total_gain, irrf, gain_free=0):
+        self.loss += total_gain - gain_free
+        self.loss = self.loss if self.loss < 0 else 0
+        base_calculo = total_gain + self.loss - gain_free
+        base_calculo = base_calculo if base_calculo > 0 else 0
+        self.imposto_devido_acumulado += base_calculo * self.aliquota - irrf
@@ -0,0 +1,187 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+from .holdings import Holdings, get_last_values
+
+from .prices import get_default_price_provider
+
+
+def get_close_matrix(history, symbols, dates):
+    # history: [(symbol, date, close)] em ordem de data. Devolve as matrizes
+    # (datas x ativos) do último fechamento até cada data e da data desse
+    # fechamento, em dias desde 1970
+    shape = (len(dates), len(symbols))
+    if not history:
+        return np.full(shape, np.nan), np.full(shape, np.nan)
+
+    history_symbols, close_dates, closes = zip(*history)
+    columns = pd.Index(symbols).get_indexer(history_symbols)
+    close_dates = np.array(close_dates, dtype="datetime64[D]")
+    # Cada fechamento vale a partir do primeiro dia do índice desde a sua data
+    rows = np.searchsorted(dates, close_dates, side="left")
+
+    valid = (columns >= 0) & (rows < len(dates))
+    rows = rows[valid]
+    columns = columns[valid]
+    closes = np.array(closes, dtype=float)[valid]
+    close_days = close_dates[valid].astype("int64").astype(float)
+    return (
+        get_last_values(rows, columns, closes, shape),
+        get_last_values(rows, columns, close_days, shape),
+    )
+
+
+def get_closes(session, symbols, dates, price_provider=None, required=None, days=6):
+    # Fechamentos da tabela de preços. Os ativos sem fechamento nos days dias
+    # anteriores a alguma data de required (posição aberta) são baixados com
+    # uma única chamada ao provedor e gravados
+    if len(dates) == 0:
+        return np.full((0, len(symbols)), np.nan)
+    start_date = dates[0].astype(object) - timedelta(days=days)
+    end_date = dates[-1].astype(object) + timedelta(days=1)
+
+    history = models.Price.query_history(session, symbols, start_date, end_date)
+    closes, close_days = get_close_matrix(history, symbols, dates)
+
+    if price_provider is not None:
+        stale = np.isnan(close_days) | (
+            dates.astype("int64")[:, np.newaxis] - close_days > days
+        )
+        if required is not None:
+            stale &= required
+        missing = [symbol for symbol, gap in zip(symbols, stale.any(axis=0)) if gap]
+        if missing:
+            downloaded = price_provider.get_history(missing, start_date, end_date)
+            if models.has_table(session, models.Price.__table__):
+                models.Price.store(session, downloaded)
+                history = models.Price.query_history(
+                    session, symbols, start_date, end_date
+                )
+            else:
+                # Sem a tabela de preços, só os fechamentos baixados
+                history = sorted(
+                    (
+                        (symbol, close_date, close)
+                        for symbol, closes in downloaded.items()
+                        for close_date, close in closes
+                    ),
+                    key=lambda row: row[1],
+                )
+            closes, _ = get_close_matrix(history, symbols, dates)
+    return closes
+
+
+def align_prices(prices, symbols, dates):
+    # prices: DataFrame (datas x ativos) de fechamentos; cada data recebe o
+    # último fechamento até ela
+    index = pd.DatetimeIndex(dates)
+    prices = prices.reindex(columns=symbols)
+    prices.index = pd.DatetimeIndex(prices.index)
+    prices = prices.sort_index()
+    return (
+        prices.reindex(prices.index.union(index))
+        .ffill()
+        .reindex(index)
+        .to_numpy(dtype=float)
+    )
+
+
+class Valuation:
+    # Avaliação diária da carteira: as matrizes (datas x ativos) de Holdings e
+    # dos fechamentos são combinadas de uma vez, sem laço por dia ou ativo
+    def __init__(self, holdings, closes):
+        self.holdings = holdings
+        self.closes = closes
+
+        # Como em get_resume, só as posições compradas entram na avaliação
+        quantity = holdings.quantity
+        held = quantity > 0
+        self.market_value = np.where(held, quantity * closes, 0)
+        self.cost = np.where(held, quantity * holdings.price_average, 0)
+        self.unrealized = self.market_value - self.cost
+
+        # Retorno de cada dia das posições mantidas desde o dia anterior: as
+        # compras e vendas do dia são fluxo de caixa, não rendimento
+        start_value = self.market_value[:-1].sum(axis=1)
+        end_value = np.where(held[:-1], quantity[:-1] * closes[1:], 0).sum(axis=1)
+        self.returns = np.zeros(len(holdings.dates))
+        np.divide(
+            end_value - start_value,
+            start_value,
+            out=self.returns[1:],
+            where=start_value != 0,
+        )
+
+    @classmethod
+    def from_portfolio(
+        cls,
+        portfolio,
+        start_date=None,
+        end_date=None,
+        price_provider=None,
+        prices=None,
+        business_days=True,
+    ):
+        # prices: DataFrame (datas x ativos) de fechamentos. Sem ele, os
+        # fechamentos vêm da tabela de preços, completada pelo provedor
+        holdings = Holdings.from_portfolio(
+            portfolio,
+            start_date=start_date,
+            end_date=end_date,
+            business_days=business_days,
+        )
+        if prices is not None:
+            closes = align_prices(prices, holdings.symbols, holdings.dates)
+        else:
+            if portfolio.stock_exange != "BVMF":
+                price_provider = None
+            elif price_provider is None:
+                price_provider = get_default_price_provider()
+            closes = get_closes(
+                Session.object_session(portfolio),
+                holdings.symbols,
+                holdings.dates,
+                price_provider,
+                required=holdings.quantity > 0,
+            )
+        return cls(holdings, closes)
+
+    def get_market_value(self):
+        return pd.DataFrame(
+            self.market_value,
+            index=pd.DatetimeIndex(self.holdings.dates, name="Data"),
+            columns=pd.Index(self.holdings.symbols, name="Ticker"),
+        )
+
+    def get_unrealized(self):
+        return pd.DataFrame(
+            self.unrealized,
+            index=pd.DatetimeIndex(self.holdings.dates, name="Data"),
+            columns=pd.Index(self.holdings.symbols, name="Ticker"),
+        )
+
+    def get_table(self):
+        # Totais da carteira em cada dia, com as colunas de get_resume
+        cost = self.cost.sum(axis=1)
+        market_value = self.market_value.sum(axis=1)
+        unrealized = market_value - cost
+        unrealized_percent = np.full(len(cost), np.nan)
+        np.divide(unrealized, cost, out=unrealized_percent, where=cost > 0)
+        return pd.DataFrame(
+            {
+                "Valor Investido": cost,
+                "Valor Atual": market_value,
+                "Variação": unrealized,
+                "Variação (%)": unrealized_percent,
+                "Retorno": self.returns,
+                # Dias sem cotação não interrompem o retorno acumulado
+                "Retorno Acumulado": np.nancumprod(1 + self.returns) - 1,
+            },
+            index=pd.DatetimeIndex(self.holdings.dates, name="Data"),
+        )
@@ -0,0 +1,437 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+from .const import *
+
+from .functions import get_stock_type, add_business_days_array
+
+from .ledger import apply_trade
+
+from .corporate_actions import adjust_trades
+
+STOCK_TYPES = [STOCK_ACAO, STOCK_BDR, STOCK_ETF]
+
+
+def add_day_trades(trades):
+    # k-ésima compra casada com a k-ésima venda do mesmo ativo na nota,
+    # em ordem de id, como em BrokerageNote.get_day_trades
+    columns = ["id", "note", "symbol", "qty", "price"]
+    buy = trades.loc[trades["op"] == STOCK_BUY, columns].copy()
+    sale = trades.loc[trades["op"] == STOCK_SALE, columns].copy()
+    buy["rank"] = buy.groupby(["note", "symbol"]).cumcount()
+    sale["rank"] = sale.groupby(["note", "symbol"]).cumcount()
+
+    pairs = buy.merge(sale, on=["note", "symbol", "rank"], suffixes=("_buy", "_sale"))
+    quantity = np.minimum(pairs["qty_buy"], pairs["qty_sale"]).to_numpy()
+    gain = ((pairs["price_sale"] - pairs["price_buy"]) * quantity).to_numpy()
+    sale_value = (pairs["price_sale"] * quantity).to_numpy()
+
+    ids = np.concatenate([pairs["id_buy"], pairs["id_sale"]])
+    for column, values in [
+        ("day_trade", quantity),
+        ("gain_day_trade", gain),
+        ("sale_value_day_trade", sale_value),
+    ]:
+        mapping = pd.Series(np.concatenate([values, values]), index=ids)
+        trades[column] = trades["id"].map(mapping).fillna(0).to_numpy()
+
+
+class VectorizedTaxEngine:
+    # Alternativa colunar a Portfolio.get_ir_table_*: carrega todos os negócios
+    # do portfólio em um DataFrame e apura o IR com operações agrupadas.
+    # Devolve as mesmas tabelas que os métodos do Portfolio.
+    def __init__(self, portfolio):
+        self.portfolio = portfolio
+        self.trades = None
+        self.notes = None
+
+    ## Trades
+
+    def get_trades(self):
+        if self.trades is None:
+            self.trades = self.load_trades()
+        return self.trades
+
+    def load_trades(self):
+        # O PM de cada ativo considera os negócios de todos os portfólios, como
+        # no livro de posições do motor ORM; só os negócios deste portfólio
+        # entram na apuração
+        session = Session.object_session(self.portfolio)
+        query = session.query(
+            models.Stock.id,
+            models.Stock.brokerage_note_id,
+            models.BrokerageNote.portfolio_id,
+            models.BrokerageNote.date,
+            models.Stock.symbol,
+            models.Stock.operation,
+            models.Stock.quantity,
+            models.Stock.value,
+        ).join(models.Stock.brokerage_note)
+        # Linhas lidas pela conexão, sem o processamento de resultados do ORM
+        trades = pd.DataFrame(
+            session.connection().execute(query.statement).fetchall(),
+            columns=["id", "note", "portfolio", "date", "symbol", "op", "qty", "price"],
+        )
+        trades = trades.sort_values(["date", "id"], kind="stable").reset_index(
+            drop=True
+        )
+        trades["date"] = pd.to_datetime(trades["date"])
+        trades["qty"] = trades["qty"].astype(float)
+        trades["price"] = trades["price"].astype(float)
+        adjust_trades(trades, models.CorporateAction.get_adjustment_factors(session))
+        self.add_price_average(trades)
+        trades = trades[trades["portfolio"] == self.portfolio.id].reset_index(
+            drop=True
+        )
+
+        types = {
+            symbol: get_stock_type(symbol, self.portfolio.stock_exange)
+            for symbol in trades["symbol"].unique()
+        }
+        trades["type"] = trades["symbol"].map(types)
+
+        add_day_trades(trades)
+
+        sale = trades["op"] == STOCK_SALE
+        swing_quantity = trades["qty"] - trades["day_trade"]
+        trades["sale_value"] = np.where(sale, trades["price"] * swing_quantity, 0)
+        trades["gain"] = np.where(
+            sale, (trades["price"] - trades["pm_before"]) * swing_quantity, 0
+        )
+        trades["month"] = trades["date"].dt.to_period("M")
+        return trades
+
+    def add_price_average(self, trades):
+        # PM corrente por ativo. Entre dois zeramentos da posição o custo
+        # evolui como C' = r * C + v * q, com r = Q_depois / Q_antes nas vendas,
+        # então C_n = R_n * soma(v * q / R) com R = produto acumulado de r
+        buy = (trades["op"] == STOCK_BUY).to_numpy()
+        sale = (trades["op"] == STOCK_SALE).to_numpy()
+        quantity = trades["qty"].to_numpy()
+        signed = np.where(buy, quantity, np.where(sale, -quantity, 0))
+
+        symbols = trades["symbol"]
+        position = pd.Series(signed).groupby(symbols).cumsum().to_numpy()
+        before = position - signed
+
+        closed = pd.Series(position == 0)
+        segment = (
+            closed.groupby(symbols).shift(fill_value=False).groupby(symbols).cumsum()
+        )
+        keys = [symbols, segment]
+
+        ratio = np.ones(len(trades))
+        np.divide(position, before, out=ratio, where=sale & (before != 0))
+        product = pd.Series(ratio).groupby(keys).cumprod().to_numpy()
+
+        terms = np.zeros(len(trades))
+        np.divide(
+            trades["price"].to_numpy() * quantity,
+            product,
+            out=terms,
+            where=buy & (product != 0),
+        )
+        cost = product * pd.Series(terms).groupby(keys).cumsum().to_numpy()
+
+        price_average = np.zeros(len(trades))
+        np.divide(cost, position, out=price_average, where=position > 0)
+
+        # Posições vendidas a descoberto não seguem a fórmula acima: refaz
+        # esses ativos negócio a negócio, com a mesma regra do livro de posições
+        oversold = pd.Series(position < 0).groupby(symbols).transform("any")
+        operations = trades["op"].to_numpy()
+        prices = trades["price"].to_numpy()
+        for symbol in symbols[oversold.to_numpy()].unique():
+            rows = np.flatnonzero((symbols == symbol).to_numpy())
+            state = (0, 0)
+            for row in rows:
+                state = apply_trade(
+                    state[0], state[1], operations[row], quantity[row], prices[row]
+                )
+                price_average[row] = state[0]
+
+        trades["pm"] = price_average
+
+        # PM usado em cada venda: posição ao fim do último pregão anterior
+        end_of_day = trades.groupby(["symbol", "date"], sort=False).tail(1)
+        pm_before = end_of_day.groupby("symbol")["pm"].shift(fill_value=0)
+        pm_before = pd.Series(
+            pm_before.to_numpy(),
+            index=pd.MultiIndex.from_frame(end_of_day[["symbol", "date"]]),
+        )
+        trades["pm_before"] = pm_before.reindex(
+            pd.MultiIndex.from_frame(trades[["symbol", "date"]])
+        ).to_numpy()
+
+    ## Notes
+
+    def get_notes(self):
+        # IRRF de cada nota rateado por categoria, como em
+        # BrokerageNote.get_irrf_swing_trade_* e get_irrf_day_trade_*
+        if self.notes is None:
+            session = Session.object_session(self.portfolio)
+            query = session.query(
+                models.BrokerageNote.id,
+                models.BrokerageNote.date,
+                models.BrokerageNote.irrf,
+            ).filter(models.BrokerageNote.portfolio_id == self.portfolio.id)
+            notes = pd.DataFrame(
+                session.connection().execute(query.statement).fetchall(),
+                columns=["note", "date", "irrf"],
+            )
+            notes["date"] = pd.to_datetime(notes["date"])
+            notes = notes.set_index("note")
+
+            sales = self.get_trades()
+            sales = sales[sales["op"] == STOCK_SALE]
+            stock = sales["type"].isin(STOCK_TYPES)
+            fii = sales["type"] == STOCK_FII
+
+            by_note = pd.DataFrame(
+                {
+                    "total": sales["sale_value"],
+                    "stock": sales["sale_value"].where(stock, 0),
+                    "fii": sales["sale_value"].where(fii, 0),
+                    "day_trade_stock": sales["gain_day_trade"].where(stock, 0),
+                    "day_trade_fii": sales["gain_day_trade"].where(fii, 0),
+                    "note": sales["note"],
+                }
+            ).groupby("note").sum()
+            by_note = by_note.reindex(notes.index, fill_value=0)
+
+            total = by_note["total"].to_numpy()
+            share = np.zeros(len(notes))
+            irrf = notes["irrf"].to_numpy(dtype=float)
+            for column in ["stock", "fii"]:
+                share = np.zeros(len(notes))
+                np.divide(by_note[column].to_numpy(), total, out=share, where=total > 0)
+                notes["irrf_swing_trade_" + column] = irrf * share
+            notes["irrf_day_trade_stock"] = (
+                by_note["day_trade_stock"] * ALIQ_IRRF_DAY_TRADE
+            )
+            notes["irrf_day_trade_fii"] = by_note["day_trade_fii"] * ALIQ_IRRF_DAY_TRADE
+            self.notes = notes
+        return self.notes
+
+    def get_irrf_by_month(self):
+        # Uma nota do dia 1º também entra no mês anterior, como em
+        # Portfolio.get_brokerage_notes_for_irrf
+        notes = self.get_notes()
+        month = notes["date"].dt.to_period("M")
+        first_day = notes["date"].dt.day == 1
+        columns = {
+            TAX_CATEGORY_STOCK: notes["irrf_swing_trade_stock"],
+            TAX_CATEGORY_STOCK_DAY_TRADE: notes["irrf_day_trade_stock"],
+            TAX_CATEGORY_FII: notes["irrf_day_trade_fii"]
+            + notes["irrf_swing_trade_fii"],
+        }
+        irrf = pd.DataFrame(columns)
+        irrf = pd.concat(
+            [
+                irrf.assign(month=month),
+                irrf[first_day].assign(month=month[first_day] - 1),
+            ]
+        )
+        return irrf.groupby("month").sum()
+
+    ## Monthly sweep
+
+    def get_first_date(self):
+        # Data do primeiro negócio, tirada dos negócios já carregados, sem
+        # carregar as notas pelo ORM como Portfolio.get_first_date
+        trades = self.get_trades()
+        if len(trades) == 0:
+            return None
+        return trades["date"].min().date()
+
+    def get_months(self, start_date, end_date):
+        first_date = self.get_first_date()
+        if first_date is None or start_date < first_date:
+            first_date = start_date
+        return pd.period_range(
+            pd.Period(year=first_date.year, month=first_date.month, freq="M"),
+            pd.Period(year=end_date.year, month=end_date.month, freq="M"),
+            freq="M",
+        )
+
+    def get_monthly(self, months, values):
+        # Soma por mês de cada coluna de values (DataFrame com coluna month)
+        monthly = values.groupby("month").sum()
+        return monthly.reindex(months, fill_value=0)
+
+    def sweep(self, total_gain, gain_free, irrf, aliquota):
+        # Mesmo estado de MonthlyTaxState, sem laço: o prejuízo a compensar
+        # L_n = min(L_{n-1} + x_n, 0) é S_n - max(0, S_1..S_n), S = cumsum(x)
+        accumulated = np.cumsum(total_gain - gain_free)
+        loss = accumulated - np.maximum.accumulate(np.maximum(accumulated, 0))
+        base_calculo = np.maximum(total_gain + loss - gain_free, 0)
+        imposto_devido_acumulado = np.cumsum(base_calculo * aliquota - irrf)
+
+        # Cada linha usa o estado de antes do mês
+        loss = np.concatenate([[0], loss[:-1]])
+        imposto_devido_acumulado = np.concatenate([[0], imposto_devido_acumulado[:-1]])
+        return loss, imposto_devido_acumulado
+
+    def get_payment_dates(self, months, imposto_devido, irrf):
+        due = (imposto_devido - irrf) >= MIN_IR_VALUE
+        ninth = [
+            date(period.year, period.month, 9) for period in (months[due] + 1)
+        ]
+        payment_dates = np.full(len(months), np.nan, dtype=object)
+        payment_dates[due] = add_business_days_array(ninth, 1).tolist()
+        return list(payment_dates)
+
+    def calculate_ir_table(
+        self, start_date, end_date, day_trade, types, aliquota, category
+    ):
+        if end_date < start_date:
+            # Período vazio: a tabela sai só com as colunas
+            return self.calculate_ir_table(
+                start_date, start_date, day_trade, types, aliquota, category
+            ).iloc[:0]
+
+        months = self.get_months(start_date, end_date)
+        trades = self.get_trades()
+        sales = trades[(trades["op"] == STOCK_SALE) & trades["type"].isin(types)]
+
+        if day_trade is None:
+            gain = sales["gain"] + sales["gain_day_trade"]
+            sale_value = sales["sale_value"] + sales["sale_value_day_trade"]
+        elif day_trade:
+            gain = sales["gain_day_trade"]
+            sale_value = sales["sale_value_day_trade"]
+        else:
+            gain = sales["gain"]
+            sale_value = sales["sale_value"]
+
+        values = {"month": sales["month"]}
+        for type_stock in types:
+            values["gain_{}".format(type_stock)] = gain.where(
+                sales["type"] == type_stock, 0
+            )
+            values["sale_{}".format(type_stock)] = sale_value.where(
+                sales["type"] == type_stock, 0
+            )
+        monthly = self.get_monthly(months, pd.DataFrame(values))
+        irrf = (
+            self.get_irrf_by_month()[category].reindex(months, fill_value=0).to_numpy()
+        )
+
+        gains = {
+            type_stock: monthly["gain_{}".format(type_stock)].to_numpy()
+            for type_stock in types
+        }
+        sales_value = sum(
+            monthly["sale_{}".format(type_stock)].to_numpy() for type_stock in types
+        )
+        total_gain = sum(gains.values())
+
+        gain_free = np.zeros(len(months))
+        if day_trade is False:
+            gain_free = np.where(
+                (gains[STOCK_ACAO] > 0)
+                & (monthly["sale_{}".format(STOCK_ACAO)].to_numpy() < 20000),
+                gains[STOCK_ACAO],
+                0,
+            )
+
+        loss, imposto_devido_acumulado = self.sweep(
+            total_gain, gain_free, irrf, aliquota
+        )
+        base_calculo = np.maximum(total_gain + loss - gain_free, 0)
+        imposto_devido = base_calculo * aliquota
+
+        rows = months >= pd.Period(
+            year=start_date.year, month=start_date.month, freq="M"
+        )
+        months = months[rows]
+        imposto_devido = imposto_devido[rows]
+        irrf = irrf[rows]
+
+        data = {
+            "Mês": [period.strftime("%Y-%m") for period in months],
+            "Alienações": sales_value[rows],
+        }
+        if day_trade is None:
+            data["Lucro"] = total_gain[rows]
+        else:
+            data["Lucro Ação"] = gains[STOCK_ACAO][rows]
+            data["Lucro BDR"] = gains[STOCK_BDR][rows]
+            data["Lucro ETF"] = gains[STOCK_ETF][rows]
+            if day_trade is False:
+                data["Lucro Isento"] = gain_free[rows]
+            data["Lucro Total"] = total_gain[rows]
+        data["Prejuizo a Compensar"] = loss[rows]
+        data["Base de Cálculo"] = base_calculo[rows]
+        data["Imposto Devido"] = imposto_devido
+        data["I.R.R.F no mês"] = irrf
+        data["Imposto a Pagar"] = (
+            imposto_devido - irrf + imposto_devido_acumulado[rows] % MIN_IR_VALUE
+        )
+        data["Data de Pagamento"] = self.get_payment_dates(
+            months, imposto_devido, irrf
+        )
+        return pd.DataFrame(data)
+
+    def get_ir_table_stock(self, start_date=START_DATE, end_date=None):
+        return models.MonthlyTaxSummary.get_table(
+            self.portfolio,
+            TAX_CATEGORY_STOCK,
+            start_date,
+            end_date or date.today(),
+            self.calculate_ir_table_stock,
+        )
+
+    def get_ir_table_stock_day_trade(self, start_date=START_DATE, end_date=None):
+        return models.MonthlyTaxSummary.get_table(
+            self.portfolio,
+            TAX_CATEGORY_STOCK_DAY_TRADE,
+            start_date,
+            end_date or date.today(),
+            self.calculate_ir_table_stock_day_trade,
+        )
+
+    def get_ir_table_fii(self, start_date=START_DATE, end_date=None):
+        return models.MonthlyTaxSummary.get_table(
+            self.portfolio,
+            TAX_CATEGORY_FII,
+            start_date,
+            end_date or date.today(),
+            self.calculate_ir_table_fii,
+        )
+
+    def calculate_ir_table_stock(self, start_date, end_date):
+        return self.calculate_ir_table(
+            start_date,
+            end_date,
+            False,
+            STOCK_TYPES,
+            ALIQ_STOCK_BVMF,
+            TAX_CATEGORY_STOCK,
+        )
+
+    def calculate_ir_table_stock_day_trade(self, start_date, end_date):
+        return self.calculate_ir_table(
+            start_date,
+            end_date,
+            True,
+            STOCK_TYPES,
+            ALIQ_STOCK_DAY_TRADE_BVMF,
+            TAX_CATEGORY_STOCK_DAY_TRADE,
+        )
+
+    def calculate_ir_table_fii(self, start_date, end_date):
+        return self.calculate_ir_table(
+            start_date,
+            end_date,
+            None,
+            [STOCK_FII],
+            ALIQ_FII_BVMF,
+            TAX_CATEGORY_FII,
+        )
@@ -0,0 +1,137 @@
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from InvestmentManager import InvestmentManager
+from InvestmentManager.const import *
+
+ETF_SYMBOLS = ["BOVA11", "SMAL11", "IVVB11", "FIXA11", "GOAU11", "QBTC11"]
+
+
+def get_symbols(tickers, seed=0):
+    # Mistura de ações (3/4), FIIs (11), BDRs (33) e ETFs da lista conhecida
+    rnd = random.Random(seed)
+    symbols = []
+    etfs = list(ETF_SYMBOLS)
+    for i in range(tickers):
+        kind = i % 10
+        if kind == 9 and etfs:
+            symbols.append(etfs.pop(0))
+            continue
+        name = "".join(rnd.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(4))
+        if kind < 5:
+            symbols.append(name + rnd.choice(["3", "4"]))
+        elif kind < 8:
+            symbols.append(name + "11")
+        else:
+            symbols.append(name + "33")
+    return symbols
+
+
+def generate_portfolio(
+    path,
+    years=5,
+    tickers=20,
+    notes_per_month=8,
+    day_trade_ratio=0.1,
+    splits=2,
+    end_year=2023,
+    seed=0,
+):
+    # Cria um banco SQLite em path com um portfólio sintético montado pelos
+    # próprios modelos. Devolve {"notes": ..., "stocks": ..., "symbols": ...}
+    if os.path.exists(path):
+        os.remove(path)
+
+    rnd = random.Random(seed)
+    symbols = get_symbols(tickers, seed)
+    prices = {symbol: rnd.uniform(5, 150) for symbol in symbols}
+    positions = {symbol: 0 for symbol in symbols}
+
+    start_date = date(end_year - years + 1, 1, 2)
+    end_date = date(end_year, 12, 29)
+    total_days = (end_date - start_date).days
+    total_notes = years * 12 * notes_per_month
+    split_dates = sorted(
+        start_date + timedelta(days=rnd.randint(total_days // 4, total_days))
+        for _ in range(splits)
+    )
+
+    with InvestmentManager("sqlite:///" + path) as investments_manager:
+        investments_manager.create_db("benchmark@example.com", "Benchmark")
+        session = investments_manager.get_session()
+        portfolio = investments_manager.get_portfolio()
+
+        stocks = 0
+        for number in range(1, total_notes + 1):
+            note_date = start_date + timedelta(days=total_days * number // total_notes)
+            while note_date.weekday() >= 5:
+                note_date += timedelta(days=1)
+
+            while split_dates and split_dates[0] <= note_date:
+                split_dates.pop(0)
+                symbol = max(positions, key=positions.get)
+                portfolio.split(symbol, 2, "s", note_date - timedelta(days=1))
+                positions[symbol] *= 2
+                prices[symbol] /= 2
+
+            note = portfolio.add_brokerage_note(
+                number,
+                rnd.choice(["XP", "Clear", "Rico", "Inter"]),
+                note_date,
+                irrf=round(rnd.uniform(0, 2), 2),
+                taxa_liquidacao=round(rnd.uniform(0, 3), 2),
+                taxa_registro=round(rnd.uniform(0, 1), 2),
+                emolumentos=round(rnd.uniform(0, 1), 2),
+                corretagem=rnd.choice([0, 0, 4.9, 10]),
+                impostos=round(rnd.uniform(0, 0.5), 2),
+                outros=round(rnd.uniform(0, 0.2), 2),
+            )
+            for symbol in rnd.sample(symbols, min(len(symbols), rnd.randint(1, 5))):
+                prices[symbol] *= rnd.uniform(0.95, 1.06)
+                value = round(prices[symbol], 2)
+                if positions[symbol] > 0 and rnd.random() < 0.4:
+                    quantity = rnd.randint(1, positions[symbol])
+                    note.add_stock(symbol, quantity, value, STOCK_SALE)
+                    positions[symbol] -= quantity
+                    stocks += 1
+                else:
+                    quantity = rnd.randint(1, 50) * 10
+                    note.add_stock(symbol, quantity, value, STOCK_BUY)
+                    positions[symbol] += quantity
+                    stocks += 1
+                    if rnd.random() < day_trade_ratio:
+                        sale_value = round(value * rnd.uniform(0.97, 1.03), 2)
+                        sale_quantity = rnd.randint(1, quantity)
+                        note.add_stock(symbol, sale_quantity, sale_value, STOCK_SALE)
+                        positions[symbol] -= sale_quantity
+                        stocks += 1
+
+            if number % 500 == 0:
+                session.commit()
+        session.commit()
+
+    return {"notes": total_notes, "stocks": stocks, "symbols": symbols}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera um portfólio sintético")
+    parser.add_argument("path")
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--tickers", type=int, default=20)
+    parser.add_argument("--notes-per-month", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    info = generate_portfolio(
+        args.path,
+        years=args.years,
+        tickers=args.tickers,
+        notes_per_month=args.notes_per_month,
+        seed=args.seed,
+    )
+    print("{} notas, {} ativos em {}".format(info["notes"], info["stocks"], args.path))
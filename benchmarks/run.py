@@ -0,0 +1,255 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+from InvestmentManager import InvestmentManager
+from InvestmentManager import models
+from InvestmentManager.prices import FakePriceProvider
+
+from generate import generate_portfolio
+
+SIZES = {
+    "small": {"years": 2, "tickers": 10, "notes_per_month": 4},
+    "medium": {"years": 5, "tickers": 30, "notes_per_month": 8},
+    "large": {"years": 10, "tickers": 60, "notes_per_month": 16},
+}
+
+
+def get_price_history(info):
+    # Fechamentos diários sintéticos de todos os ativos, para a avaliação
+    dates = pd.bdate_range("2000-01-01", datetime.now().date())
+    return pd.DataFrame(
+        {
+            symbol: np.linspace(10.0 + i, 20.0 + i, len(dates))
+            for i, symbol in enumerate(info["symbols"])
+        },
+        index=dates,
+    )
+
+
+# Cada operação recebe (investments_manager, info, year, workdir)
+OPERATIONS = {
+    "calculate_pm": lambda im, info, year, workdir: [
+        im.calculate_pm(symbol) for symbol in info["symbols"]
+    ],
+    "resume": lambda im, info, year, workdir: im.resume(),
+    "resume_year": lambda im, info, year, workdir: im.resume(year),
+    "ir_table_stock_swing_trade": lambda im, info, year, workdir: (
+        im.ir_table_stock_swing_trade()
+    ),
+    "ir_table_stock_day_trade": lambda im, info, year, workdir: (
+        im.ir_table_stock_day_trade()
+    ),
+    "ir_table_fii": lambda im, info, year, workdir: im.ir_table_fii(),
+    "brokerage_notes": lambda im, info, year, workdir: im.brokerage_notes(),
+    "impost": lambda im, info, year, workdir: im.impost(),
+    "year_diff": lambda im, info, year, workdir: im.year_diff(year),
+    "to_excel": lambda im, info, year, workdir: im.to_excel(
+        os.path.join(workdir, "benchmark.xlsx")
+    ),
+    # Caminho completo: negócios, posições diárias e avaliação; os fechamentos
+    # sintéticos são gerados antes da medição
+    "valuation": lambda im, info, year, workdir: im.calculate_valuation(
+        prices=info["prices"]
+    ).get_table(),
+}
+
+
+def reset_caches(path):
+    # Resultados materializados e cotações gravadas são apagados antes de cada
+    # medição, para que todas comecem do zero
+    engine = sqlalchemy.create_engine("sqlite:///" + path)
+    with engine.begin() as connection:
+        for table in [models.MonthlyTaxSummary.__table__, models.Price.__table__]:
+            table.create(connection, checkfirst=True)
+            connection.execute(table.delete())
+    engine.dispose()
+
+
+def time_operation(path, operation, info, year, workdir, repeat, tax_engine):
+    runs = []
+    for _ in range(repeat):
+        reset_caches(path)
+        price_provider = FakePriceProvider(
+            {symbol: 10.0 + i for i, symbol in enumerate(info["symbols"])}
+        )
+        with InvestmentManager(
+            "sqlite:///" + path, price_provider=price_provider, tax_engine=tax_engine
+        ) as investments_manager:
+            start = time.perf_counter()
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    OPERATIONS[operation](investments_manager, info, year, workdir)
+            except Exception as e:
+                return {"error": "{}: {}".format(type(e).__name__, e)}
+            runs.append(time.perf_counter() - start)
+    return {
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "runs": runs,
+    }
+
+
+def run_benchmarks(sizes, operations, repeat=3, tax_engine="orm", seed=0):
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            path = os.path.join(workdir, "{}.sqlite".format(size))
+            start = time.perf_counter()
+            info = generate_portfolio(path, seed=seed, **SIZES[size])
+            generate_time = time.perf_counter() - start
+            info["prices"] = get_price_history(info)
+            year = 2023
+
+            print(
+                "{}: {} notas, {} ativos ({:.1f}s para gerar)".format(
+                    size, info["notes"], info["stocks"], generate_time
+                )
+            )
+            timings = {}
+            for operation in operations:
+                timings[operation] = time_operation(
+                    path, operation, info, year, workdir, repeat, tax_engine
+                )
+                print("  {:<28} {}".format(operation, format_timing(timings[operation])))
+
+            results.append(
+                {
+                    "size": size,
+                    "parameters": SIZES[size],
+                    "notes": info["notes"],
+                    "stocks": info["stocks"],
+                    "symbols": len(info["symbols"]),
+                    "generate": generate_time,
+                    "operations": timings,
+                }
+            )
+    return results
+
+
+def format_timing(timing):
+    if "error" in timing:
+        return "erro: " + timing["error"]
+    return "{:.4f}s (mediana {:.4f}s)".format(timing["min"], timing["median"])
+
+
+def get_environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+    }
+
+
+def get_errors(results):
+    # Operações que falharam contam como falha da execução, e não como uma
+    # medição ausente
+    return [
+        (size["size"], operation, timing["error"])
+        for size in results
+        for operation, timing in size["operations"].items()
+        if "error" in timing
+    ]
+
+
+def compare_results(results, baseline, threshold):
+    # Devolve as operações que ficaram mais de threshold vezes mais lentas
+    previous = {
+        (size["size"], operation): timing
+        for size in baseline["results"]
+        for operation, timing in size["operations"].items()
+    }
+    regressions = []
+    for size in results:
+        for operation, timing in size["operations"].items():
+            old = previous.get((size["size"], operation))
+            if not old or "min" not in old or "min" not in timing:
+                continue
+            ratio = timing["min"] / old["min"] if old["min"] > 0 else float("inf")
+            print(
+                "{:<8} {:<28} {:.4f}s -> {:.4f}s ({:.2f}x)".format(
+                    size["size"], operation, old["min"], timing["min"], ratio
+                )
+            )
+            if ratio > threshold:
+                regressions.append((size["size"], operation, ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks do InvestmentManager")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["small"])
+    parser.add_argument("--operations", nargs="+", choices=list(OPERATIONS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tax-engine", choices=["orm", "vectorized"], default="orm")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="arquivo JSON de saída")
+    parser.add_argument("--compare", help="JSON de uma execução anterior")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        args.sizes,
+        args.operations or list(OPERATIONS),
+        repeat=args.repeat,
+        tax_engine=args.tax_engine,
+        seed=args.seed,
+    )
+
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "results",
+        "benchmark-{}.json".format(datetime.now().strftime("%Y%m%d-%H%M%S")),
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(
+            {
+                "environment": get_environment(),
+                "tax_engine": args.tax_engine,
+                "repeat": args.repeat,
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+    print("Resultados em", output)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare_results(results, json.load(file), args.threshold)
+        for size, operation, ratio in regressions:
+            print("REGRESSÃO: {} {} {:.2f}x mais lento".format(size, operation, ratio))
+    errors = get_errors(results)
+    for size, operation, error in errors:
+        print("ERRO: {} {} {}".format(size, operation, error))
+    sys.exit(1 if regressions or errors else 0)
@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Dependências pesadas que só devem ser carregadas pelos recursos que as usam
+HEAVY_MODULES = [
+    "pandas",
+    "numpy",
+    "yfinance",
+    "yahoo_fin",
+    "tabula",
+    "holidays",
+    "tabulate",
+]
+
+# Cada cenário roda num interpretador novo; {path} é um banco sintético
+SCENARIOS = {
+    "import": "import InvestmentManager",
+    "calculate_pm": (
+        "from InvestmentManager import InvestmentManager\n"
+        "with InvestmentManager('sqlite:///' + {path!r}) as im:\n"
+        "    [im.calculate_pm(symbol) for symbol in {symbols!r}]"
+    ),
+}
+
+SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "time": elapsed,
+    "loaded": [module for module in {heavy!r} if module in sys.modules],
+}}))
+"""
+
+
+def time_scenario(code, repeat):
+    snippet = SNIPPET.format(code=code, heavy=HEAVY_MODULES)
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", snippet],
+            capture_output=True,
+            text=True,
+            cwd=ROOT,
+            check=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "min": min(run["time"] for run in runs),
+        "runs": [run["time"] for run in runs],
+        "loaded": runs[-1]["loaded"],
+    }
+
+
+def run_startup(scenarios, repeat=5):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "startup.sqlite")
+        info = None
+        for scenario in scenarios:
+            if "{path" in SCENARIOS[scenario] and info is None:
+                # Importado só aqui para não contaminar o processo medido
+                from generate import generate_portfolio
+
+                info = generate_portfolio(path, years=1, tickers=5, notes_per_month=4)
+            code = SCENARIOS[scenario].format(
+                path=path, symbols=info["symbols"] if info else []
+            )
+            results[scenario] = time_scenario(code, repeat)
+            print(
+                "{:<14} {:.4f}s  carregados: {}".format(
+                    scenario,
+                    results[scenario]["min"],
+                    ", ".join(results[scenario]["loaded"]) or "-",
+                )
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Tempo de inicialização do InvestmentManager"
+    )
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=0.75,
+        help="tempo máximo, em segundos, de 'import InvestmentManager'",
+    )
+    parser.add_argument("--output", help="arquivo JSON de saída")
+    args = parser.parse_args()
+
+    results = run_startup(args.scenarios, repeat=args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"budget": args.budget, "results": results}, file, indent=2)
+
+    failures = []
+    base = results.get("import")
+    if base is not None:
+        if base["min"] > args.budget:
+            failures.append(
+                "import InvestmentManager levou {:.4f}s (limite {:.4f}s)".format(
+                    base["min"], args.budget
+                )
+            )
+        if base["loaded"]:
+            failures.append(
+                "import InvestmentManager carregou " + ", ".join(base["loaded"])
+            )
+    for failure in failures:
+        print("FALHA:", failure)
+    sys.exit(1 if failures else 0)
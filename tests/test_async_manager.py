@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+
+from datetime import date
+
+import pytest
+
+from InvestmentManager.async_manager import AsyncInvestmentManager
+from InvestmentManager.const import *
+
+from test_brokerage_notes import new_note
+
+
+def test_timeout_and_close_order(tmp_path):
+    calls = []
+
+    def slow():
+        calls.append("slow")
+        time.sleep(0.3)
+        calls.append("slow done")
+
+    def queued():
+        calls.append("queued")
+
+    async def main():
+        manager = AsyncInvestmentManager(
+            "sqlite:///" + str(tmp_path / "db.sqlite"), timeout=0.05
+        )
+        await manager.run(manager.investments_manager.create_db, timeout=10)
+        close = manager.investments_manager.close
+        manager.investments_manager.close = lambda: calls.append("close") or close()
+
+        # A chamada que já começou vai até o fim; a que estoura o timeout
+        # ainda na fila não é executada
+        slow_task = asyncio.ensure_future(manager.run(slow))
+        await asyncio.sleep(0.01)
+        with pytest.raises(asyncio.TimeoutError):
+            await manager.run(queued)
+        with pytest.raises(asyncio.TimeoutError):
+            await slow_task
+
+        await manager.close()
+        assert calls == ["slow", "slow done", "close"]
+        assert not any(
+            thread.name.startswith("InvestmentManager")
+            for thread in threading.enumerate()
+        )
+
+    asyncio.run(main())
+
+
+def test_calls_run_in_order(tmp_path):
+    async def main():
+        async with AsyncInvestmentManager(
+            "sqlite:///" + str(tmp_path / "db.sqlite")
+        ) as manager:
+            await manager.run(manager.investments_manager.create_db)
+            add = manager.add_brokerage_notes(
+                [new_note(1, date(2023, 1, 10), STOCK_BUY, 100, 20.0)]
+            )
+            pm = manager.calculate_pm("PETR4")
+            report, position = await asyncio.gather(add, pm)
+        assert list(report["Status"]) == ["Importada"]
+        assert position == (20.0, 100)
+
+    asyncio.run(main())
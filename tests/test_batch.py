@@ -0,0 +1,51 @@
+from datetime import date
+import os
+
+from InvestmentManager import InvestmentManager
+from InvestmentManager.batch import run_batch_reports
+from InvestmentManager.const import *
+from InvestmentManager.prices import FakePriceProvider
+
+from test_brokerage_notes import new_note
+
+
+def new_db(path):
+    db_file = "sqlite:///" + str(path)
+    with InvestmentManager(db_file) as investments_manager:
+        investments_manager.create_db()
+        investments_manager.add_brokerage_notes(
+            [new_note(1, date(2023, 1, 10), STOCK_BUY, 100, 20.0)]
+        )
+    return db_file
+
+
+def test_targets_with_the_same_file_name(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    targets = [new_db(tmp_path / "a" / "prod.db"), new_db(tmp_path / "b" / "prod.db")]
+
+    report = run_batch_reports(
+        targets,
+        year=2023,
+        output_dir=str(tmp_path / "reports"),
+        max_workers=1,
+        price_provider=FakePriceProvider({"PETR4": 30.0}),
+        verbose=False,
+    )
+    assert list(report["Status"]) == ["OK", "OK"]
+    assert len(set(report["Arquivo"])) == 2
+    assert all(os.path.exists(filename) for filename in report["Arquivo"])
+
+
+def test_targets_with_the_same_excel_file(tmp_path):
+    db_file = new_db(tmp_path / "prod.db")
+
+    report = run_batch_reports(
+        [(db_file, 1), (db_file, 1, "prod-1-2023.xlsx")],
+        year=2023,
+        output_dir=str(tmp_path / "reports"),
+        max_workers=1,
+        reports=["ir"],
+        verbose=False,
+    )
+    assert list(report["Status"]) == ["OK", "Erro"]
@@ -0,0 +1,145 @@
+from datetime import date
+
+import pytest
+
+from sqlalchemy import text
+
+from InvestmentManager import InvestmentManager, models
+from InvestmentManager.const import *
+
+
+def new_note(number, note_date, operation, quantity, value):
+    note = {"number": number, "broker": "XP", "date": note_date, "irrf": 0}
+    for column in BROKERAGE_NOTE_FEES:
+        note[column] = 0
+    note["stocks"] = [
+        {
+            "symbol": "PETR4",
+            "quantity": quantity,
+            "value": value,
+            "operation": operation,
+        }
+    ]
+    return note
+
+
+@pytest.fixture
+def investments_manager(tmp_path):
+    investments_manager = InvestmentManager(
+        "sqlite:///" + str(tmp_path / "db.sqlite")
+    )
+    investments_manager.create_db()
+    investments_manager.add_brokerage_notes(
+        [
+            new_note(1, date(2022, 12, 1), STOCK_BUY, 2000, 20.0),
+            new_note(2, date(2023, 1, 10), STOCK_SALE, 1000, 25.0),
+            new_note(3, date(2023, 1, 20), STOCK_SALE, 1000, 30.0),
+        ]
+    )
+    yield investments_manager
+    investments_manager.close()
+
+
+def get_january(investments_manager):
+    table = investments_manager.get_portfolio().get_ir_table_stock(
+        date(2023, 1, 1), date(2023, 12, 31)
+    )
+    investments_manager.save_reports()
+    return table[table["Mês"] == "2023-01"].iloc[0]
+
+
+def test_delete_brokerage_note_rebuilds_ir_table(investments_manager, tmp_path):
+    january = get_january(investments_manager)
+    assert january["Alienações"] == pytest.approx(55000)
+    assert january["Lucro Total"] == pytest.approx(15000)
+    assert investments_manager.calculate_pm("PETR4") == (0, 0)
+
+    session = investments_manager.get_session()
+    stock_ids = [
+        stock.id
+        for note in investments_manager.get_portfolio().brokerage_notes
+        if note.number == 3
+        for stock in note.stocks
+    ]
+    investments_manager.delete_brokerage_note(3)
+
+    # A nota e os seus ativos saem do banco
+    assert session.query(models.BrokerageNote).filter_by(number=3).count() == 0
+    assert stock_ids
+    assert (
+        session.query(models.Stock).filter(models.Stock.id.in_(stock_ids)).count()
+        == 0
+    )
+    portfolio = investments_manager.get_portfolio()
+    assert [note.number for note in portfolio.brokerage_notes] == [1, 2]
+    # O livro de posições volta a ter as ações vendidas na nota removida
+    assert investments_manager.calculate_pm("PETR4") == (20.0, 1000)
+    assert list(portfolio.get_brokerage_notes()["Nota"]) == [1, 2]
+
+    # Mesma sessão: a nota removida não entra mais na apuração
+    january = get_january(investments_manager)
+    assert january["Alienações"] == pytest.approx(25000)
+    assert january["Lucro Total"] == pytest.approx(5000)
+
+    # Outro processo lê o resultado gravado, que também precisa estar correto
+    investments_manager.close()
+    with InvestmentManager("sqlite:///" + str(tmp_path / "db.sqlite")) as fresh:
+        january = get_january(fresh)
+        assert january["Alienações"] == pytest.approx(25000)
+        assert january["Lucro Total"] == pytest.approx(5000)
+
+
+def test_remove_stock(investments_manager):
+    portfolio = investments_manager.get_portfolio()
+    get_january(investments_manager)
+
+    brokerage_note = next(
+        note for note in portfolio.brokerage_notes if note.number == 3
+    )
+    assert brokerage_note.remove_stock(brokerage_note.stocks[0].id)
+    assert brokerage_note.stocks == []
+
+    january = get_january(investments_manager)
+    assert january["Alienações"] == pytest.approx(25000)
+
+
+def test_note_cache_follows_edits_and_rollback(investments_manager):
+    session = investments_manager.get_session()
+    note = new_note(4, date(2023, 2, 1), STOCK_BUY, 100, 20.0)
+    note["stocks"].append(
+        {"symbol": "PETR4", "quantity": 100, "value": 21.0, "operation": STOCK_SALE}
+    )
+    note["corretagem"] = 10.0
+    investments_manager.add_brokerage_notes([note])
+    brokerage_note = next(
+        note
+        for note in investments_manager.get_portfolio().brokerage_notes
+        if note.number == 4
+    )
+    buy, sale = brokerage_note.stocks
+    assert brokerage_note.get_day_trades()[buy.id][0] == 100
+    assert brokerage_note.get_fees()[buy.id]["corretagem"] == pytest.approx(
+        10.0 * 20 / 41
+    )
+
+    # Edição direta de um ativo, sem passar pelos métodos da nota
+    sale.quantity = 50
+    sale.value = 40.0
+    assert brokerage_note.get_day_trades()[buy.id] == pytest.approx(
+        (50, 1000, 2000)
+    )
+    assert brokerage_note.get_fees()[buy.id]["corretagem"] == pytest.approx(5.0)
+
+    # O rollback devolve os valores gravados
+    session.rollback()
+    assert brokerage_note.get_day_trades()[buy.id][0] == 100
+    assert brokerage_note.get_fees()[buy.id]["corretagem"] == pytest.approx(
+        10.0 * 20 / 41
+    )
+
+    # Alteração feita fora do ORM aparece depois do refresh
+    session.execute(
+        text("UPDATE stocks SET quantity = 30 WHERE id = :id"), {"id": sale.id}
+    )
+    session.refresh(sale)
+    assert brokerage_note.get_day_trades()[buy.id][0] == 30
@@ -0,0 +1,59 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import pytest
+
+from InvestmentManager import business_days
+from InvestmentManager.business_days import add_business_days, add_business_days_array
+
+
+CASES = [
+    # Fim de semana
+    (date(2023, 1, 6), 1, date(2023, 1, 9)),
+    (date(2023, 1, 7), 1, date(2023, 1, 9)),
+    # Tiradentes (sexta-feira) e fim de semana
+    (date(2023, 4, 20), 1, date(2023, 4, 24)),
+    (date(2023, 4, 20), 2, date(2023, 4, 25)),
+    # Virada do ano, com o feriado de 1º de janeiro
+    (date(2023, 12, 29), 1, date(2024, 1, 2)),
+    (date(2023, 12, 29), 2, date(2024, 1, 3)),
+    (date(2023, 1, 10), 0, date(2023, 1, 10)),
+]
+
+
+@pytest.mark.parametrize("start_date, days_to_add, expected", CASES)
+def test_add_business_days(start_date, days_to_add, expected):
+    assert add_business_days(start_date, days_to_add) == expected
+
+
+@pytest.mark.parametrize("days_to_add", [0, 1, 2])
+def test_add_business_days_array(days_to_add):
+    dates = [start_date for start_date, _, _ in CASES]
+    assert add_business_days_array(dates, days_to_add).tolist() == [
+        add_business_days(start_date, days_to_add) for start_date in dates
+    ]
+    assert len(add_business_days_array([], days_to_add)) == 0
+
+
+def test_calendar_is_built_once_across_threads(monkeypatch):
+    calendars = []
+
+    class SlowCalendar(business_days.BusinessDayCalendar):
+        def __init__(self, start_year, end_year):
+            calendars.append((start_year, end_year))
+            time.sleep(0.05)
+            super().__init__(start_year, end_year)
+
+    monkeypatch.setattr(business_days, "BusinessDayCalendar", SlowCalendar)
+    monkeypatch.setattr(business_days, "business_day_calendar", None)
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(
+            executor.map(
+                lambda _: add_business_days(date(2023, 12, 29), 1), range(8)
+            )
+        )
+    assert results == [date(2024, 1, 2)] * 8
+    assert calendars == [(2023, 2024)]
@@ -0,0 +1,98 @@
+from datetime import date
+
+import pytest
+
+from sqlalchemy import create_engine, inspect
+
+from InvestmentManager import InvestmentManager, models
+from InvestmentManager.const import *
+
+from test_brokerage_notes import new_note
+
+
+@pytest.fixture
+def investments_manager(tmp_path):
+    investments_manager = InvestmentManager(
+        "sqlite:///" + str(tmp_path / "db.sqlite")
+    )
+    investments_manager.create_db()
+    investments_manager.add_brokerage_notes(
+        [new_note(1, date(2023, 1, 10), STOCK_BUY, 100, 20.0)]
+    )
+    yield investments_manager
+    investments_manager.close()
+
+
+@pytest.mark.parametrize(
+    "ratio, type, price_average, quantity",
+    [
+        (2, "s", 10.0, 200),  # 1 -> 2
+        (2, "g", 40.0, 50),  # 2 -> 1
+        (0.1, "b", 20.0 / 1.1, 110),  # 10%
+    ],
+)
+def test_position_across_corporate_action(
+    investments_manager, ratio, type, price_average, quantity
+):
+    investments_manager.split("PETR4", ratio, type, date(2023, 2, 1))
+
+    # Antes do evento a posição já está na base atual; o custo não muda
+    assert investments_manager.calculate_pm(
+        "PETR4", end_date=date(2023, 1, 20)
+    ) == pytest.approx((price_average, quantity))
+    assert investments_manager.calculate_pm("PETR4") == pytest.approx(
+        (price_average, quantity)
+    )
+
+
+def test_sale_after_split(investments_manager):
+    investments_manager.split("PETR4", 2, "s", date(2023, 2, 1))
+    investments_manager.add_brokerage_notes(
+        [new_note(2, date(2023, 3, 10), STOCK_SALE, 200, 12.0)]
+    )
+
+    table = investments_manager.get_portfolio().get_ir_table_stock(
+        date(2023, 1, 1), date(2023, 12, 31)
+    )
+    assert table["Lucro Total"].iloc[2] == pytest.approx(400)
+    assert investments_manager.calculate_pm("PETR4") == (0, 0)
+
+
+def test_bonus_keeps_fractional_quantities(investments_manager):
+    investments_manager.add_brokerage_notes(
+        [new_note(2, date(2023, 1, 20), STOCK_SALE, 95, 20.0)]
+    )
+    investments_manager.split("PETR4", 0.1, "b", date(2023, 2, 1))
+    investments_manager.add_brokerage_notes(
+        [new_note(3, date(2023, 3, 10), STOCK_SALE, 5, 22.0)]
+    )
+
+    # 5 ações viram 5,5 ao mesmo custo; vendidas 5, a fração continua na
+    # posição com o mesmo PM
+    price_average, quantity = investments_manager.calculate_pm("PETR4")
+    assert quantity == pytest.approx(0.5)
+    assert price_average == pytest.approx(20.0 / 1.1)
+
+    table = investments_manager.get_portfolio().get_ir_table_stock(
+        date(2023, 1, 1), date(2023, 12, 31)
+    )
+    assert table["Lucro Total"].iloc[2] == pytest.approx(5 * (22.0 - 20.0 / 1.1))
+
+
+def test_positions_without_the_corporate_actions_table(tmp_path):
+    db_file = "sqlite:///" + str(tmp_path / "db.sqlite")
+    with InvestmentManager(db_file) as investments_manager:
+        investments_manager.create_db()
+        investments_manager.add_brokerage_notes(
+            [new_note(1, date(2023, 1, 10), STOCK_BUY, 100, 20.0)]
+        )
+    # Banco de uma versão anterior à tabela
+    engine = create_engine(db_file)
+    models.CorporateAction.__table__.drop(engine)
+
+    with InvestmentManager(db_file) as investments_manager:
+        assert investments_manager.calculate_pm("PETR4") == (20.0, 100)
+        investments_manager.export_brokerage_notes_stocks(
+            str(tmp_path / "trades.csv")
+        )
+    assert not inspect(engine).has_table("corporate_actions")
@@ -0,0 +1,68 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from InvestmentManager import InvestmentManager
+from InvestmentManager.const import *
+
+from test_brokerage_notes import new_note
+
+
+def test_export_keeps_adjusted_day_trade(tmp_path):
+    note = new_note(1, date(2023, 1, 10), STOCK_BUY, 5, 20.0)
+    note["stocks"].append(
+        {"symbol": "PETR4", "quantity": 5, "value": 21.0, "operation": STOCK_SALE}
+    )
+    with InvestmentManager("sqlite:///" + str(tmp_path / "db.sqlite")) as manager:
+        manager.create_db()
+        manager.add_brokerage_notes([note])
+        # Bonificação de 10%: 5 ações viram 5,5
+        manager.split("PETR4", 0.1, "b", date(2023, 2, 1))
+
+        filename = str(tmp_path / "trades.csv")
+        manager.export_brokerage_notes_stocks(filename)
+        expected = manager.get_portfolio().get_brokerage_notes_stocks()
+
+    exported = pd.read_csv(filename)
+    assert list(exported["Day-trade"]) == [5.5, 5.5]
+    assert list(exported["Day-trade"]) == list(expected["Day-trade"])
+
+
+def test_export_keeps_integer_quantities(tmp_path):
+    with InvestmentManager("sqlite:///" + str(tmp_path / "db.sqlite")) as manager:
+        manager.create_db()
+        manager.add_brokerage_notes(
+            [new_note(1, date(2023, 1, 10), STOCK_BUY, 5, 20.0)]
+        )
+        manager.split("PETR4", 2, "s", date(2023, 2, 1))
+
+        filename = str(tmp_path / "trades.csv")
+        manager.export_brokerage_notes_stocks(filename)
+        expected = manager.get_portfolio().get_brokerage_notes_stocks()
+
+    exported = pd.read_csv(filename)
+    assert exported["Quantidade"].dtype == expected["Quantidade"].dtype == "int64"
+    assert list(exported["Quantidade"]) == [10]
+
+
+def test_export_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    with InvestmentManager("sqlite:///" + str(tmp_path / "db.sqlite")) as manager:
+        manager.create_db()
+        manager.add_brokerage_notes(
+            [
+                new_note(number, date(2023, 1, number), STOCK_BUY, 100, 20.0)
+                for number in range(2, 7)
+            ]
+        )
+
+        filename = str(tmp_path / "trades.parquet")
+        assert manager.export_brokerage_notes_stocks(filename, chunk_size=2) == 5
+        expected = manager.get_portfolio().get_brokerage_notes_stocks()
+
+    exported = pd.read_parquet(filename)
+    assert list(exported.columns) == list(expected.columns)
+    assert exported["Quantidade"].dtype == "int64"
+    assert list(exported["Nota"]) == list(expected["Nota"])
+    pd.testing.assert_series_equal(exported["Valor Liquido"], expected["Valor Liquido"])
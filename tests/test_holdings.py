@@ -0,0 +1,41 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from test_positions import investments_manager
+
+
+@pytest.mark.parametrize("business_days", [True, False])
+def test_holdings_match_the_ledger(investments_manager, business_days):
+    holdings = investments_manager.calculate_holdings(
+        date(2023, 1, 2), date(2023, 4, 28), business_days=business_days
+    )
+    assert holdings.symbols == ["PETR4", "VALE3"]
+    assert holdings.dates[0] == np.datetime64("2023-01-02")
+    assert holdings.dates[-1] == np.datetime64("2023-04-28")
+
+    quantity = holdings.get_quantity()
+    price_average = holdings.get_price_average()
+    # Ao fim de cada dia: calculate_pm com end_date no dia seguinte
+    for day in [0, len(holdings.dates) // 2, -1]:
+        end_date = holdings.dates[day].astype(object) + timedelta(days=1)
+        for symbol in holdings.symbols:
+            expected = investments_manager.calculate_pm(symbol, end_date=end_date)
+            assert quantity[symbol].iloc[day] == expected[1]
+            assert price_average[symbol].iloc[day] == pytest.approx(expected[0])
+
+
+def test_holdings_on_business_days(investments_manager):
+    holdings = investments_manager.calculate_holdings(
+        date(2023, 2, 9), date(2023, 2, 14)
+    )
+    # Sábado e domingo ficam de fora; a venda de 10/02 entra no próprio dia
+    assert [str(day) for day in holdings.dates] == [
+        "2023-02-09",
+        "2023-02-10",
+        "2023-02-13",
+        "2023-02-14",
+    ]
+    assert list(holdings.get_quantity()["PETR4"]) == [400, 0, 0, 0]
+    assert list(holdings.to_frame()["Quantidade", "PETR4"]) == [400, 0, 0, 0]
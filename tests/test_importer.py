@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from InvestmentManager import InvestmentManager
+from InvestmentManager.importer import parse_float
+
+
+@pytest.fixture
+def investments_manager(tmp_path):
+    investments_manager = InvestmentManager(
+        "sqlite:///" + str(tmp_path / "db.sqlite")
+    )
+    investments_manager.create_db()
+    yield investments_manager
+    investments_manager.close()
+
+
+def test_load_missing_file(investments_manager, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        investments_manager.load_brokerage_notes(str(tmp_path / "missing.json"))
+
+
+def test_load_truncated_json(investments_manager, tmp_path):
+    filename = tmp_path / "notas.json"
+    note = {
+        "number": 1,
+        "broker": "XP",
+        "date": "2023-01-10",
+        "irrf": 0,
+        "stocks": [
+            {"symbol": "PETR4", "quantity": 100, "value": 20.0, "operation": "C"}
+        ],
+    }
+    filename.write_text(json.dumps([note, note])[:-20])
+    with pytest.raises(ValueError):
+        investments_manager.load_brokerage_notes(str(filename))
+    assert investments_manager.get_portfolio().brokerage_notes == []
+
+
+def test_load_invalid_records(investments_manager, tmp_path):
+    filename = tmp_path / "notas.jsonl"
+    filename.write_text('{"number": 1}\n{"number": \n')
+    report = investments_manager.load_brokerage_notes(str(filename))
+    assert list(report["Status"]) == ["Erro", "Erro"]
+
+
+def test_parse_float():
+    assert parse_float("1.234,56") == 1234.56
+    assert parse_float("1234,56") == 1234.56
+    assert parse_float("1234.56") == 1234.56
+    for value in ["1,234.56", "1,2,3", "1.23,4"]:
+        with pytest.raises(ValueError):
+            parse_float(value)
+
+
+def test_load_us_formatted_price(investments_manager, tmp_path):
+    filename = tmp_path / "notas.csv"
+    filename.write_text(
+        "number;broker;date;irrf;symbol;quantity;value;operation\n"
+        "1;XP;10/01/2023;0;PETR4;100;1,234.56;C\n"
+    )
+    report = investments_manager.load_brokerage_notes(str(filename))
+    assert list(report["Status"]) == ["Erro"]
+    assert investments_manager.get_portfolio().brokerage_notes == []
+
+
+def test_load_non_contiguous_note(investments_manager, tmp_path):
+    filename = tmp_path / "notas.csv"
+    filename.write_text(
+        "number;broker;date;irrf;symbol;quantity;value;operation\n"
+        "1;XP;10/01/2023;0;PETR4;100;20,00;C\n"
+        "2;XP;11/01/2023;0;VALE3;100;60,00;C\n"
+        "1;XP;10/01/2023;0;BBAS3;100;40,00;C\n"
+    )
+    report = investments_manager.load_brokerage_notes(str(filename))
+    assert list(report["Status"]) == ["Erro", "Importada", "Erro"]
+    assert "não são contíguas" in report["Erro"].iloc[0]
+    assert [
+        note.number for note in investments_manager.get_portfolio().brokerage_notes
+    ] == [2]
@@ -0,0 +1,118 @@
+from datetime import date
+import threading
+
+import pytest
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from InvestmentManager import InvestmentManager, models
+from InvestmentManager.const import *
+
+from test_brokerage_notes import new_note
+
+
+def new_manager(tmp_path, name):
+    investments_manager = InvestmentManager(
+        "sqlite:///" + str(tmp_path / name), instrument=True
+    )
+    investments_manager.create_db()
+    investments_manager.add_brokerage_notes(
+        [
+            new_note(1, date(2022, 12, 1), STOCK_BUY, 100, 20.0),
+            new_note(2, date(2023, 1, 10), STOCK_SALE, 100, 25.0),
+        ]
+    )
+    investments_manager.instrumentation.clear()
+    return investments_manager
+
+
+def test_instrumentations_are_kept_per_manager(tmp_path):
+    get_ir_table_stock = models.Portfolio.get_ir_table_stock
+    first = new_manager(tmp_path, "first.sqlite")
+    second = new_manager(tmp_path, "second.sqlite")
+
+    first.get_portfolio().get_ir_table_stock(date(2023, 1, 1), date(2023, 12, 31))
+    assert list(first.instrumentation.get_reports()["report"]) == [
+        "get_ir_table_stock"
+    ]
+    assert second.instrumentation.get_reports().empty
+
+    # Fechar um manager não desfaz a instrumentação do outro
+    first.close()
+    second.get_portfolio().get_ir_table_stock(date(2023, 1, 1), date(2023, 12, 31))
+    reports = second.instrumentation.get_reports()
+    assert list(reports["report"]) == ["get_ir_table_stock"]
+    assert reports["queries"].iloc[0] > 0
+
+    second.close()
+    assert models.Portfolio.get_ir_table_stock is get_ir_table_stock
+
+
+def test_other_managers_are_not_instrumented(tmp_path):
+    investments_manager = new_manager(tmp_path, "db.sqlite")
+    with InvestmentManager(
+        "sqlite:///" + str(tmp_path / "db.sqlite")
+    ) as other_manager:
+        portfolio = other_manager.get_portfolio()
+        portfolio.get_ir_table_stock(date(2023, 1, 1), date(2023, 12, 31))
+        assert "get_ir_table_stock" not in vars(portfolio)
+    assert investments_manager.instrumentation.get_reports().empty
+
+    portfolio = investments_manager.get_portfolio()
+    assert "get_ir_table_stock" in vars(portfolio)
+    investments_manager.close()
+    assert "get_ir_table_stock" not in vars(portfolio)
+
+
+def test_failed_query_is_measured(tmp_path):
+    investments_manager = new_manager(tmp_path, "db.sqlite")
+    instrumentation = investments_manager.instrumentation
+    session = investments_manager.get_session()
+
+    def call():
+        with pytest.raises(OperationalError):
+            session.execute(text("SELECT * FROM missing"))
+        session.rollback()
+        session.execute(text("SELECT 1"))
+
+    instrumentation.measure("get_resume", call)
+    report = instrumentation.get_reports().iloc[0]
+    assert report["queries"] == 2
+    assert instrumentation.start_key not in session.connection().info
+    investments_manager.close()
+
+
+def test_reports_are_measured_per_thread(tmp_path):
+    investments_manager = new_manager(tmp_path, "db.sqlite")
+    instrumentation = investments_manager.instrumentation
+    started = threading.Event()
+    finished = threading.Event()
+
+    def report():
+        def call():
+            started.set()
+            finished.wait(5)
+
+        instrumentation.measure("get_resume", call)
+
+    thread = threading.Thread(target=report)
+    thread.start()
+    started.wait(5)
+    # Um relatório em outra thread não absorve os desta
+    investments_manager.get_portfolio().get_ir_table_fii(
+        date(2023, 1, 1), date(2023, 12, 31)
+    )
+    finished.set()
+    thread.join()
+
+    assert list(instrumentation.get_reports()["report"]) == [
+        "get_ir_table_fii",
+        "get_resume",
+    ]
+    investments_manager.close()
+
+
+def test_instrument_requires_a_database():
+    with pytest.raises(ValueError):
+        InvestmentManager(instrument=True)
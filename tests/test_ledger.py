@@ -0,0 +1,95 @@
+from datetime import date
+
+import pytest
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+
+from InvestmentManager import InvestmentManager
+from InvestmentManager.const import *
+from InvestmentManager.ledger import LEDGER_KEY, _after_flush, get_position_ledger
+
+from test_brokerage_notes import new_note
+
+
+def test_session_events_are_local(tmp_path):
+    with InvestmentManager("sqlite:///" + str(tmp_path / "db.sqlite")) as manager:
+        manager.create_db()
+        manager.add_brokerage_notes(
+            [new_note(1, date(2023, 1, 10), STOCK_BUY, 100, 20.0)]
+        )
+        assert manager.calculate_pm("PETR4") == (20.0, 100)
+
+        # O livro é descartado no flush da própria sessão
+        manager.get_portfolio().add_brokerage_note(
+            2, "XP", date(2023, 2, 10)
+        ).add_stock("PETR4", 100, 30.0, STOCK_BUY)
+        assert manager.calculate_pm("PETR4") == (25.0, 200)
+        assert event.contains(manager.get_session(), "after_flush", _after_flush)
+
+    other = sessionmaker(bind=create_engine("sqlite://"))()
+    assert not event.contains(other, "after_flush", _after_flush)
+    assert not event.contains(Session, "after_flush", _after_flush)
+
+
+@pytest.fixture
+def investments_manager(tmp_path):
+    investments_manager = InvestmentManager(
+        "sqlite:///" + str(tmp_path / "db.sqlite")
+    )
+    investments_manager.create_db()
+    investments_manager.add_brokerage_notes(
+        [
+            new_note(1, date(2023, 1, 10), STOCK_BUY, 100, 20.0),
+            new_note(2, date(2023, 2, 10), STOCK_BUY, 100, 30.0),
+            # Venda de toda a posição e nova compra
+            new_note(3, date(2023, 3, 10), STOCK_SALE, 200, 35.0),
+            new_note(4, date(2023, 4, 10), STOCK_BUY, 50, 40.0),
+        ]
+    )
+    yield investments_manager
+    investments_manager.close()
+
+
+@pytest.mark.parametrize(
+    "start_date, end_date, position",
+    [
+        (START_DATE, date(2023, 1, 5), (0, 0)),
+        # end_date não entra no período
+        (START_DATE, date(2023, 1, 10), (0, 0)),
+        (START_DATE, date(2023, 1, 11), (20.0, 100)),
+        (START_DATE, date(2023, 3, 1), (25.0, 200)),
+        (START_DATE, date(2023, 3, 20), (0, 0)),
+        (START_DATE, date(2023, 12, 31), (40.0, 50)),
+        (date(2023, 2, 1), date(2023, 3, 1), (30.0, 100)),
+        (date(2023, 3, 20), date(2023, 12, 31), (40.0, 50)),
+        (date(2023, 5, 1), date(2023, 12, 31), (0, 0)),
+    ],
+)
+def test_position(investments_manager, start_date, end_date, position):
+    assert investments_manager.calculate_pm(
+        "PETR4", start_date=start_date, end_date=end_date
+    ) == pytest.approx(position)
+    assert investments_manager.calculate_pm(
+        "VALE3", start_date=start_date, end_date=end_date
+    ) == (0, 0)
+
+
+def test_ledger_follows_add_stock_and_rollback(investments_manager):
+    session = investments_manager.get_session()
+    assert investments_manager.calculate_pm("PETR4") == (40.0, 50)
+    ledger = get_position_ledger(session)
+
+    brokerage_note = next(
+        note
+        for note in investments_manager.get_portfolio().brokerage_notes
+        if note.number == 4
+    )
+    brokerage_note.add_stock("PETR4", 50, 50.0, STOCK_BUY)
+    assert investments_manager.calculate_pm("PETR4") == (45.0, 100)
+    assert get_position_ledger(session) is not ledger
+
+    # O negócio não confirmado sai da posição
+    session.rollback()
+    assert LEDGER_KEY not in session.info
+    assert investments_manager.calculate_pm("PETR4") == (40.0, 50)
@@ -0,0 +1,98 @@
+from datetime import date
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+from InvestmentManager import InvestmentManager, models
+from InvestmentManager.const import *
+
+from test_brokerage_notes import new_note
+
+
+def test_report_does_not_commit_caller_session(tmp_path):
+    db_file = "sqlite:///" + str(tmp_path / "db.sqlite")
+    with InvestmentManager(db_file) as investments_manager:
+        investments_manager.create_db()
+        investments_manager.add_brokerage_notes(
+            [
+                new_note(1, date(2022, 12, 1), STOCK_BUY, 100, 20.0),
+                new_note(2, date(2023, 1, 10), STOCK_SALE, 100, 25.0),
+            ]
+        )
+
+    session = sessionmaker(bind=create_engine(db_file))()
+    portfolio = session.get(models.Portfolio, 1)
+    portfolio.user.name = "Alterado"
+
+    portfolio.get_ir_table_stock(date(2023, 1, 1), date(2023, 12, 31))
+    session.rollback()
+
+    assert session.get(models.User, 1).name == "Name"
+    assert session.query(models.MonthlyTaxSummary).count() == 0
+    session.close()
+
+
+def test_invalidation_only_touches_portfolios_with_the_symbols(tmp_path):
+    db_file = "sqlite:///" + str(tmp_path / "db.sqlite")
+    with InvestmentManager(db_file) as investments_manager:
+        investments_manager.create_db()
+        user = investments_manager.get_session().get(models.User, 1)
+        user.add_portfolio()
+        user.add_portfolio()
+        investments_manager.get_session().commit()
+
+    notes = {
+        1: [new_note(1, date(2023, 1, 10), STOCK_BUY, 100, 20.0)],
+        2: [new_note(1, date(2023, 1, 10), STOCK_BUY, 100, 20.0)],
+        3: [new_note(1, date(2023, 1, 10), STOCK_BUY, 100, 20.0)],
+    }
+    notes[2][0]["stocks"][0]["symbol"] = "VALE3"
+    for portfolio_id, portfolio_notes in notes.items():
+        with InvestmentManager(db_file, portfolio_id=portfolio_id) as manager:
+            manager.add_brokerage_notes(portfolio_notes)
+            manager.get_portfolio().get_ir_table_stock(
+                date(2023, 1, 1), date(2023, 12, 31)
+            )
+            manager.save_reports()
+
+    with InvestmentManager(db_file) as investments_manager:
+        investments_manager.delete_brokerage_note(1)
+        session = investments_manager.get_session()
+        saved = {
+            portfolio_id
+            for (portfolio_id,) in session.query(
+                models.MonthlyTaxSummary.portfolio_id
+            ).distinct()
+        }
+    # Portfólio 3 também negocia PETR4; o 2 só tem VALE3
+    assert saved == {2}
+
+
+def test_reports_without_the_summary_table(tmp_path):
+    db_file = "sqlite:///" + str(tmp_path / "db.sqlite")
+    with InvestmentManager(db_file) as investments_manager:
+        investments_manager.create_db()
+        investments_manager.add_brokerage_notes(
+            [
+                new_note(1, date(2022, 12, 1), STOCK_BUY, 100, 20.0),
+                new_note(2, date(2023, 1, 10), STOCK_SALE, 100, 25.0),
+            ]
+        )
+    # Banco de uma versão anterior à tabela
+    engine = create_engine(db_file)
+    models.MonthlyTaxSummary.__table__.drop(engine)
+
+    with InvestmentManager(db_file) as investments_manager:
+        investments_manager.ir_table_stock_swing_trade(2023)
+        table = investments_manager.get_portfolio().get_ir_table_stock(
+            date(2023, 1, 1), date(2023, 12, 31)
+        )
+        assert table["Lucro Total"].iloc[0] == 500
+        investments_manager.delete_brokerage_note(2)
+    assert not inspect(engine).has_table("monthly_tax_summary")
+
+    with InvestmentManager(db_file) as investments_manager:
+        investments_manager.upgrade_db()
+        investments_manager.ir_table_stock_swing_trade(2023)
+        session = investments_manager.get_session()
+        assert session.query(models.MonthlyTaxSummary).count() == 12
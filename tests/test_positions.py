@@ -0,0 +1,69 @@
+from datetime import date
+
+import pytest
+
+from InvestmentManager import InvestmentManager
+from InvestmentManager.const import *
+
+from test_brokerage_notes import new_note
+
+
+NOTES = [
+    ("PETR4", 1, date(2022, 12, 1), STOCK_BUY, 300, 20.0),
+    ("VALE3", 2, date(2022, 12, 15), STOCK_BUY, 100, 60.0),
+    ("PETR4", 3, date(2023, 1, 10), STOCK_BUY, 100, 28.0),
+    ("PETR4", 4, date(2023, 2, 10), STOCK_SALE, 400, 30.0),
+    ("VALE3", 5, date(2023, 3, 10), STOCK_SALE, 40, 70.0),
+    ("PETR4", 6, date(2023, 4, 10), STOCK_BUY, 50, 25.0),
+]
+
+DATES = [
+    date(2022, 11, 1),
+    date(2022, 12, 1),
+    date(2023, 1, 11),
+    date(2023, 2, 10),
+    date(2023, 3, 31),
+    date(2023, 12, 31),
+]
+
+
+@pytest.fixture
+def investments_manager(tmp_path):
+    investments_manager = InvestmentManager(
+        "sqlite:///" + str(tmp_path / "db.sqlite")
+    )
+    investments_manager.create_db()
+    notes = []
+    for symbol, number, note_date, operation, quantity, value in NOTES:
+        note = new_note(number, note_date, operation, quantity, value)
+        note["stocks"][0]["symbol"] = symbol
+        notes.append(note)
+    investments_manager.add_brokerage_notes(notes)
+    investments_manager.split("VALE3", 2, "s", date(2023, 2, 1))
+    yield investments_manager
+    investments_manager.close()
+
+
+@pytest.mark.parametrize("start_date", [START_DATE, date(2023, 1, 1)])
+def test_positions_match_calculate_pm(investments_manager, start_date):
+    positions = investments_manager.calculate_positions(
+        DATES, start_date=start_date
+    )
+    assert list(positions.index) == ["PETR4", "VALE3"]
+    for symbol in positions.index:
+        for end_date in DATES:
+            price_average, quantity = investments_manager.calculate_pm(
+                symbol, start_date=start_date, end_date=end_date
+            )
+            assert positions.loc[symbol, ("Quantidade", end_date)] == quantity
+            assert positions.loc[
+                symbol, ("Preço Médio", end_date)
+            ] == pytest.approx(price_average)
+
+
+def test_positions_of_the_given_symbols(investments_manager):
+    positions = investments_manager.calculate_positions(
+        [date(2023, 12, 31)], symbols=["vale3", "ITSA4"]
+    )
+    assert list(positions.index) == ["VALE3", "ITSA4"]
+    assert list(positions["Quantidade", date(2023, 12, 31)]) == [160, 0]
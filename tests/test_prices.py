@@ -0,0 +1,81 @@
+from datetime import date
+
+import pytest
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+from InvestmentManager import InvestmentManager, models
+from InvestmentManager.const import *
+from InvestmentManager.prices import FakePriceProvider, PriceProvider
+
+from test_brokerage_notes import new_note
+
+
+def test_prices_are_saved_only_by_the_session_owner(tmp_path):
+    db_file = "sqlite:///" + str(tmp_path / "db.sqlite")
+    with InvestmentManager(db_file) as investments_manager:
+        investments_manager.create_db()
+        investments_manager.add_brokerage_notes(
+            [new_note(1, date(2022, 12, 1), STOCK_BUY, 100, 20.0)]
+        )
+
+    # Sessão do chamador: os fechamentos baixados não são confirmados
+    session = sessionmaker(bind=create_engine(db_file))()
+    portfolio = session.get(models.Portfolio, 1)
+    portfolio.get_resume(
+        end_date=date(2023, 1, 31), price_provider=FakePriceProvider({"PETR4": 30.0})
+    )
+    session.rollback()
+    assert session.query(models.Price).count() == 0
+    session.close()
+
+    with InvestmentManager(
+        db_file, price_provider=FakePriceProvider({"PETR4": 30.0})
+    ) as investments_manager:
+        investments_manager.resume(2023)
+
+    session = sessionmaker(bind=create_engine(db_file))()
+    assert session.query(models.Price.symbol, models.Price.close).all() == [
+        ("PETR4", 30.0)
+    ]
+    session.close()
+
+
+def test_price_provider_requires_fetch_methods():
+    class PriceOnlyProvider(PriceProvider):
+        def fetch_price(self, symbol, end_date=None):
+            return 1.0
+
+    with pytest.raises(TypeError):
+        PriceOnlyProvider()
+
+
+def test_reports_without_the_prices_table(tmp_path):
+    db_file = "sqlite:///" + str(tmp_path / "db.sqlite")
+    with InvestmentManager(db_file) as investments_manager:
+        investments_manager.create_db()
+        investments_manager.add_brokerage_notes(
+            [new_note(1, date(2022, 12, 1), STOCK_BUY, 100, 20.0)]
+        )
+    # Banco de uma versão anterior à tabela
+    engine = create_engine(db_file)
+    models.Price.__table__.drop(engine)
+
+    price_provider = FakePriceProvider(
+        {"PETR4": 30.0, ("PETR4", date(2022, 12, 23)): 30.0}
+    )
+    with InvestmentManager(
+        db_file, price_provider=price_provider
+    ) as investments_manager:
+        resume = investments_manager.get_portfolio().get_resume(
+            end_date=date(2022, 12, 31), price_provider=price_provider
+        )
+        assert resume["Valor Atual"].iloc[0] == 3000
+        investments_manager.resume(2022)
+
+        valuation = investments_manager.calculate_valuation(
+            date(2022, 12, 26), date(2022, 12, 30)
+        )
+        assert list(valuation.get_table()["Valor Atual"]) == [3000] * 5
+    assert not inspect(engine).has_table("prices")
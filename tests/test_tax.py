@@ -0,0 +1,115 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from InvestmentManager import InvestmentManager
+from InvestmentManager.const import *
+
+from test_brokerage_notes import new_note
+
+
+def get_table(tmp_path, notes, symbol="PETR4", end_date=date(2023, 4, 30)):
+    # notes: [(número, data, operação, quantidade, preço, irrf)]; os ativos
+    # terminados em 11 usados aqui são FIIs
+    brokerage_notes = []
+    for number, note_date, operation, quantity, value, irrf in notes:
+        note = new_note(number, note_date, operation, quantity, value)
+        note["irrf"] = irrf
+        note["stocks"][0]["symbol"] = symbol
+        brokerage_notes.append(note)
+
+    with InvestmentManager("sqlite:///" + str(tmp_path / "db.sqlite")) as manager:
+        manager.create_db()
+        manager.add_brokerage_notes(brokerage_notes)
+        portfolio = manager.get_portfolio()
+        if symbol.endswith("11"):
+            table = portfolio.get_ir_table_fii(date(2023, 1, 1), end_date)
+        else:
+            table = portfolio.get_ir_table_stock(date(2023, 1, 1), end_date)
+    return table.set_index("Mês")
+
+
+def test_exemption_month(tmp_path):
+    table = get_table(
+        tmp_path,
+        [
+            (1, date(2022, 12, 1), STOCK_BUY, 1000, 10.0, 0),
+            # Vendas abaixo de R$ 20 mil: lucro isento
+            (2, date(2023, 1, 10), STOCK_SALE, 500, 15.0, 0),
+            (3, date(2023, 2, 10), STOCK_SALE, 500, 50.0, 0),
+        ],
+    )
+    assert table.loc["2023-01", "Lucro Isento"] == pytest.approx(2500)
+    assert table.loc["2023-01", "Imposto a Pagar"] == 0
+    assert pd.isna(table.loc["2023-01", "Data de Pagamento"])
+
+    assert table.loc["2023-02", "Lucro Isento"] == 0
+    assert table.loc["2023-02", "Base de Cálculo"] == pytest.approx(20000)
+    assert table.loc["2023-02", "Imposto a Pagar"] == pytest.approx(3000)
+    assert table.loc["2023-02", "Data de Pagamento"] == date(2023, 3, 10)
+
+
+def test_fii_has_no_exemption(tmp_path):
+    table = get_table(
+        tmp_path,
+        [
+            (1, date(2022, 12, 1), STOCK_BUY, 1000, 10.0, 0),
+            (2, date(2023, 1, 10), STOCK_SALE, 500, 15.0, 0),
+        ],
+        symbol="HGLG11",
+    )
+    assert table.loc["2023-01", "Base de Cálculo"] == pytest.approx(2500)
+    assert table.loc["2023-01", "Imposto a Pagar"] == pytest.approx(500)
+
+
+@pytest.mark.parametrize("symbol, tax", [("PETR4", 3000), ("HGLG11", 4000)])
+def test_loss_carried_across_years(tmp_path, symbol, tax):
+    table = get_table(
+        tmp_path,
+        [
+            (1, date(2022, 6, 1), STOCK_BUY, 2000, 20.0, 0),
+            (2, date(2022, 11, 10), STOCK_SALE, 1000, 10.0, 0),
+            (3, date(2023, 3, 10), STOCK_SALE, 1000, 50.0, 0),
+        ],
+        symbol=symbol,
+    )
+    # O prejuízo de 2022 aparece desde o primeiro mês do período
+    assert list(table["Prejuizo a Compensar"].iloc[:3]) == [-10000] * 3
+    assert table.loc["2023-03", "Base de Cálculo"] == pytest.approx(20000)
+    assert table.loc["2023-03", "Imposto a Pagar"] == pytest.approx(tax)
+    assert table.loc["2023-04", "Prejuizo a Compensar"] == 0
+
+
+def test_tax_below_min_ir_value_accumulates(tmp_path):
+    table = get_table(
+        tmp_path,
+        [(1, date(2022, 12, 1), STOCK_BUY, 3000, 25.0, 0)]
+        + [
+            (number, date(2023, number - 1, 10), STOCK_SALE, 1000, 25.04, 0)
+            for number in [2, 3, 4]
+        ],
+    )
+    # R$ 6 por mês, abaixo de MIN_IR_VALUE: o valor acumulado (módulo
+    # MIN_IR_VALUE) entra no imposto a pagar do mês seguinte
+    assert list(table["Imposto Devido"].iloc[:3]) == pytest.approx([6, 6, 6])
+    assert list(table["Imposto a Pagar"]) == pytest.approx([6, 12, 8, 8])
+    assert table["Data de Pagamento"].isna().all()
+
+
+def test_irrf_from_note_on_the_first_of_next_month(tmp_path):
+    table = get_table(
+        tmp_path,
+        [
+            (1, date(2022, 12, 1), STOCK_BUY, 2000, 25.0, 0),
+            (2, date(2023, 1, 10), STOCK_SALE, 500, 25.04, 0.5),
+            (3, date(2023, 2, 1), STOCK_SALE, 500, 25.04, 0.25),
+            (4, date(2023, 2, 2), STOCK_SALE, 500, 25.04, 0.125),
+        ],
+    )
+    # A nota do dia 1º entra no IRRF do mês anterior; a do dia 2 não
+    assert table.loc["2023-01", "I.R.R.F no mês"] == pytest.approx(0.75)
+    assert table.loc["2023-02", "I.R.R.F no mês"] == pytest.approx(0.375)
+    assert table.loc["2023-02", "Imposto a Pagar"] == pytest.approx(
+        6 - 0.375 + (-0.75 % MIN_IR_VALUE)
+    )
@@ -0,0 +1,43 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from InvestmentManager import InvestmentManager
+from InvestmentManager.const import *
+
+from test_brokerage_notes import new_note
+
+
+def test_valuation_with_given_prices(tmp_path):
+    prices = pd.DataFrame(
+        {"PETR4": [19.0, 20.0, 22.0, 24.2], "VALE3": [60.0] * 4},
+        index=pd.to_datetime(["2022-12-29", "2023-01-02", "2023-01-03", "2023-01-05"]),
+    )
+    with InvestmentManager("sqlite:///" + str(tmp_path / "db.sqlite")) as manager:
+        manager.create_db()
+        manager.add_brokerage_notes(
+            [
+                new_note(1, date(2023, 1, 2), STOCK_BUY, 100, 20.0),
+                # Compra no meio do período: fluxo de caixa, não retorno
+                new_note(2, date(2023, 1, 4), STOCK_BUY, 100, 22.0),
+            ]
+        )
+        valuation = manager.calculate_valuation(
+            date(2023, 1, 2), date(2023, 1, 5), prices=prices
+        )
+
+    table = valuation.get_table()
+    assert list(table.index.strftime("%Y-%m-%d")) == [
+        "2023-01-02",
+        "2023-01-03",
+        "2023-01-04",
+        "2023-01-05",
+    ]
+    # 04/01 sem fechamento: vale o último, de 03/01
+    assert list(table["Valor Atual"]) == pytest.approx([2000, 2200, 4400, 4840])
+    assert list(table["Valor Investido"]) == pytest.approx([2000, 2000, 4200, 4200])
+    assert list(table["Variação"]) == pytest.approx([0, 200, 200, 640])
+    assert list(table["Retorno"]) == pytest.approx([0, 0.1, 0, 0.1])
+    assert list(table["Retorno Acumulado"]) == pytest.approx([0, 0.1, 0.1, 0.21])
+    assert list(valuation.get_market_value().columns) == ["PETR4"]
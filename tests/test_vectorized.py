@@ -0,0 +1,109 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from InvestmentManager import InvestmentManager, models
+from InvestmentManager.const import *
+
+
+def new_note(number, note_date, stocks, irrf=0):
+    # stocks: [(symbol, operation, quantity, value)]
+    note = {"number": number, "broker": "XP", "date": note_date, "irrf": irrf}
+    for column in BROKERAGE_NOTE_FEES:
+        note[column] = 0
+    note["corretagem"] = 5.0
+    note["stocks"] = [
+        {"symbol": symbol, "operation": operation, "quantity": quantity, "value": value}
+        for symbol, operation, quantity, value in stocks
+    ]
+    return note
+
+
+NOTES = {
+    1: [
+        new_note(
+            1,
+            date(2022, 11, 3),
+            [
+                ("PETR4", STOCK_BUY, 300, 20.0),
+                ("HGLG11", STOCK_BUY, 50, 160.0),
+                ("BOVA11", STOCK_BUY, 100, 110.0),
+            ],
+        ),
+        # Day trade e venda no mesmo dia
+        new_note(
+            2,
+            date(2023, 1, 10),
+            [
+                ("PETR4", STOCK_BUY, 100, 22.0),
+                ("PETR4", STOCK_SALE, 250, 24.0),
+            ],
+            irrf=1.5,
+        ),
+        new_note(3, date(2023, 2, 1), [("HGLG11", STOCK_SALE, 20, 170.0)]),
+        new_note(4, date(2023, 4, 12), [("PETR4", STOCK_SALE, 200, 11.0)]),
+        new_note(5, date(2023, 6, 5), [("BOVA11", STOCK_SALE, 100, 100.0)]),
+        new_note(6, date(2023, 9, 1), [("HGLG11", STOCK_SALE, 30, 150.0)]),
+    ],
+    # Segundo portfólio com o mesmo ativo: entra no PM do motor ORM
+    2: [
+        new_note(1, date(2022, 12, 1), [("PETR4", STOCK_BUY, 100, 30.0)]),
+        new_note(2, date(2023, 5, 2), [("PETR4", STOCK_SALE, 50, 15.0)]),
+    ],
+}
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    db_file = "sqlite:///" + str(tmp_path / "db.sqlite")
+    with InvestmentManager(db_file) as investments_manager:
+        investments_manager.create_db()
+        investments_manager.get_session().get(models.User, 1).add_portfolio()
+        investments_manager.get_session().commit()
+    for portfolio_id, notes in NOTES.items():
+        with InvestmentManager(db_file, portfolio_id=portfolio_id) as manager:
+            manager.add_brokerage_notes(notes)
+    with InvestmentManager(db_file) as investments_manager:
+        # Desdobramento 1 -> 2 entre a compra e a venda de abril
+        investments_manager.split("PETR4", 2, "s", date(2023, 3, 1))
+    return db_file
+
+
+def get_tables(db_file, tax_engine, portfolio_id):
+    # Cada motor em uma sessão própria, sem gravar os meses apurados
+    with InvestmentManager(
+        db_file, tax_engine=tax_engine, portfolio_id=portfolio_id
+    ) as investments_manager:
+        portfolio = investments_manager.get_portfolio()
+        source = investments_manager.get_tax_engine(portfolio) or portfolio
+        start_date, end_date = date(2023, 1, 1), date(2023, 12, 31)
+        return [
+            source.get_ir_table_stock(start_date, end_date),
+            source.get_ir_table_stock_day_trade(start_date, end_date),
+            source.get_ir_table_fii(start_date, end_date),
+        ]
+
+
+@pytest.mark.parametrize("portfolio_id", [1, 2])
+def test_engines_return_the_same_tables(db_file, portfolio_id):
+    orm = get_tables(db_file, "orm", portfolio_id)
+    vectorized = get_tables(db_file, "vectorized", portfolio_id)
+    for orm_table, vectorized_table in zip(orm, vectorized):
+        pd.testing.assert_frame_equal(
+            orm_table, vectorized_table, check_dtype=False, atol=1e-6
+        )
+
+
+def test_engines_share_the_saved_months(db_file):
+    # O motor que roda primeiro grava os meses; o outro os lê
+    with InvestmentManager(db_file, tax_engine="vectorized") as investments_manager:
+        investments_manager.ir_table_stock_swing_trade(2023)
+    orm = get_tables(db_file, "orm", 1)
+    with InvestmentManager(db_file) as investments_manager:
+        session = investments_manager.get_session()
+        session.query(models.MonthlyTaxSummary).delete()
+        session.commit()
+    pd.testing.assert_frame_equal(
+        orm[0], get_tables(db_file, "orm", 1)[0], check_dtype=False, atol=1e-6
+    )